@@ -1,51 +1,158 @@
 from flask import Flask, jsonify
-from pymongo import MongoClient
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
+from models.user import User
 from routes.auth import auth_bp
 from routes.crops import crops_bp
+from utils.indexes import ensure_indexes
+from utils.mongo import LazyDatabase
+from utils.background import run_in_background
+from utils.passwords import PasswordHasher
+from utils.cache import ResponseCache, TTLCache
+from utils.serialization import BSONJSONProvider
+from utils.events import OfferEventBus
+from utils.metrics import Metrics
+from utils.geo import Gazetteer
+from utils.ratelimit import RateLimiter, AdmissionControl, parse_rate
+from commands import register_commands
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     
-    # MongoDB connection with error handling
-    try:
-        mongo_client = MongoClient(
-            app.config['MONGODB_URI'],
-            serverSelectionTimeoutMS=5000  # 5 second timeout
-        )
-        # Test connection
-        mongo_client.admin.command('ping')
-        app.db = mongo_client[app.config['MONGODB_DB']]
-        print(f"✅ Connected to MongoDB: {app.config['MONGODB_DB']}")
-    except Exception as e:
-        print(f"❌ MongoDB connection failed: {e}")
-        raise e
+    # Client IPs (used by rate limits) come from X-Forwarded-For behind a proxy
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+    
+    # Serializes ObjectId and datetime in every JSON response
+    app.json = BSONJSONProvider(app)
+    
+    # Request timings and MongoDB command instrumentation
+    app.metrics = Metrics(
+        slow_query_ms=app.config['SLOW_QUERY_MS'],
+        measure_bytes=app.config['MONGO_METRICS_BYTES']
+    )
+    
+    # Index builds started on first use of MongoDB; /health reports their state
+    app.index_status = 'pending' if app.config['MONGODB_ENSURE_INDEXES'] else 'skipped'
+    
+    def build_indexes(db):
+        try:
+            ensure_indexes(db)
+            app.index_status = 'ready'
+        except Exception as e:
+            # Retried by the next /health check
+            app.logger.warning("Building indexes failed: %s", e)
+            app.index_status = 'failed'
+    
+    def on_connect(db):
+        if app.config['MONGODB_ENSURE_INDEXES']:
+            app.index_status = 'pending'
+            run_in_background(build_indexes, db)
+    
+    # MongoDB client built on first use in each worker, never at import: a
+    # briefly unreachable MongoDB slows the first requests instead of
+    # crash-looping worker boots
+    app.db = LazyDatabase(
+        app.config['MONGODB_URI'],
+        app.config['MONGODB_DB'],
+        on_connect=on_connect,
+        maxPoolSize=app.config['MONGODB_MAX_POOL_SIZE'],
+        minPoolSize=app.config['MONGODB_MIN_POOL_SIZE'],
+        maxIdleTimeMS=app.config['MONGODB_MAX_IDLE_TIME_MS'],
+        waitQueueTimeoutMS=app.config['MONGODB_WAIT_QUEUE_TIMEOUT_MS'],
+        serverSelectionTimeoutMS=app.config['MONGODB_SERVER_SELECTION_TIMEOUT_MS'],
+        event_listeners=[app.metrics.command_listener] if app.config['METRICS_ENABLED'] else []
+    )
+    
+    # Models shared by all requests
+    app.password_hasher = PasswordHasher(
+        rounds=app.config['BCRYPT_ROUNDS'],
+        workers=app.config['BCRYPT_POOL_WORKERS'],
+        max_pending=app.config['BCRYPT_MAX_PENDING'],
+        timeout=app.config['BCRYPT_TIMEOUT']
+    )
+    app.users = User(app.db, app.password_hasher)
+    app.gazetteer = Gazetteer.load(app.config['GAZETTEER_PATH'])
+    app.response_cache = ResponseCache(
+        maxsize=app.config['MARKETPLACE_CACHE_SIZE'],
+        ttl=app.config['MARKETPLACE_CACHE_TTL'],
+        redis_url=app.config['CACHE_REDIS_URL']
+    )
+    # TOKEN_CACHE_SIZE=0 verifies every token's signature on every request
+    app.token_cache = (
+        TTLCache(app.config['TOKEN_CACHE_SIZE'], app.config['TOKEN_CACHE_TTL'])
+        if app.config['TOKEN_CACHE_SIZE'] else None
+    )
+    app.offer_events = OfferEventBus(
+        queue_size=app.config['SSE_QUEUE_SIZE'],
+        max_subscribers=app.config['SSE_MAX_SUBSCRIBERS'],
+        source=app.config['OFFER_EVENTS_SOURCE']
+    )
+    
+    app.rate_limiter = RateLimiter(
+        {name: parse_rate(app.config[f'RATELIMIT_{name.upper()}']) for name in ('login', 'register', 'offer', 'offer_bulk')},
+        store_size=app.config['RATELIMIT_STORE_SIZE'],
+        redis_url=app.config['RATELIMIT_REDIS_URL']
+    )
+    app.admission = AdmissionControl(
+        app.config['MAX_CONCURRENT_REQUESTS'],
+        # Probes stay answerable under load; SSE streams have their own cap
+        exempt=('health_check', 'metrics', 'crops.offer_events')
+    )
     
     # Register blueprints
     app.register_blueprint(auth_bp, url_prefix='/api/user')
     app.register_blueprint(crops_bp, url_prefix='/api/crops')
     
+    # CLI commands
+    register_commands(app)
+    
+    # /metrics endpoint
+    if app.config['METRICS_ENABLED']:
+        app.metrics.init_app(app)
+    app.metrics.register_value('agripal_cache_hits_total', 'counter', 'Marketplace cache hits',
+                               lambda: app.response_cache.hits)
+    app.metrics.register_value('agripal_cache_misses_total', 'counter', 'Marketplace cache misses',
+                               lambda: app.response_cache.misses)
+    app.metrics.register_value('agripal_sse_subscribers', 'gauge', 'Open offer event streams',
+                               lambda: app.offer_events.stats()['subscribers'])
+    app.metrics.register_value('agripal_rate_limited_total', 'counter', 'Requests rejected by rate limits',
+                               lambda: app.rate_limiter.limited)
+    app.metrics.register_value('agripal_requests_in_flight', 'gauge', 'Requests being handled',
+                               lambda: app.admission.in_flight)
+    app.metrics.register_value('agripal_requests_shed_total', 'counter', 'Requests rejected by the concurrency cap',
+                               lambda: app.admission.rejected)
+    
+    # After the metrics hooks, so shed requests are still timed and counted
+    app.admission.init_app(app)
+    
     @app.route('/')
     def home():
         return "Hello, Agri-pal!"
     
     @app.route('/health')
     def health_check():
+        # Readiness: 200 once this worker can reach MongoDB, 503 until then.
+        # "/" answers without touching MongoDB, for liveness probes.
         try:
-            # Test MongoDB connection
             app.db.command('ping')
+            if app.index_status == 'failed':
+                on_connect(app.db.get())
             return jsonify({
                 "status": "healthy",
                 "database": "connected",
-                "message": "API is running"
+                "indexes": app.index_status,
+                "message": "API is running",
+                "cache": app.response_cache.stats()
             }), 200
         except Exception as e:
             return jsonify({
                 "status": "unhealthy",
                 "database": "disconnected",
+                "indexes": app.index_status,
                 "error": str(e)
-            }), 500
+            }), 503
     
     @app.errorhandler(404)
     def not_found(e):
@@ -0,0 +1,109 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from jobs.market_rollups import rebuild_market_rollups, summarize_rollups, day_of, _bucket_stages
+from benchmarks.seed import seed
+
+# Market analytics served from the market_daily rollups against the same
+# figures aggregated from crops and offers on every request. Timings only
+# mean something against a real MongoDB; --mongodb-uri memory:// checks that
+# both give the same result without one.
+
+def naive_rows(db, since):
+    # What the endpoint would have to run without rollups: both collections
+    # scanned for the window and grouped into the same buckets
+    crops = db.crops.aggregate([
+        {'$match': {
+            'created_at': {'$gte': since}, 'status': {'$ne': 'deleted'},
+            'price': {'$type': 'number'}, 'quantity': {'$type': 'number'}
+        }},
+        *_bucket_stages('', {
+            'listings': {'$sum': 1},
+            'ask_sum': {'$sum': '$price'},
+            'ask_min': {'$min': '$price'},
+            'ask_max': {'$max': '$price'},
+            'volume_kg': {'$sum': '$quantity'}
+        })
+    ])
+    offers = db.offers.aggregate([
+        {'$match': {'created_at': {'$gte': since}}},
+        {'$addFields': {'bid': {'$convert': {
+            'input': '$offered_price', 'to': 'double', 'onError': None, 'onNull': None
+        }}}},
+        {'$match': {'bid': {'$ne': None}}},
+        {'$lookup': {'from': 'crops', 'localField': 'crop_id', 'foreignField': '_id', 'as': 'crop'}},
+        {'$unwind': '$crop'},
+        {'$match': {'crop.status': {'$ne': 'deleted'}}},
+        *_bucket_stages('crop.', {
+            'bids': {'$sum': 1},
+            'bid_sum': {'$sum': '$bid'},
+            'best_bid': {'$max': '$bid'}
+        })
+    ])
+    
+    rows = {row['_id']: row for row in crops}
+    for row in offers:
+        rows.setdefault(row['_id'], {}).update(row)
+    return rows.values()
+
+def rollup_rows(db, since):
+    return db.market_daily.find({'day': {'$gte': since}}, {'_id': 0, 'rebuilt_at': 0, 'updated_at': 0})
+
+def _time_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {"median_ms": round(samples[len(samples) // 2], 2), "max_ms": round(samples[-1], 2)}
+
+def main():
+    from utils.mongo import connect
+    from utils.indexes import ensure_indexes
+    
+    parser = argparse.ArgumentParser(description="Compare market analytics from rollups with a live aggregation")
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='agripal_bench')
+    parser.add_argument('--seed', type=int, metavar='CROPS', help="drop the database and seed this many crops first")
+    parser.add_argument('--history-days', type=int, default=365, help="days the seeded listings are spread over")
+    parser.add_argument('--days', type=int, nargs='+', default=[7, 30, 365], help="analytics windows to measure")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    
+    client = connect(args.mongodb_uri)
+    seeded = None
+    if args.seed:
+        client.drop_database(args.db)
+        seeded = seed(client[args.db], args.seed, history_days=args.history_days)
+    db = client[args.db]
+    ensure_indexes(db)
+    
+    started = time.perf_counter()
+    buckets = rebuild_market_rollups(db)
+    rebuild_ms = round((time.perf_counter() - started) * 1000, 2)
+    
+    windows = {}
+    for days in args.days:
+        since = day_of(datetime.utcnow()) - timedelta(days=days - 1)
+        naive = summarize_rollups(naive_rows(db, since), 'crop_type')
+        rollup = summarize_rollups(rollup_rows(db, since), 'crop_type')
+        windows[f"{days}_days"] = {
+            "rollup_rows": db.market_daily.count_documents({'day': {'$gte': since}}),
+            "crops_scanned": db.crops.count_documents({'created_at': {'$gte': since}}),
+            "offers_scanned": db.offers.count_documents({'created_at': {'$gte': since}}),
+            "same_result": naive == rollup,
+            "naive": _time_ms(lambda: summarize_rollups(naive_rows(db, since), 'crop_type'), args.repeat),
+            "rollups": _time_ms(lambda: summarize_rollups(rollup_rows(db, since), 'crop_type'), args.repeat)
+        }
+    
+    print(json.dumps({
+        "seed": seeded,
+        "catalog": {name: db[name].estimated_document_count() for name in ('crops', 'offers', 'market_daily')},
+        "rebuild": {"buckets": buckets, "ms": rebuild_ms},
+        "windows": windows
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
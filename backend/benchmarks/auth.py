@@ -0,0 +1,98 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+import jwt
+from flask import Flask, jsonify
+from utils.cache import TTLCache
+from utils.verify_token import verify_token, _decode_token
+
+# Cost of authenticating a request, with and without the verified-token cache:
+# token decoding on its own, then per request through a bare Flask app whose
+# protected route does no other work, so JWT handling is all that differs.
+
+SECRET_KEY = 'benchmark-secret'
+
+def _per_op_us(fn, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return round((time.perf_counter() - started) / iterations * 1e6, 3)
+
+def _bench_app(cache_size):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.token_cache = TTLCache(cache_size, 300) if cache_size else None
+    
+    @app.route('/plain')
+    def plain():
+        return jsonify({"ok": True})
+    
+    @app.route('/protected')
+    @verify_token
+    def protected(current_user_id, current_user_role):
+        return jsonify({"ok": True})
+    
+    return app
+
+def _token(user):
+    return jwt.encode({
+        'id': f'{user:024x}',
+        'role': 'trader',
+        'exp': datetime.utcnow() + timedelta(hours=1)
+    }, SECRET_KEY, algorithm='HS256')
+
+def bench_decode(iterations, users):
+    tokens = [_token(user) for user in range(users)]
+    results = {}
+    for label, cache_size in (('uncached', 0), ('cached', users * 2)):
+        app = _bench_app(cache_size)
+        with app.test_request_context('/protected'):
+            for token in tokens:
+                _decode_token(token)
+            results[f"{label}_us"] = _per_op_us(lambda i: _decode_token(tokens[i % users]), iterations)
+    return results
+
+def bench_requests(iterations, users, rounds=5):
+    # Median time per request over interleaved rounds, which keeps the
+    # test client's own jitter from swamping the difference
+    tokens = [_token(user) for user in range(users)]
+    configs = {
+        'bare': (0, '/plain'),
+        'uncached': (0, '/protected'),
+        'cached': (users * 2, '/protected'),
+    }
+    clients = {label: (_bench_app(cache_size).test_client(), path)
+               for label, (cache_size, path) in configs.items()}
+    
+    def request(client, path, i):
+        return client.get(path, headers={'Authorization': 'Bearer ' + tokens[i % users]})
+    
+    for client, path in clients.values():
+        for i in range(min(iterations, 1000)):
+            request(client, path, i)
+    
+    samples = {label: [] for label in configs}
+    for _ in range(rounds):
+        for label, (client, path) in clients.items():
+            samples[label].append(_per_op_us(lambda i: request(client, path, i), iterations // rounds))
+    
+    results = {f"{label}_us": sorted(values)[len(values) // 2] for label, values in samples.items()}
+    for label in ('uncached', 'cached'):
+        results[f"{label}_auth_overhead_us"] = round(results[f"{label}_us"] - results["bare_us"], 3)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure authentication overhead with and without the token cache")
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--request-iterations', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=1000, help="distinct tokens in rotation")
+    args = parser.parse_args()
+    
+    print(json.dumps({
+        "decode": bench_decode(args.iterations, args.users),
+        "requests": bench_requests(args.request_iterations, args.users)
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
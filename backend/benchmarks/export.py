@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import resource
+import time
+from benchmarks.run import build_app
+
+# Full-catalog marketplace export: the NDJSON stream against building the
+# whole list and encoding it in one response, as the endpoint did before
+# streaming. Reports time to first byte, total time and how far the
+# process's resident memory grew while each ran. The catalog should live in a
+# MongoDB server; with memory:// it sits in this process too.
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def _rss_mb():
+    # Current resident set, read from /proc where it exists; elsewhere the
+    # lifetime peak is the best available
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class _MemoryWatch:
+    # Peak RSS growth over a phase, sampled as the export advances
+    def __init__(self):
+        self.start = _rss_mb()
+        self.peak = self.start
+    
+    def sample(self):
+        self.peak = max(self.peak, _rss_mb())
+    
+    def growth_mb(self):
+        self.sample()
+        return round(self.peak - self.start, 1)
+
+def export_stream(client, path):
+    watch = _MemoryWatch()
+    started = time.perf_counter()
+    response = client.get(path, buffered=False)
+    first_byte = None
+    size = 0
+    rows = 0
+    for i, chunk in enumerate(response.iter_encoded()):
+        if first_byte is None:
+            first_byte = time.perf_counter()
+        size += len(chunk)
+        rows += chunk.count(b'\n')
+        if i % 16 == 0:
+            watch.sample()
+    response.close()
+    finished = time.perf_counter()
+    return {
+        "status": response.status_code,
+        "rows": rows,
+        "mb": round(size / 2**20, 1),
+        "first_byte_ms": round(((first_byte or finished) - started) * 1000, 1),
+        "total_s": round(finished - started, 2),
+        "rss_growth_mb": watch.growth_mb()
+    }
+
+def export_buffered(app):
+    # The pre-streaming shape: every document in memory, then one JSON body
+    from routes.crops import MARKETPLACE_PROJECTION, MARKETPLACE_SORTS
+    
+    watch = _MemoryWatch()
+    started = time.perf_counter()
+    with app.app_context():
+        crops = list(app.db.crops.find({'status': 'active'}, MARKETPLACE_PROJECTION)
+                     .sort(MARKETPLACE_SORTS['newest']))
+        watch.sample()
+        body = app.json.dumps({"crops": crops}, separators=(',', ':')).encode('utf-8')
+        watch.sample()
+    finished = time.perf_counter()
+    rows = len(crops)
+    size = len(body)
+    del crops, body
+    return {
+        "rows": rows,
+        "mb": round(size / 2**20, 1),
+        "first_byte_ms": round((finished - started) * 1000, 1),
+        "total_s": round(finished - started, 2),
+        "rss_growth_mb": watch.growth_mb()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure memory and time to first byte of a full marketplace export")
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='agripal_bench')
+    parser.add_argument('--in-memory', action='store_true', help="use the in-process MongoDB stand-in")
+    parser.add_argument('--seed', type=int, metavar='CROPS', help="drop the crops and seed this many first, e.g. 500000")
+    parser.add_argument('--bcrypt-rounds', type=int, default=4)
+    parser.add_argument('--skip-buffered', action='store_true', help="only measure the stream")
+    args = parser.parse_args()
+    args.rate_limits = False
+    args.no_token_cache = False
+    
+    app = build_app(args)
+    seeded = None
+    if args.seed:
+        from benchmarks.seed import seed
+        for collection in ('users', 'crops', 'offers'):
+            app.db[collection].delete_many({})
+        seeded = seed(app.db, args.seed, offers_per_crop=0, bcrypt_rounds=args.bcrypt_rounds)
+    
+    # The stream runs first, so the buffered run cannot leave it a warm heap
+    report = {
+        "seed": seeded,
+        "rss_before_mb": round(_rss_mb(), 1),
+        "stream": export_stream(app.test_client(), '/api/crops/marketplace?stream=1')
+    }
+    if not args.skip_buffered:
+        report["buffered"] = export_buffered(app)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
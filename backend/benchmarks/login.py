@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from flask import current_app, request
+
+# Cost of a login in MongoDB commands, as counted by the metrics command
+# listener, and in time. The same app is measured as it is and with the
+# create_index the User model used to issue on every login, so the round trip
+# it saved shows up directly in the commands per login.
+
+USERNAME = 'login-benchmark'
+PASSWORD = 'login-benchmark'
+
+def build_app(args):
+    os.environ['MONGODB_URI'] = args.mongodb_uri
+    os.environ['MONGODB_DB'] = args.db
+    os.environ['BCRYPT_ROUNDS'] = str(args.bcrypt_rounds)
+    # The command listener does the counting
+    os.environ['METRICS_ENABLED'] = 'true'
+    # Every login comes from the same client
+    os.environ['RATELIMIT_LOGIN'] = 'off'
+    from app import create_app
+    return create_app()
+
+def _commands(app):
+    return Counter({key: histogram.count for key, histogram in app.metrics.commands.items()})
+
+def main():
+    parser = argparse.ArgumentParser(description="MongoDB commands and time per login")
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='agripal_bench')
+    parser.add_argument('--logins', type=int, default=500, help="logins per round")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help="cost of the benchmark user's hash")
+    args = parser.parse_args()
+    
+    app = build_app(args)
+    index_per_login = False
+    
+    @app.before_request
+    def create_index_per_login():
+        # What User(current_app.db) did on every login before the model was shared
+        if index_per_login and request.endpoint == 'auth.login':
+            current_app.db.users.create_index('username', unique=True)
+    
+    client = app.test_client()
+    app.db.users.delete_one({'username': USERNAME})
+    response = client.post('/api/user/register', json={
+        'username': USERNAME, 'password': PASSWORD, 'role': 'trader',
+        'full_name': 'Login Benchmark', 'phone': '0100000000', 'location': 'Giza'
+    })
+    if response.status_code != 201:
+        raise SystemExit(f"Could not register the benchmark user: {response.get_json()}")
+    
+    def login_round(count):
+        started = time.perf_counter()
+        for _ in range(count):
+            response = client.post('/api/user/login', json={'username': USERNAME, 'password': PASSWORD})
+            if response.status_code != 200:
+                raise SystemExit(f"Login failed with status {response.status_code}")
+        return (time.perf_counter() - started) / count * 1e6
+    
+    login_round(min(args.logins, 100))
+    
+    # Median of interleaved rounds, with the commands of every round counted
+    modes = ('shared_model', 'create_index_per_login')
+    samples = {mode: [] for mode in modes}
+    commands = {mode: Counter() for mode in modes}
+    for _ in range(args.rounds):
+        for mode in modes:
+            index_per_login = mode == 'create_index_per_login'
+            before = _commands(app)
+            samples[mode].append(login_round(args.logins))
+            commands[mode] += _commands(app) - before
+    
+    logins = args.rounds * args.logins
+    results = {}
+    for mode in modes:
+        results[mode] = {
+            "us_per_login": round(sorted(samples[mode])[len(samples[mode]) // 2], 1),
+            "commands_per_login": round(sum(commands[mode].values()) / logins, 2),
+            "commands": {f"{collection}.{command}": round(count / logins, 2)
+                         for (collection, command), count in sorted(commands[mode].items())}
+        }
+    app.db.users.delete_one({'username': USERNAME})
+    
+    print(json.dumps({
+        "backend": "in-memory" if args.mongodb_uri.startswith('memory://') else "mongodb",
+        "logins_per_round": args.logins,
+        "bcrypt_rounds": args.bcrypt_rounds,
+        **results,
+        "saved_us_per_login": round(results['create_index_per_login']['us_per_login'] - results['shared_model']['us_per_login'], 1)
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import random
+import time
+from types import SimpleNamespace
+from flask import Flask, jsonify
+from benchmarks.run import SEARCH_TERMS, NEAR
+from utils.metrics import Metrics
+
+# Cost of instrumentation on the marketplace: the same requests against an app
+# built with metrics (request timing hooks and the MongoDB command listener)
+# and one built with METRICS_ENABLED off. The response cache is off so every
+# request reaches the database and its commands are observed. End to end the
+# difference is small next to request jitter, so the hooks and the listener are
+# also timed on their own and combined into an estimate per request.
+
+def build_app(metrics_enabled):
+    from config import Config
+    from app import create_app
+    Config.METRICS_ENABLED = metrics_enabled
+    Config.MARKETPLACE_CACHE_SIZE = 0
+    return create_app()
+
+def marketplace_queries(count, rng):
+    queries = []
+    for _ in range(count):
+        kind = rng.choice(['page', 'search', 'nearby'])
+        if kind == 'page':
+            queries.append({})
+        elif kind == 'search':
+            queries.append({rng.choice(['crop_type', 'location']): rng.choice(SEARCH_TERMS)})
+        else:
+            queries.append({'near': rng.choice(NEAR), 'radius_km': rng.choice(['25', '50', '150'])})
+    return queries
+
+def _per_request_us(client, queries):
+    started = time.perf_counter()
+    for query in queries:
+        client.get('/api/crops/marketplace', query_string=query)
+    return (time.perf_counter() - started) / len(queries) * 1e6
+
+def bench_listener(iterations):
+    # started + succeeded for one command, as the driver calls them
+    listener = Metrics(slow_query_ms=float('inf')).command_listener
+    command = {'find': 'crops'}
+    started = time.perf_counter()
+    for request_id in range(iterations):
+        event = SimpleNamespace(command_name='find', command=command, connection_id=('localhost', 27017),
+                                request_id=request_id, duration_micros=500, reply={})
+        listener.started(event)
+        listener.succeeded(event)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def bench_hooks(iterations, rounds=5):
+    # The timing hooks of Metrics.init_app on a bare Flask app
+    def plain_app(instrumented):
+        app = Flask(__name__)
+        if instrumented:
+            Metrics(slow_query_ms=float('inf')).init_app(app)
+        
+        @app.route('/plain')
+        def plain():
+            return jsonify({"ok": True})
+        return app
+    
+    clients = {label: plain_app(label == 'instrumented').test_client() for label in ('bare', 'instrumented')}
+    samples = {label: [] for label in clients}
+    for _ in range(rounds):
+        for label, client in clients.items():
+            started = time.perf_counter()
+            for _ in range(iterations // rounds):
+                client.get('/plain')
+            samples[label].append((time.perf_counter() - started) / (iterations // rounds) * 1e6)
+    medians = {label: sorted(values)[len(values) // 2] for label, values in samples.items()}
+    return medians['instrumented'] - medians['bare']
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the overhead of request and MongoDB metrics")
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='agripal_bench')
+    parser.add_argument('--seed', type=int, metavar='CROPS', help="drop the database and seed this many crops first")
+    parser.add_argument('--requests', type=int, default=2000, help="marketplace requests per round")
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--random-seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=100000, help="listener and hook timings")
+    args = parser.parse_args()
+    
+    os.environ['MONGODB_URI'] = args.mongodb_uri
+    os.environ['MONGODB_DB'] = args.db
+    in_memory = args.mongodb_uri.startswith('memory://')
+    apps = {'bare': build_app(False), 'instrumented': build_app(True)}
+    
+    if args.seed:
+        from benchmarks.seed import seed
+        # The stand-in keeps a database per app, a server shares one
+        for app in apps.values() if in_memory else [apps['bare']]:
+            for collection in ('users', 'crops', 'offers'):
+                app.db[collection].delete_many({})
+            seed(app.db, args.seed, random_seed=args.random_seed)
+    
+    queries = marketplace_queries(args.requests, random.Random(args.random_seed))
+    metrics = apps['instrumented'].metrics
+    commands_before = sum(histogram.count for histogram in metrics.commands.values())
+    clients = {label: app.test_client() for label, app in apps.items()}
+    for client in clients.values():
+        _per_request_us(client, queries[:200])
+    
+    # Median of interleaved rounds, so drift in the machine or the server
+    # affects both alike
+    samples = {label: [] for label in clients}
+    for _ in range(args.rounds):
+        for label, client in clients.items():
+            samples[label].append(_per_request_us(client, queries))
+    results = {f"{label}_us": round(sorted(values)[len(values) // 2], 1) for label, values in samples.items()}
+    
+    overhead = results['instrumented_us'] - results['bare_us']
+    commands = sum(histogram.count for histogram in metrics.commands.values()) - commands_before
+    # Every round plus the warm-up went through the instrumented app
+    commands_per_request = commands / (args.rounds * len(queries) + 200)
+    listener_us = bench_listener(args.iterations)
+    hooks_us = bench_hooks(args.iterations // 5)
+    estimated_us = hooks_us + commands_per_request * listener_us
+    report = {
+        "backend": "in-memory" if in_memory else "mongodb",
+        "catalog": apps['bare'].db.crops.estimated_document_count(),
+        "requests_per_round": args.requests,
+        **results,
+        "overhead_us": round(overhead, 1),
+        "overhead_pct": round(overhead / results['bare_us'] * 100, 2),
+        "commands_per_request": round(commands_per_request, 2),
+        "listener_us_per_command": round(listener_us, 3),
+        "hooks_us_per_request": round(hooks_us, 3),
+        "estimated_overhead_us": round(estimated_us, 1),
+        "estimated_overhead_pct": round(estimated_us / results['bare_us'] * 100, 3)
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
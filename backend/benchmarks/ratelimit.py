@@ -0,0 +1,106 @@
+import argparse
+import json
+import threading
+import time
+from flask import Flask, jsonify
+from utils.ratelimit import LocalBuckets, RedisBuckets, RateLimiter, AdmissionControl, rate_limit, _client_keys
+
+# Cost of rate limiting and admission control: bucket operations on their own,
+# then per request through a bare Flask app, so the limiter is all that differs.
+
+# Never runs out, so every take() does the full refill-and-take path
+UNLIMITED = (10**9, 10**9)
+
+def _per_op_us(fn, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return round((time.perf_counter() - started) / iterations * 1e6, 3)
+
+def bench_store(store, iterations, keys, threads):
+    results = {
+        "same_key_us": _per_op_us(lambda i: store.take(['ip:127.0.0.1'], *UNLIMITED), iterations),
+        "distinct_keys_us": _per_op_us(lambda i: store.take([f'ip:10.0.{i % keys}'], *UNLIMITED), iterations)
+    }
+    
+    # Wall time per take with every thread hitting the store at once
+    per_thread = iterations // threads
+    workers = [
+        threading.Thread(target=lambda: [store.take([f'ip:10.1.{i % keys}'], *UNLIMITED) for i in range(per_thread)])
+        for _ in range(threads)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results[f"contended_{threads}_threads_us"] = round((time.perf_counter() - started) / (per_thread * threads) * 1e6, 3)
+    return results
+
+def _bench_app(max_concurrent):
+    app = Flask(__name__)
+    app.rate_limiter = RateLimiter({'bench': UNLIMITED})
+    app.admission = AdmissionControl(max_concurrent)
+    app.admission.init_app(app)
+    
+    @app.route('/plain')
+    def plain():
+        return jsonify({"ok": True})
+    
+    @app.route('/limited')
+    @rate_limit('bench')
+    def limited():
+        return jsonify({"ok": True})
+    
+    return app
+
+def bench_requests(iterations, rounds=5):
+    # Median time per request over interleaved rounds, which keeps the
+    # test client's own jitter (hundreds of us) from swamping the difference
+    configs = {
+        'bare': (0, '/plain'),
+        'rate_limited': (0, '/limited'),
+        'admission_control': (1000, '/plain'),
+        'both': (1000, '/limited'),
+    }
+    clients = {label: (_bench_app(max_concurrent).test_client(), path)
+               for label, (max_concurrent, path) in configs.items()}
+    for client, path in clients.values():
+        for _ in range(min(iterations, 1000)):
+            client.get(path)
+    
+    samples = {label: [] for label in configs}
+    for _ in range(rounds):
+        for label, (client, path) in clients.items():
+            samples[label].append(_per_op_us(lambda i: client.get(path), iterations // rounds))
+    
+    results = {f"{label}_us": sorted(values)[len(values) // 2] for label, values in samples.items()}
+    for label in ('rate_limited', 'admission_control', 'both'):
+        results[f"{label}_overhead_us"] = round(results[f"{label}_us"] - results["bare_us"], 3)
+    
+    # The limiter check alone, inside a request context
+    app = _bench_app(0)
+    with app.test_request_context('/limited'):
+        results["check_us"] = _per_op_us(lambda i: app.rate_limiter.check('bench', _client_keys()), iterations)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure rate limiter and admission control overhead")
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--request-iterations', type=int, default=20000)
+    parser.add_argument('--keys', type=int, default=10000, help="distinct client keys")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--redis-url', help="also measure the shared Redis store")
+    args = parser.parse_args()
+    
+    report = {
+        "local_store": bench_store(LocalBuckets(args.keys * 2), args.iterations, args.keys, args.threads),
+        "requests": bench_requests(args.request_iterations)
+    }
+    if args.redis_url:
+        report["redis_store"] = bench_store(RedisBuckets(args.redis_url), args.iterations // 10, args.keys, args.threads)
+    
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Request mixes, weights are relative
+WORKLOADS = {
+    'browse-heavy': {
+        'marketplace': 45,
+        'marketplace_search': 25,
+        'marketplace_nearby': 10,
+        'marketplace_next_page': 10,
+        'farmer_crops': 5,
+        'create_offer': 5
+    },
+    'bid-storm': {
+        'create_offer': 60,
+        'update_offer': 20,
+        'trader_offers': 15,
+        'marketplace': 5
+    },
+    'bulk-bid': {
+        'bulk_offers': 80,
+        'trader_offers': 20
+    },
+    'login-burst': {
+        'login': 80,
+        'marketplace': 20
+    }
+}
+
+SEARCH_TERMS = ['wheat', 'ri', 'tom', 'cairo', 'giz', 'aswan', 'on']
+NEAR = ['Cairo', 'Tanta', 'Assiut', '30.59,31.50', '25.69,32.64']
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def _summary(latencies):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "p50_ms": _percentile(values, 0.50),
+        "p95_ms": _percentile(values, 0.95),
+        "p99_ms": _percentile(values, 0.99),
+        "max_ms": values[-1] if values else None
+    }
+
+class Context:
+    # Ids and tokens sampled from the seeded data, shared by all client threads
+    def __init__(self, app, sample_size, rng):
+        import jwt
+        
+        db = app.db
+        secret = app.config['SECRET_KEY']
+        exp = datetime.utcnow() + timedelta(hours=1)
+        
+        def token(user):
+            payload = {'id': str(user['_id']), 'role': user['role'], 'exp': exp}
+            return {'Authorization': 'Bearer ' + jwt.encode(payload, secret, algorithm='HS256')}
+        
+        def sample(collection, match, size):
+            return list(db[collection].aggregate([{'$match': match}, {'$sample': {'size': size}}]))
+        
+        farmers = sample('users', {'role': 'farmer'}, sample_size)
+        traders = sample('users', {'role': 'trader'}, sample_size)
+        if not farmers or not traders:
+            raise SystemExit("No seeded users found, run with --seed")
+        
+        self.farmer_tokens = [token(user) for user in farmers]
+        self.trader_tokens = [token(user) for user in traders]
+        self.usernames = [user['username'] for user in farmers + traders]
+        self.crop_ids = [str(crop['_id']) for crop in sample('crops', {}, sample_size)]
+        self.offers = []
+        self.next_cursors = []
+        self.lock = threading.Lock()
+        self.rng = rng
+
+def op_marketplace(client, ctx, rng):
+    response = client.get('/api/crops/marketplace')
+    cursor = response.get_json(silent=True) or {}
+    if cursor.get('next'):
+        with ctx.lock:
+            ctx.next_cursors.append(cursor['next'])
+            del ctx.next_cursors[:-100]
+    return response
+
+def op_marketplace_search(client, ctx, rng):
+    params = {rng.choice(['crop_type', 'location']): rng.choice(SEARCH_TERMS)}
+    if rng.random() < 0.3:
+        params['min_price'] = rng.choice(['5', '10', '20'])
+    if rng.random() < 0.3:
+        params['sort'] = rng.choice(['price', '-price'])
+    return client.get('/api/crops/marketplace', query_string=params)
+
+def op_marketplace_nearby(client, ctx, rng):
+    params = {'near': rng.choice(NEAR), 'radius_km': rng.choice(['25', '50', '150'])}
+    return client.get('/api/crops/marketplace', query_string=params)
+
+def op_marketplace_next_page(client, ctx, rng):
+    with ctx.lock:
+        cursor = rng.choice(ctx.next_cursors) if ctx.next_cursors else None
+    if cursor is None:
+        return op_marketplace(client, ctx, rng)
+    return client.get('/api/crops/marketplace', query_string={'cursor': cursor})
+
+def op_farmer_crops(client, ctx, rng):
+    return client.get('/api/crops/', headers=rng.choice(ctx.farmer_tokens))
+
+def op_create_offer(client, ctx, rng):
+    headers = rng.choice(ctx.trader_tokens)
+    response = client.post(
+        f'/api/crops/{rng.choice(ctx.crop_ids)}/offer',
+        json={'offered_price': round(rng.uniform(2, 80), 2)},
+        headers=headers
+    )
+    if response.status_code == 201:
+        with ctx.lock:
+            ctx.offers.append((response.get_json()['offer']['_id'], headers))
+    return response
+
+def op_bulk_offers(client, ctx, rng):
+    # One trader bidding on 50 listings in a single request
+    return client.post(
+        '/api/crops/offers/bulk',
+        json={'offers': [
+            {'crop_id': crop_id, 'offered_price': round(rng.uniform(2, 80), 2)}
+            for crop_id in rng.sample(ctx.crop_ids, min(50, len(ctx.crop_ids)))
+        ]},
+        headers=rng.choice(ctx.trader_tokens)
+    )
+
+def op_update_offer(client, ctx, rng):
+    with ctx.lock:
+        offer = rng.choice(ctx.offers) if ctx.offers else None
+    if offer is None:
+        return op_create_offer(client, ctx, rng)
+    offer_id, headers = offer
+    return client.put(
+        f'/api/crops/offers/{offer_id}',
+        json={'offered_price': round(rng.uniform(2, 80), 2)},
+        headers=headers
+    )
+
+def op_trader_offers(client, ctx, rng):
+    return client.get('/api/crops/offers/', headers=rng.choice(ctx.trader_tokens))
+
+def op_login(client, ctx, rng):
+    from benchmarks.seed import PASSWORD
+    return client.post('/api/user/login', json={'username': rng.choice(ctx.usernames), 'password': PASSWORD})
+
+OPERATIONS = {
+    'marketplace': op_marketplace,
+    'marketplace_search': op_marketplace_search,
+    'marketplace_nearby': op_marketplace_nearby,
+    'marketplace_next_page': op_marketplace_next_page,
+    'farmer_crops': op_farmer_crops,
+    'create_offer': op_create_offer,
+    'bulk_offers': op_bulk_offers,
+    'update_offer': op_update_offer,
+    'trader_offers': op_trader_offers,
+    'login': op_login
+}
+
+def _db_commands(app):
+    # Total MongoDB commands seen by the command listener so far
+    return sum(histogram.count for histogram in app.metrics.commands.values())
+
+def run_workload(app, ctx, workload, requests, concurrency, random_seed, make_client=None):
+    # make_client builds one client per thread, Flask's test client by default
+    make_client = make_client or app.test_client
+    names = list(WORKLOADS[workload])
+    weights = [WORKLOADS[workload][name] for name in names]
+    results = []
+    results_lock = threading.Lock()
+    
+    def client_loop(worker, count):
+        rng = random.Random(random_seed + worker)
+        client = make_client()
+        local = []
+        for _ in range(count):
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            response = OPERATIONS[name](client, ctx, rng)
+            local.append((name, response.status_code, (time.perf_counter() - started) * 1000))
+        with results_lock:
+            results.extend(local)
+    
+    commands_before = _db_commands(app)
+    started = time.perf_counter()
+    per_worker, remainder = divmod(requests, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(client_loop, worker, per_worker + (1 if worker < remainder else 0))
+            for worker in range(concurrency)
+        ]
+        for future in futures:
+            future.result()
+    duration = time.perf_counter() - started
+    commands = _db_commands(app) - commands_before
+    
+    by_operation = {}
+    for name, status, latency in results:
+        by_operation.setdefault(name, {"latencies": [], "statuses": {}})
+        by_operation[name]["latencies"].append(latency)
+        statuses = by_operation[name]["statuses"]
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    
+    return {
+        "workload": workload,
+        "requests": len(results),
+        "concurrency": concurrency,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(results) / duration, 1) if duration else None,
+        "latency": _summary([latency for _, _, latency in results]),
+        # Counted by the command listener, against a MongoDB server or the in-memory stand-in
+        "db_ops_per_request": round(commands / len(results), 2) if commands else None,
+        "operations": {
+            name: dict(_summary(data["latencies"]), statuses=data["statuses"])
+            for name, data in sorted(by_operation.items())
+        }
+    }
+
+def build_app(args):
+    # Configure through the environment before the app module is imported
+    os.environ['MONGODB_URI'] = 'memory://' if args.in_memory else args.mongodb_uri
+    os.environ['MONGODB_DB'] = args.db
+    os.environ.setdefault('BCRYPT_ROUNDS', str(args.bcrypt_rounds))
+    if args.no_token_cache:
+        os.environ['TOKEN_CACHE_SIZE'] = '0'
+    if not args.rate_limits:
+        # All simulated clients share one IP and a few users
+        for name in ('LOGIN', 'REGISTER', 'OFFER', 'OFFER_BULK'):
+            os.environ[f'RATELIMIT_{name}'] = 'off'
+    
+    import app as app_module
+    return app_module.app
+
+def main():
+    parser = argparse.ArgumentParser(description="Run API workloads and report latency as JSON")
+    parser.add_argument('--workload', choices=sorted(WORKLOADS) + ['all'], default='all')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='agripal_bench')
+    parser.add_argument('--in-memory', action='store_true', help="use the in-process MongoDB stand-in (same as --mongodb-uri memory://)")
+    parser.add_argument('--seed', type=int, metavar='CROPS', help="drop the database and seed this many crops first")
+    parser.add_argument('--sample-size', type=int, default=500)
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help="cost for seeded users and new hashes")
+    parser.add_argument('--random-seed', type=int, default=42)
+    parser.add_argument('--no-token-cache', action='store_true', help="verify every token's signature on every request")
+    parser.add_argument('--rate-limits', action='store_true', help="keep the configured rate limits")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+    
+    app = build_app(args)
+    
+    seeded = None
+    if args.seed:
+        from benchmarks.seed import seed
+        for collection in ('users', 'crops', 'offers'):
+            app.db[collection].delete_many({})
+        started = time.perf_counter()
+        seeded = seed(app.db, args.seed, bcrypt_rounds=args.bcrypt_rounds, random_seed=args.random_seed)
+        seeded['duration_s'] = round(time.perf_counter() - started, 3)
+    
+    ctx = Context(app, args.sample_size, random.Random(args.random_seed))
+    workloads = sorted(WORKLOADS) if args.workload == 'all' else [args.workload]
+    
+    report = {
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "backend": "in-memory" if os.environ['MONGODB_URI'].startswith('memory://') else "mongodb",
+        "database": args.db,
+        "token_cache": app.token_cache is not None,
+        "catalog": {name: app.db[name].estimated_document_count() for name in ('users', 'crops', 'offers')},
+        "seed": seeded,
+        "results": [
+            run_workload(app, ctx, workload, args.requests, args.concurrency, args.random_seed)
+            for workload in workloads
+        ]
+    }
+    
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import argparse
+import random
+from datetime import datetime, timedelta
+import bcrypt
+from bson import ObjectId
+from config import Config
+from models.crop import build_crop_doc
+from utils.geo import Gazetteer
+from jobs.offer_stats import compute_offer_stats
+
+CROP_TYPES = [
+    'Wheat', 'Rice', 'Maize', 'Cotton', 'Sugarcane', 'Potato', 'Tomato', 'Onion',
+    'Garlic', 'Orange', 'Mango', 'Dates', 'Grapes', 'Beans', 'Lentils', 'Clover'
+]
+LOCATIONS = [
+    'Cairo', 'Giza', 'Alexandria', 'Beheira', 'Dakahlia', 'Sharqia', 'Gharbia',
+    'Menoufia', 'Qalyubia', 'Kafr El Sheikh', 'Fayoum', 'Beni Suef', 'Minya',
+    'Assiut', 'Sohag', 'Qena', 'Luxor', 'Aswan', 'Ismailia', 'New Valley'
+]
+
+# Every seeded user shares this password so it is hashed only once
+PASSWORD = 'benchmark'
+
+def _users(role, count, password_hash, rng):
+    for i in range(count):
+        location = rng.choice(LOCATIONS)
+        yield {
+            "_id": ObjectId(),
+            "username": f"bench_{role}_{i}",
+            "password": password_hash,
+            "role": role,
+            "full_name": f"Bench {role.title()} {i}",
+            "phone": f"01{rng.randrange(10**8, 10**9)}",
+            "location": location,
+            "created_at": datetime.utcnow().isoformat() + "Z"
+        }
+
+def _insert_batches(collection, docs, batch_size):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+def seed(db, crops, farmers=None, traders=None, offers_per_crop=2, batch_size=5000,
+         bcrypt_rounds=4, random_seed=42, history_days=None):
+    # Generates farmers, traders, crops and offers. Crops and their offers are
+    # produced together, batch by batch, so memory stays flat at any scale.
+    # history_days spreads the listings over that many days instead of a
+    # second apart.
+    rng = random.Random(random_seed)
+    farmers = farmers or max(1, crops // 50)
+    traders = traders or max(1, crops // 100)
+    gazetteer = Gazetteer.load(Config.GAZETTEER_PATH)
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(bcrypt_rounds)).decode('utf-8')
+    
+    farmer_docs = list(_users('farmer', farmers, password_hash, rng))
+    trader_docs = list(_users('trader', traders, password_hash, rng))
+    _insert_batches(db.users, farmer_docs, batch_size)
+    _insert_batches(db.users, trader_docs, batch_size)
+    
+    now = datetime.utcnow()
+    span = timedelta(days=history_days) if history_days else timedelta(seconds=crops)
+    crop_batch = []
+    offer_batch = []
+    offers = 0
+    
+    for i in range(crops):
+        farmer = rng.choice(farmer_docs)
+        crop_doc = build_crop_doc({
+            "crop_type": rng.choice(CROP_TYPES),
+            "quantity": rng.randrange(100, 50000),
+            "price": round(rng.uniform(2, 80), 2),
+            "location": rng.choice(LOCATIONS),
+            "harvest_date": (now + timedelta(days=rng.randrange(0, 180))).date().isoformat()
+        }, farmer['_id'], farmer, gazetteer)
+        crop_doc['_id'] = ObjectId()
+        crop_doc['created_at'] = now - span * (crops - i) / crops
+        
+        crop_offers = []
+        for _ in range(rng.randrange(0, offers_per_crop * 2 + 1)):
+            trader = rng.choice(trader_docs)
+            crop_offers.append({
+                "crop_id": crop_doc['_id'],
+                "trader_id": trader['_id'],
+                "farmer_id": farmer['_id'],
+                "offered_price": round(crop_doc['price'] * rng.uniform(0.7, 1.1), 2),
+                "trader_name": trader['full_name'],
+                "trader_phone": trader['phone'],
+                "created_at": crop_doc['created_at'] + timedelta(minutes=rng.randrange(1, 600))
+            })
+        crop_doc['offer_stats'] = compute_offer_stats(crop_offers)
+        crop_batch.append(crop_doc)
+        offer_batch.extend(crop_offers)
+        offers += len(crop_offers)
+        
+        if len(crop_batch) >= batch_size:
+            db.crops.insert_many(crop_batch, ordered=False)
+            crop_batch = []
+        if len(offer_batch) >= batch_size:
+            db.offers.insert_many(offer_batch, ordered=False)
+            offer_batch = []
+    
+    if crop_batch:
+        db.crops.insert_many(crop_batch, ordered=False)
+    if offer_batch:
+        db.offers.insert_many(offer_batch, ordered=False)
+    
+    return {"farmers": farmers, "traders": traders, "crops": crops, "offers": offers}
+
+def main():
+    from pymongo import MongoClient
+    
+    parser = argparse.ArgumentParser(description="Seed a database with benchmark data")
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='agripal_bench')
+    parser.add_argument('--crops', type=int, default=10000)
+    parser.add_argument('--offers-per-crop', type=int, default=2)
+    parser.add_argument('--history-days', type=int, help="spread listings over this many days")
+    parser.add_argument('--drop', action='store_true', help="drop the database first")
+    args = parser.parse_args()
+    
+    client = MongoClient(args.mongodb_uri)
+    if args.drop:
+        client.drop_database(args.db)
+    print(seed(client[args.db], args.crops, offers_per_crop=args.offers_per_crop,
+               history_days=args.history_days))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+import utils.serialization as serialization
+from utils.serialization import BSONJSONProvider
+from models.crop import build_crop_doc
+from jobs.offer_stats import compute_offer_stats
+from benchmarks.seed import CROP_TYPES, LOCATIONS
+
+# Encoding a marketplace page of crops: the per-route loops the routes used
+# before the JSON provider (str() every ObjectId, then Flask's default
+# encoder), the provider on the standard library, and the provider on orjson.
+
+def crop_docs(count, random_seed):
+    rng = random.Random(random_seed)
+    now = datetime.utcnow()
+    farmer = {"_id": ObjectId(), "full_name": "Bench Farmer", "phone": "0100000000", "location": "Cairo"}
+    docs = []
+    for i in range(count):
+        doc = build_crop_doc({
+            "crop_type": rng.choice(CROP_TYPES),
+            "quantity": rng.randrange(100, 50000),
+            "price": round(rng.uniform(2, 80), 2),
+            "location": rng.choice(LOCATIONS),
+            "harvest_date": (now + timedelta(days=rng.randrange(0, 180))).date().isoformat()
+        }, farmer['_id'], farmer)
+        doc['_id'] = ObjectId()
+        doc['created_at'] = now - timedelta(seconds=i)
+        doc['offer_stats'] = compute_offer_stats([
+            {"offered_price": doc['price'] * rng.uniform(0.7, 1.1), "created_at": now}
+            for _ in range(rng.randrange(0, 4))
+        ])
+        docs.append(doc)
+    return docs
+
+def _per_route_loops(provider, docs):
+    # What get_marketplace did before the provider: ids rewritten in place
+    for crop in docs:
+        crop['_id'] = str(crop['_id'])
+        crop['user_id'] = str(crop['user_id'])
+    return provider.dumps({"crops": docs})
+
+def _time_ms(fn, make_input, repeat):
+    samples = []
+    size = None
+    for _ in range(repeat):
+        value = make_input()
+        started = time.perf_counter()
+        size = len(fn(value))
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {"median_ms": round(samples[len(samples) // 2], 2), "max_ms": round(samples[-1], 2), "chars": size}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare JSON encoders on a page of crop documents")
+    parser.add_argument('--docs', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--random-seed', type=int, default=42)
+    args = parser.parse_args()
+    
+    app = Flask(__name__)
+    default_provider = DefaultJSONProvider(app)
+    provider = BSONJSONProvider(app)
+    docs = crop_docs(args.docs, args.random_seed)
+    # The loops mutate their input, so each run gets fresh copies, made outside the timing
+    fresh = lambda: [dict(doc) for doc in docs]
+    
+    report = {
+        "docs": args.docs,
+        "per_route_loops": _time_ms(lambda value: _per_route_loops(default_provider, value), fresh, args.repeat)
+    }
+    
+    orjson = serialization.orjson
+    try:
+        serialization.orjson = None
+        report["provider_stdlib"] = _time_ms(lambda value: provider.dumps({"crops": value}), lambda: docs, args.repeat)
+    finally:
+        serialization.orjson = orjson
+    if orjson is not None:
+        report["provider_orjson"] = _time_ms(lambda value: provider.dumps({"crops": value}), lambda: docs, args.repeat)
+        with app.app_context():
+            report["provider_orjson_response"] = _time_ms(
+                lambda value: provider.response({"crops": value}).get_data(), lambda: docs, args.repeat
+            )
+    
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
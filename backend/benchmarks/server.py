@@ -0,0 +1,173 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+from benchmarks.run import WORKLOADS, Context, build_app, run_workload
+
+# Throughput of the deployment profile: starts gunicorn with gunicorn.conf.py
+# against a MongoDB server and drives it over HTTP with the same request mixes
+# as benchmarks.run, once per worker count. The load generator shares the
+# machine, so compare runs taken on the same host.
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+    
+    def get_json(self, silent=False):
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            if silent:
+                return None
+            raise
+
+def _encode(body):
+    return json.dumps(body).encode('utf-8')
+
+class HttpClient:
+    # The subset of Flask's test client the workload operations use, over one
+    # keep-alive connection
+    def __init__(self, host, port):
+        self.connection = http.client.HTTPConnection(host, port, timeout=60)
+    
+    def open(self, method, path, json=None, headers=None, query_string=None):
+        if query_string:
+            path = f"{path}?{urlencode(query_string)}"
+        headers = dict(headers or {})
+        body = None
+        if json is not None:
+            body = _encode(json)
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                return Response(response.status, response.read())
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The worker closed an idle connection; retry once on a new one
+                self.connection.close()
+                if attempt:
+                    raise
+    
+    def get(self, path, **kwargs):
+        return self.open('GET', path, **kwargs)
+    
+    def post(self, path, **kwargs):
+        return self.open('POST', path, **kwargs)
+    
+    def put(self, path, **kwargs):
+        return self.open('PUT', path, **kwargs)
+
+def start_server(port, workers, worker_class):
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), GUNICORN_WORKER_CLASS=worker_class)
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning', 'app:app'],
+        cwd=BACKEND, env=env
+    )
+
+def wait_until_ready(server, port, timeout):
+    # /health answers 200 once a worker reaches MongoDB
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with status {server.returncode}")
+        try:
+            if HttpClient('127.0.0.1', port).get('/health').status_code == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit("gunicorn did not become ready")
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests per second per core of the gunicorn profile")
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='agripal_bench')
+    parser.add_argument('--seed', type=int, metavar='CROPS', help="drop the database and seed this many crops first")
+    parser.add_argument('--workload', choices=sorted(WORKLOADS), default='browse-heavy')
+    parser.add_argument('--workers', type=int, nargs='+', default=[os.cpu_count()], help="worker counts to compare")
+    parser.add_argument('--worker-class', default='gevent')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--sample-size', type=int, default=500)
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help="cost for seeded users and new hashes")
+    parser.add_argument('--random-seed', type=int, default=42)
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+    
+    if args.mongodb_uri.startswith('memory://'):
+        # Every worker would get its own empty in-memory database
+        raise SystemExit("benchmarks.server needs a MongoDB server shared by the workers")
+    args.in_memory = False
+    args.no_token_cache = False
+    args.rate_limits = False
+    # The server inherits the configuration build_app puts in the environment
+    app = build_app(args)
+    
+    if args.seed:
+        from benchmarks.seed import seed
+        for collection in ('users', 'crops', 'offers'):
+            app.db[collection].delete_many({})
+        seed(app.db, args.seed, bcrypt_rounds=args.bcrypt_rounds, random_seed=args.random_seed)
+    
+    ctx = Context(app, args.sample_size, random.Random(args.random_seed))
+    cores = os.cpu_count()
+    
+    def make_client():
+        return HttpClient('127.0.0.1', args.port)
+    
+    results = []
+    for workers in args.workers:
+        server = start_server(args.port, workers, args.worker_class)
+        try:
+            wait_until_ready(server, args.port, timeout=60)
+            if args.warmup:
+                run_workload(app, ctx, args.workload, args.warmup, args.concurrency, args.random_seed, make_client)
+            result = run_workload(app, ctx, args.workload, args.requests, args.concurrency, args.random_seed, make_client)
+        finally:
+            stop_server(server)
+        # Commands are counted in the server's workers, not here
+        result.pop('db_ops_per_request')
+        results.append(dict(
+            result,
+            workers=workers,
+            worker_class=args.worker_class,
+            rps_per_core=round(result['throughput_rps'] / min(workers, cores), 1)
+        ))
+    
+    report = {
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "database": args.db,
+        "cores": cores,
+        "catalog": {name: app.db[name].estimated_document_count() for name in ('users', 'crops', 'offers')},
+        "results": results
+    }
+    
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == '__main__':
+    sys.exit(main())
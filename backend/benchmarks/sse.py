@@ -0,0 +1,103 @@
+import argparse
+import json
+import selectors
+import socket
+import time
+import uuid
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+# Load test for GET /api/crops/offers/events against a running server:
+# opens many idle SSE subscribers, places one offer and measures how long the
+# event takes to reach all of them.
+
+def _api(base_url, method, path, body=None, token=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    with urlopen(Request(base_url + path, data=data, headers=headers, method=method)) as response:
+        return json.loads(response.read())
+
+def _register(base_url, role):
+    username = f"sse_{role}_{uuid.uuid4().hex[:8]}"
+    result = _api(base_url, 'POST', '/api/user/register', {
+        'username': username, 'password': 'benchmark', 'role': role,
+        'full_name': username, 'phone': '0100000000', 'location': 'Cairo'
+    })
+    return result['token']
+
+def _subscribe(host, port, token):
+    sock = socket.create_connection((host, port))
+    sock.sendall((
+        "GET /api/crops/offers/events HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        f"Authorization: Bearer {token}\r\n"
+        "Accept: text/event-stream\r\n\r\n"
+    ).encode('ascii'))
+    sock.setblocking(False)
+    return sock
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE fan-out load test")
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--subscribers', type=int, default=2000)
+    parser.add_argument('--idle-seconds', type=float, default=10.0)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args()
+    
+    parsed = urlparse(args.url)
+    farmer_token = _register(args.url, 'farmer')
+    trader_token = _register(args.url, 'trader')
+    crop = _api(args.url, 'POST', '/api/crops/', {
+        'crop_type': 'Wheat', 'quantity': 100, 'price': 10,
+        'location': 'Cairo', 'harvest_date': '2026-01-01'
+    }, farmer_token)['crop']
+    
+    selector = selectors.DefaultSelector()
+    started = time.perf_counter()
+    for _ in range(args.subscribers):
+        sock = _subscribe(parsed.hostname, parsed.port or 80, farmer_token)
+        selector.register(sock, selectors.EVENT_READ, data={'buffer': b'', 'received_at': None})
+    connect_seconds = time.perf_counter() - started
+    
+    def pump(until):
+        while time.perf_counter() < until:
+            for key, _ in selector.select(timeout=0.1):
+                chunk = key.fileobj.recv(65536)
+                key.data['buffer'] += chunk
+                if key.data['received_at'] is None and b'event: offer' in key.data['buffer']:
+                    key.data['received_at'] = time.perf_counter()
+                key.data['buffer'] = key.data['buffer'][-64:]
+    
+    # Hold the subscribers idle, then trigger one event for all of them
+    pump(time.perf_counter() + args.idle_seconds)
+    offer_at = time.perf_counter()
+    _api(args.url, 'POST', f"/api/crops/{crop['_id']}/offer", {'offered_price': 9}, trader_token)
+    offer_latency = time.perf_counter() - offer_at
+    
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        pump(time.perf_counter() + 0.5)
+        if all(key.data['received_at'] for key in selector.get_map().values()):
+            break
+    
+    delays = sorted(
+        (key.data['received_at'] - offer_at) * 1000
+        for key in selector.get_map().values() if key.data['received_at']
+    )
+    
+    def percentile(fraction):
+        return delays[min(len(delays) - 1, int(fraction * (len(delays) - 1)))] if delays else None
+    
+    print(json.dumps({
+        "subscribers": args.subscribers,
+        "connect_s": round(connect_seconds, 3),
+        "idle_s": args.idle_seconds,
+        "offer_request_ms": round(offer_latency * 1000, 1),
+        "delivered": len(delays),
+        "delivery_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99)}
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Worker boot cost: each run starts a fresh interpreter, as a gunicorn worker
+# does, and times importing the app, the first request that needs no
+# database, and the first request that does (/health, which connects).
+# Workers boot in parallel like gunicorn's.
+
+WORKER = r"""
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get('/')
+first_request = time.perf_counter()
+status = client.get('/health').status_code
+first_db_request = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (first_request - imported) * 1000,
+    "first_db_request_ms": (first_db_request - first_request) * 1000,
+    "health": status
+}))
+"""
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _summary(values):
+    values = sorted(values)
+    return {
+        "median": round(values[len(values) // 2], 2),
+        "max": round(values[-1], 2)
+    }
+
+def boot_workers(workers, env):
+    processes = [
+        subprocess.Popen([sys.executable, '-c', WORKER], cwd=BACKEND, env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        for _ in range(workers)
+    ]
+    results = []
+    for process in processes:
+        output, _ = process.communicate()
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import-to-first-request latency per worker")
+    parser.add_argument('--mongodb-uri', default=os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/'))
+    parser.add_argument('--workers', type=int, default=4, help="workers booted at once")
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    
+    env = dict(os.environ, MONGODB_URI=args.mongodb_uri, BCRYPT_POOL_WORKERS='0')
+    results = []
+    for _ in range(args.rounds):
+        results.extend(boot_workers(args.workers, env))
+    
+    report = {
+        "workers": args.workers,
+        "rounds": args.rounds,
+        "health": sorted({result["health"] for result in results})
+    }
+    for phase in ('import_ms', 'first_request_ms', 'first_db_request_ms'):
+        report[phase] = _summary([result[phase] for result in results])
+    report["import_to_first_request_ms"] = _summary(
+        [result["import_ms"] + result["first_request_ms"] for result in results]
+    )
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
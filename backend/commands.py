@@ -0,0 +1,154 @@
+import click
+from flask import current_app
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+from utils.indexes import ensure_indexes, check_query_plans
+from utils.search import SEARCH_FIELDS, search_terms
+from utils.units import InvalidMeasure
+from models.crop import MEASURE_FIELDS
+from jobs.farmer_snapshots import backfill_farmer_snapshots
+from jobs.offer_stats import rebuild_offer_stats
+from jobs.market_rollups import rebuild_market_rollups
+from jobs.crop_cleanup import backfill_crop_status, purge_orphan_offers
+
+def register_commands(app):
+    
+    @app.cli.command('ensure-indexes')
+    def ensure_indexes_command():
+        ensure_indexes(current_app.db)
+        click.echo("✅ Indexes are up to date")
+    
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        try:
+            failures = check_query_plans(current_app.db)
+        except OperationFailure as e:
+            # e.g. the memory:// stand-in, which has no query planner
+            click.echo(f"❌ Could not explain route queries: {e}")
+            raise SystemExit(1)
+        
+        if failures:
+            for route, stages in failures.items():
+                click.echo(f"❌ {route}: {', '.join(stages)}")
+            raise SystemExit(1)
+        
+        click.echo("✅ All route queries are served by indexes")
+
+    
+    @app.cli.command('backfill-search-terms')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def backfill_search_terms_command(batch_size):
+        # Recompute normalized search terms for every crop
+        crops = current_app.db.crops.find({}, {field: 1 for field in SEARCH_FIELDS})
+        batch = []
+        updated = 0
+        
+        for crop in crops:
+            batch.append(UpdateOne({"_id": crop['_id']}, {"$set": search_terms(crop)}))
+            if len(batch) >= batch_size:
+                updated += current_app.db.crops.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            updated += current_app.db.crops.bulk_write(batch, ordered=False).modified_count
+        
+        click.echo(f"✅ Updated search terms on {updated} crops")
+
+    
+    @app.cli.command('backfill-crop-locations')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def backfill_crop_locations_command(batch_size):
+        # Geocode every crop's location with the current gazetteer; run
+        # rebuild-market-rollups afterwards, rollups are kept per place
+        crops = current_app.db.crops.find({}, {"location": 1})
+        batch = []
+        updated = 0
+        unknown = 0
+        
+        for crop in crops:
+            found = current_app.gazetteer.locate(crop.get('location') or '')
+            if found:
+                place, geo = found
+                batch.append(UpdateOne({"_id": crop['_id']}, {"$set": {"place": place, "geo": geo}}))
+            else:
+                unknown += 1
+                batch.append(UpdateOne({"_id": crop['_id']}, {"$unset": {"place": "", "geo": ""}}))
+            if len(batch) >= batch_size:
+                updated += current_app.db.crops.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            updated += current_app.db.crops.bulk_write(batch, ordered=False).modified_count
+        
+        click.echo(f"✅ Updated locations on {updated} crops ({unknown} without a known place)")
+
+    
+    @app.cli.command('normalize-crop-measures')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def normalize_crop_measures_command(batch_size):
+        # Convert quantity/price stored as text or integers to kg and price per kg
+        not_canonical = {'$or': [{field: {'$not': {'$type': 'double'}}} for field in MEASURE_FIELDS]}
+        crops = current_app.db.crops.find(not_canonical, {field: 1 for field in MEASURE_FIELDS})
+        batch = []
+        updated = 0
+        unconvertible = []
+        
+        for crop in crops:
+            measures = {}
+            for field, normalize in MEASURE_FIELDS.items():
+                if field not in crop:
+                    continue
+                try:
+                    measures[field] = normalize(crop[field])
+                except InvalidMeasure as e:
+                    unconvertible.append(f"{crop['_id']} {field}={crop[field]!r}: {e}")
+            if measures:
+                batch.append(UpdateOne({"_id": crop['_id']}, {"$set": measures}))
+            if len(batch) >= batch_size:
+                updated += current_app.db.crops.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            updated += current_app.db.crops.bulk_write(batch, ordered=False).modified_count
+        
+        # Left as they are, to be fixed by hand or by the farmer
+        for line in unconvertible:
+            click.echo(f"⚠️  {line}")
+        click.echo(f"✅ Normalized quantity/price on {updated} crops ({len(unconvertible)} values left unchanged)")
+
+    
+    @app.cli.command('backfill-farmer-snapshots')
+    @click.option('--batch-size', default=500, show_default=True)
+    def backfill_farmer_snapshots_command(batch_size):
+        updated = backfill_farmer_snapshots(current_app.db, batch_size)
+        click.echo(f"✅ Updated farmer info on {updated} crops")
+
+    
+    @app.cli.command('rebuild-offer-stats')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def rebuild_offer_stats_command(batch_size):
+        # Reconcile the per-crop offer aggregates with the offers collection
+        rebuilt = rebuild_offer_stats(current_app.db, batch_size)
+        click.echo(f"✅ Rebuilt offer stats on {rebuilt} crops")
+
+    
+    @app.cli.command('rebuild-market-rollups')
+    @click.option('--days', type=int, help="Only rebuild the last N days (default: all time)")
+    def rebuild_market_rollups_command(days):
+        # Recompute the analytics rollups from crops and offers; run it
+        # periodically or after bulk changes made outside the API
+        rebuilt = rebuild_market_rollups(current_app.db, days)
+        click.echo(f"✅ Rebuilt {rebuilt} market rollup buckets")
+
+    
+    @app.cli.command('backfill-crop-status')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def backfill_crop_status_command(batch_size):
+        # Crops from before listings had a status are missing from the marketplace until this runs
+        updated = backfill_crop_status(current_app.db, batch_size)
+        click.echo(f"✅ Marked {updated} crops as active")
+
+    
+    @app.cli.command('purge-orphan-offers')
+    @click.option('--batch-size', default=500, show_default=True)
+    def purge_orphan_offers_command(batch_size):
+        # Remove offers whose crop is deleted or no longer exists
+        purged = purge_orphan_offers(current_app.db, batch_size)
+        click.echo(f"✅ Removed {purged} orphaned offers")
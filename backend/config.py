@@ -7,4 +7,79 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key'
     FLASK_ENV = os.environ.get('FLASK_ENV') or 'development'
     MONGODB_URI = os.environ.get('MONGODB_URI') or 'mongodb://localhost:27017/'
-    MONGODB_DB = os.environ.get('MONGODB_DB') or 'agripal'
\ No newline at end of file
+    MONGODB_DB = os.environ.get('MONGODB_DB') or 'agripal'
+    
+    # MongoDB connection pool, shared by all requests of a worker
+    MONGODB_MAX_POOL_SIZE = int(os.environ.get('MONGODB_MAX_POOL_SIZE') or 100)
+    MONGODB_MIN_POOL_SIZE = int(os.environ.get('MONGODB_MIN_POOL_SIZE') or 0)
+    MONGODB_MAX_IDLE_TIME_MS = int(os.environ.get('MONGODB_MAX_IDLE_TIME_MS') or 60000)
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGODB_WAIT_QUEUE_TIMEOUT_MS') or 2000)
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS') or 5000)
+    # Build indexes in the background when a worker first uses MongoDB;
+    # set to false when `flask ensure-indexes` runs at deploy time instead
+    MONGODB_ENSURE_INDEXES = (os.environ.get('MONGODB_ENSURE_INDEXES') or 'true').lower() == 'true'
+    
+    # Marketplace pagination
+    MARKETPLACE_PAGE_SIZE = int(os.environ.get('MARKETPLACE_PAGE_SIZE') or 20)
+    MARKETPLACE_MAX_PAGE_SIZE = int(os.environ.get('MARKETPLACE_MAX_PAGE_SIZE') or 100)
+    
+    # Nearby search: offline place name lookup and radius bounds
+    GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer.csv')
+    MARKETPLACE_DEFAULT_RADIUS_KM = float(os.environ.get('MARKETPLACE_DEFAULT_RADIUS_KM') or 100)
+    MARKETPLACE_MAX_RADIUS_KM = float(os.environ.get('MARKETPLACE_MAX_RADIUS_KM') or 500)
+    
+    # Market analytics window, in days
+    ANALYTICS_DEFAULT_DAYS = int(os.environ.get('ANALYTICS_DEFAULT_DAYS') or 30)
+    ANALYTICS_MAX_DAYS = int(os.environ.get('ANALYTICS_MAX_DAYS') or 365)
+    
+    # Password hashing
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS') or 12)
+    BCRYPT_POOL_WORKERS = int(os.environ.get('BCRYPT_POOL_WORKERS') or 2)
+    BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING') or 32)
+    BCRYPT_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT') or 10)
+    
+    # Marketplace response cache
+    MARKETPLACE_CACHE_SIZE = int(os.environ.get('MARKETPLACE_CACHE_SIZE') or 1024)
+    MARKETPLACE_CACHE_TTL = int(os.environ.get('MARKETPLACE_CACHE_TTL') or 30)
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    
+    # Verified JWT claims cache
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE') or 4096)
+    TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL') or 300)
+    
+    # Bulk crop import
+    BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE') or 1000)
+    BULK_IMPORT_MAX_ERRORS = int(os.environ.get('BULK_IMPORT_MAX_ERRORS') or 1000)
+    
+    # Batch offer submission
+    BULK_OFFER_MAX_ITEMS = int(os.environ.get('BULK_OFFER_MAX_ITEMS') or 200)
+    
+    # Offers removed or closed per write when a crop is deleted or sold
+    OFFER_CLEANUP_BATCH_SIZE = int(os.environ.get('OFFER_CLEANUP_BATCH_SIZE') or 500)
+    
+    # Streaming NDJSON exports
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE') or 1000)
+    
+    # Offer notifications (Server-Sent Events)
+    OFFER_EVENTS_SOURCE = os.environ.get('OFFER_EVENTS_SOURCE') or 'auto'  # auto, change_stream or local
+    SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS') or 15)
+    SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE') or 100)
+    SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS') or 5000)
+    
+    # Metrics; false drops the /metrics hooks and the MongoDB command listener
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or 'true').lower() == 'true'
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS') or 100)
+    MONGO_METRICS_BYTES = (os.environ.get('MONGO_METRICS_BYTES') or 'false').lower() == 'true'
+    
+    # Rate limits per route, "<requests>/<second|minute|hour>" or "off".
+    # Buckets are kept per client IP and, on authenticated routes, per user.
+    RATELIMIT_LOGIN = os.environ.get('RATELIMIT_LOGIN') or '10/minute'
+    RATELIMIT_REGISTER = os.environ.get('RATELIMIT_REGISTER') or '5/minute'
+    RATELIMIT_OFFER = os.environ.get('RATELIMIT_OFFER') or '30/minute'
+    RATELIMIT_OFFER_BULK = os.environ.get('RATELIMIT_OFFER_BULK') or '5/minute'
+    RATELIMIT_STORE_SIZE = int(os.environ.get('RATELIMIT_STORE_SIZE') or 100000)
+    RATELIMIT_REDIS_URL = os.environ.get('RATELIMIT_REDIS_URL')
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES') or 0)  # proxies setting X-Forwarded-For
+    
+    # Admission control: concurrent requests per worker before 503 (0 = off)
+    MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS') or 200)
\ No newline at end of file
@@ -0,0 +1,25 @@
+import multiprocessing
+import os
+
+# Deployment profile, every setting can be overridden through the environment.
+# The default is async (gevent) workers: a request waiting on MongoDB or an SSE
+# stream only parks a greenlet, not a whole worker. Use GUNICORN_WORKER_CLASS=sync
+# for the classic one-request-per-worker model.
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+# An async worker keeps its core busy on its own, so one per core; sync workers
+# block on I/O and need the classic 2 x cores + 1
+if worker_class == 'sync':
+    default_workers = multiprocessing.cpu_count() * 2 + 1
+else:
+    default_workers = multiprocessing.cpu_count()
+workers = int(os.environ.get('WEB_CONCURRENCY', default_workers))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+def post_fork(server, worker):
+    # Each worker builds its own MongoClient on first use; drop any client
+    # inherited from the master (e.g. when running with --preload)
+    from utils.mongo import reset_after_fork
+    reset_after_fork()
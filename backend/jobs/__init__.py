@@ -0,0 +1 @@
+# Background and maintenance jobs
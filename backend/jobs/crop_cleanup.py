@@ -0,0 +1,71 @@
+from jobs.market_rollups import record_bids
+
+# Offer cleanup once a crop leaves the marketplace. Runs in the background in
+# fixed-size chunks, so deleting or selling a crop is a single status flip on
+# the request path however many offers it has.
+
+def delete_crop_offers(db, crop, batch_size=500, on_change=None):
+    # Deleted crop: its offers go, and so do their bids in the market rollups.
+    # crop holds the rollup MARKET_FIELDS.
+    deleted = 0
+    
+    while True:
+        offers = list(db.offers.find(
+            {"crop_id": crop['_id']},
+            {"crop_id": 1, "offered_price": 1, "created_at": 1}
+        ).limit(batch_size))
+        if not offers:
+            return deleted
+        
+        db.offers.delete_many({"_id": {"$in": [offer['_id'] for offer in offers]}})
+        record_bids(db, offers, {crop['_id']: crop}, -1, on_change=on_change)
+        deleted += len(offers)
+
+def close_crop_offers(db, crop_id, batch_size=500):
+    # Sold crop: its offers stay in the traders' history, closed to changes
+    closed = 0
+    
+    while True:
+        offer_ids = [offer['_id'] for offer in db.offers.find(
+            {"crop_id": crop_id, "status": {"$ne": "closed"}}, {"_id": 1}
+        ).limit(batch_size)]
+        if not offer_ids:
+            return closed
+        
+        db.offers.update_many({"_id": {"$in": offer_ids}}, {"$set": {"status": "closed"}})
+        closed += len(offer_ids)
+
+def purge_orphan_offers(db, batch_size=500):
+    # Offers whose crop is deleted or missing: left by hard deletes from before
+    # crops had a status, or by a cleanup cut short by a restart. Rollups are
+    # not adjusted; run rebuild-market-rollups afterwards.
+    purged = 0
+    crop_ids = (group['_id'] for group in db.offers.aggregate(
+        [{'$group': {'_id': '$crop_id'}}], batchSize=batch_size
+    ))
+    
+    while True:
+        chunk = [crop_id for _, crop_id in zip(range(batch_size), crop_ids)]
+        if not chunk:
+            return purged
+        
+        live = {crop['_id'] for crop in db.crops.find(
+            {"_id": {"$in": chunk}, "status": {"$ne": "deleted"}}, {"_id": 1}
+        )}
+        dead = [crop_id for crop_id in chunk if crop_id not in live]
+        if dead:
+            purged += db.offers.delete_many({"crop_id": {"$in": dead}}).deleted_count
+
+def backfill_crop_status(db, batch_size=1000):
+    # Crops created before listings had a status are active
+    updated = 0
+    
+    while True:
+        crop_ids = [crop['_id'] for crop in db.crops.find(
+            {"status": {"$exists": False}}, {"_id": 1}
+        ).limit(batch_size)]
+        if not crop_ids:
+            return updated
+        
+        db.crops.update_many({"_id": {"$in": crop_ids}}, {"$set": {"status": "active"}})
+        updated += len(crop_ids)
@@ -0,0 +1,40 @@
+from pymongo import UpdateMany
+
+# Farmer fields copied onto each of their crops for the marketplace
+SNAPSHOT_FIELDS = ('full_name', 'phone', 'location')
+
+def farmer_snapshot(user):
+    return {field: user.get(field) for field in SNAPSHOT_FIELDS}
+
+def propagate_farmer_snapshot(db, user_id, on_change=None):
+    # Fan a farmer's profile out to all of their crops
+    user = db.users.find_one({"_id": user_id}, {field: 1 for field in SNAPSHOT_FIELDS})
+    if not user:
+        return 0
+    
+    result = db.crops.update_many(
+        {"user_id": user_id},
+        {"$set": {"farmer": farmer_snapshot(user)}}
+    )
+    if result.modified_count and on_change:
+        on_change()
+    return result.modified_count
+
+def backfill_farmer_snapshots(db, batch_size=500):
+    # Rewrite the snapshot on every crop from the current farmer profiles
+    farmers = db.users.find({"role": "farmer"}, {field: 1 for field in SNAPSHOT_FIELDS})
+    batch = []
+    updated = 0
+    
+    for farmer in farmers:
+        batch.append(UpdateMany(
+            {"user_id": farmer['_id']},
+            {"$set": {"farmer": farmer_snapshot(farmer)}}
+        ))
+        if len(batch) >= batch_size:
+            updated += db.crops.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += db.crops.bulk_write(batch, ordered=False).modified_count
+    
+    return updated
@@ -0,0 +1,300 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from jobs.offer_stats import _as_number
+from utils.search import normalize_terms
+
+# Daily market rollups in "market_daily", one document per
+# (day, crop_type, location): listings and asks from crops created that day,
+# bids from offers placed that day. Sums and counts are kept exact by $inc;
+# ask_min/ask_max/best_bid only widen until the next rebuild. location is the
+# crop's gazetteer place, or OTHER_PLACE, so free-text locations can't
+# multiply the buckets.
+
+LISTING_FIELDS = ('listings', 'ask_sum', 'volume_kg')
+BID_FIELDS = ('bids', 'bid_sum')
+
+# Crop fields that decide a listing's bucket and contribution
+MARKET_FIELDS = {'created_at': 1, 'price': 1, 'quantity': 1, 'crop_type_terms': 1, 'place': 1}
+
+# Bucket location of crops whose location names no known place
+OTHER_PLACE = 'other'
+
+STAGING = 'market_daily_rebuild'
+
+def market_key(crop):
+    # Bucket keys are the normalized words of crop_type and the crop's place
+    crop_type = crop.get('crop_type_terms')
+    if crop_type is None:
+        crop_type = normalize_terms(crop.get('crop_type', ''))
+    return ' '.join(crop_type), crop.get('place') or OTHER_PLACE
+
+def day_of(moment):
+    return datetime(moment.year, moment.month, moment.day)
+
+def bucket_id(day, crop_type, location):
+    return f"{day:%Y-%m-%d}|{crop_type}|{location}"
+
+class _Deltas:
+    # Per-bucket changes gathered before writing, one upsert per bucket
+    def __init__(self):
+        self.buckets = {}
+    
+    def add(self, day, crop_type, location, inc, low=None, high=None):
+        key = bucket_id(day, crop_type, location)
+        bucket = self.buckets.setdefault(key, {
+            'day': day, 'crop_type': crop_type, 'location': location,
+            'inc': defaultdict(float), 'min': {}, 'max': {}
+        })
+        for field, value in inc.items():
+            bucket['inc'][field] += value
+        for field, value in (low or {}).items():
+            bucket['min'][field] = min(value, bucket['min'].get(field, value))
+        for field, value in (high or {}).items():
+            bucket['max'][field] = max(value, bucket['max'].get(field, value))
+    
+    def write(self, db, on_change=None):
+        # on_change runs once the buckets are written, e.g. to invalidate
+        # cached analytics that were built before they landed
+        if not self.buckets:
+            return
+        now = datetime.utcnow()
+        updates = []
+        for key, bucket in self.buckets.items():
+            update = {
+                '$inc': dict(bucket['inc']),
+                '$set': {'updated_at': now},
+                '$setOnInsert': {'day': bucket['day'], 'crop_type': bucket['crop_type'], 'location': bucket['location']}
+            }
+            if bucket['min']:
+                update['$min'] = bucket['min']
+            if bucket['max']:
+                update['$max'] = bucket['max']
+            # Removals never create a bucket, e.g. for crops listed before rollups existed
+            upsert = any(value > 0 for value in bucket['inc'].values())
+            updates.append(UpdateOne({'_id': key}, update, upsert=upsert))
+        db.market_daily.bulk_write(updates, ordered=False)
+        if on_change:
+            on_change()
+
+def _add_listing(deltas, crop, sign):
+    price = _as_number(crop.get('price'))
+    quantity = _as_number(crop.get('quantity'))
+    if price is None or quantity is None or not crop.get('created_at'):
+        return
+    
+    inc = {'listings': sign, 'ask_sum': sign * price, 'volume_kg': sign * quantity}
+    if sign > 0:
+        deltas.add(day_of(crop['created_at']), *market_key(crop), inc, {'ask_min': price}, {'ask_max': price})
+    else:
+        deltas.add(day_of(crop['created_at']), *market_key(crop), inc)
+
+def _add_bid(deltas, crop, offer, sign):
+    price = _as_number(offer.get('offered_price'))
+    if price is None or not offer.get('created_at'):
+        return
+    
+    inc = {'bids': sign, 'bid_sum': sign * price}
+    if sign > 0:
+        deltas.add(day_of(offer['created_at']), *market_key(crop), inc, high={'best_bid': price})
+    else:
+        deltas.add(day_of(offer['created_at']), *market_key(crop), inc)
+
+def record_listings(db, crops, sign=1, on_change=None):
+    # sign=1 for new crops, -1 for deleted ones
+    deltas = _Deltas()
+    for crop in crops:
+        _add_listing(deltas, crop, sign)
+    deltas.write(db, on_change)
+
+def _add_moved_bids(deltas, db, before, after):
+    # A crop whose type or place changed takes its bids to the new market:
+    # one $group per day over the offers placed before the edit. Later offers
+    # were already counted under the new key.
+    match = {'crop_id': before['_id']}
+    if after.get('updated_at'):
+        match['created_at'] = {'$lt': after['updated_at']}
+    days = db.offers.aggregate([
+        {'$match': match},
+        {'$addFields': {'bid': {'$convert': {
+            'input': '$offered_price', 'to': 'double', 'onError': None, 'onNull': None
+        }}}},
+        {'$match': {'bid': {'$ne': None}, 'created_at': {'$type': 'date'}}},
+        {'$group': {
+            '_id': _day_expr('$created_at'),
+            'bids': {'$sum': 1},
+            'bid_sum': {'$sum': '$bid'},
+            'best_bid': {'$max': '$bid'}
+        }}
+    ])
+    for day in days:
+        inc = {'bids': day['bids'], 'bid_sum': day['bid_sum']}
+        deltas.add(day['_id'], *market_key(before), {field: -value for field, value in inc.items()})
+        deltas.add(day['_id'], *market_key(after), inc, high={'best_bid': day['best_bid']})
+
+def record_listing_change(db, before, after, on_change=None):
+    # Moves an edited crop's contribution when its price, quantity, type or
+    # location changed; it stays on the day it was listed. A new type or place
+    # moves its bids too, though the old bucket's best_bid stays until the
+    # next rebuild.
+    if all(before.get(field) == after.get(field) for field in MARKET_FIELDS):
+        return
+    deltas = _Deltas()
+    _add_listing(deltas, before, -1)
+    _add_listing(deltas, after, 1)
+    if market_key(before) != market_key(after):
+        _add_moved_bids(deltas, db, before, after)
+    deltas.write(db, on_change)
+
+def record_bid_change(db, before=None, after=None, on_change=None):
+    # before=None for a new offer, after=None for a deleted one
+    offer = after or before
+    crop = db.crops.find_one({'_id': offer['crop_id']}, MARKET_FIELDS)
+    if not crop:
+        return
+    deltas = _Deltas()
+    if before:
+        _add_bid(deltas, crop, before, -1)
+    if after:
+        _add_bid(deltas, crop, after, 1)
+    deltas.write(db, on_change)
+
+def record_bids(db, offers, crops, sign=1, on_change=None):
+    # Offers placed or removed together; crops maps each crop_id to its MARKET_FIELDS
+    deltas = _Deltas()
+    for offer in offers:
+        _add_bid(deltas, crops[offer['crop_id']], offer, sign)
+    deltas.write(db, on_change)
+
+def _day_expr(field):
+    return {'$dateFromParts': {
+        'year': {'$year': field}, 'month': {'$month': field}, 'day': {'$dayOfMonth': field}
+    }}
+
+def _key_expr(field):
+    # ' '.join(terms) in the aggregation language
+    return {'$reduce': {
+        'input': {'$ifNull': [field, []]},
+        'initialValue': '',
+        'in': {'$cond': [
+            {'$eq': ['$$value', '']}, '$$this', {'$concat': ['$$value', ' ', '$$this']}
+        ]}
+    }}
+
+def _bucket_stages(prefix, accumulators):
+    # $group by bucket, then shape the output like a market_daily document
+    group = {'_id': {
+        'day': _day_expr('$created_at'),
+        'crop_type': _key_expr(f'${prefix}crop_type_terms'),
+        'location': {'$ifNull': [f'${prefix}place', OTHER_PLACE]}
+    }}
+    group.update(accumulators)
+    project = {
+        '_id': {'$concat': [
+            {'$dateToString': {'format': '%Y-%m-%d', 'date': '$_id.day'}},
+            '|', '$_id.crop_type', '|', '$_id.location'
+        ]},
+        'day': '$_id.day',
+        'crop_type': '$_id.crop_type',
+        'location': '$_id.location'
+    }
+    project.update({field: 1 for field in accumulators})
+    return [{'$group': group}, {'$project': project}]
+
+def rebuild_market_rollups(db, days=None):
+    # Recompute rollups from crops and offers, for the last `days` days or for
+    # all time. Buckets are built in a staging collection with two $merge
+    # passes, then merged over market_daily; increments landing on a bucket
+    # while it is rebuilt are overwritten, so run it off-peak.
+    started = datetime.utcnow()
+    since = day_of(started) - timedelta(days=days - 1) if days else None
+    window = {'created_at': {'$gte': since}} if since else {}
+    
+    db[STAGING].drop()
+    
+    db.crops.aggregate([
+        {'$match': dict(window, status={'$ne': 'deleted'}, price={'$type': 'number'}, quantity={'$type': 'number'})},
+        *_bucket_stages('', {
+            'listings': {'$sum': 1},
+            'ask_sum': {'$sum': '$price'},
+            'ask_min': {'$min': '$price'},
+            'ask_max': {'$max': '$price'},
+            'volume_kg': {'$sum': '$quantity'}
+        }),
+        {'$merge': {'into': STAGING, 'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+    ])
+    
+    db.offers.aggregate([
+        {'$match': window},
+        {'$addFields': {'bid': {'$convert': {
+            'input': '$offered_price', 'to': 'double', 'onError': None, 'onNull': None
+        }}}},
+        {'$match': {'bid': {'$ne': None}}},
+        {'$lookup': {'from': 'crops', 'localField': 'crop_id', 'foreignField': '_id', 'as': 'crop'}},
+        {'$unwind': '$crop'},
+        {'$match': {'crop.status': {'$ne': 'deleted'}}},
+        *_bucket_stages('crop.', {
+            'bids': {'$sum': 1},
+            'bid_sum': {'$sum': '$bid'},
+            'best_bid': {'$max': '$bid'}
+        }),
+        {'$merge': {'into': STAGING, 'whenMatched': 'merge', 'whenNotMatched': 'insert'}}
+    ])
+    
+    db[STAGING].aggregate([
+        {'$addFields': {'rebuilt_at': started, 'updated_at': started}},
+        {'$merge': {'into': 'market_daily', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+    ])
+    db[STAGING].drop()
+    
+    # Buckets in the window that no longer have any crops or offers
+    stale = {'rebuilt_at': {'$ne': started}, 'updated_at': {'$not': {'$gte': started}}}
+    if since:
+        stale['day'] = {'$gte': since}
+    db.market_daily.delete_many(stale)
+    
+    return db.market_daily.count_documents({'rebuilt_at': started})
+
+def _accumulate(total, row):
+    for field in LISTING_FIELDS + BID_FIELDS:
+        total[field] += row.get(field) or 0
+    for field, pick in (('ask_min', min), ('ask_max', max), ('best_bid', max)):
+        if row.get(field) is not None:
+            total[field] = row[field] if total.get(field) is None else pick(total[field], row[field])
+
+def _summary(total):
+    listings = round(total['listings'])
+    bids = round(total['bids'])
+    return {
+        'listings': listings,
+        'volume_kg': round(total['volume_kg'], 3),
+        'avg_ask': round(total['ask_sum'] / listings, 4) if listings > 0 else None,
+        'min_ask': total.get('ask_min') if listings > 0 else None,
+        'max_ask': total.get('ask_max') if listings > 0 else None,
+        'bids': bids,
+        'avg_bid': round(total['bid_sum'] / bids, 4) if bids > 0 else None,
+        'best_bid': total.get('best_bid') if bids > 0 else None
+    }
+
+def summarize_rollups(rows, group_by):
+    # Overall figures, a per-day trend and a per-group breakdown from rollup rows
+    overall = defaultdict(float)
+    daily = defaultdict(lambda: defaultdict(float))
+    groups = defaultdict(lambda: defaultdict(float))
+    
+    for row in rows:
+        _accumulate(overall, row)
+        _accumulate(daily[row['day']], row)
+        _accumulate(groups[row[group_by]], row)
+    
+    return {
+        'summary': _summary(overall),
+        'daily': [dict(day=f"{day:%Y-%m-%d}", **_summary(total)) for day, total in sorted(daily.items())],
+        # Markets whose listings and bids were all removed drop out
+        'groups': sorted(
+            (group for group in ({group_by: key, **_summary(total)} for key, total in groups.items())
+             if group['listings'] or group['bids']),
+            key=lambda group: group['listings'] + group['bids'],
+            reverse=True
+        )
+    }
\ No newline at end of file
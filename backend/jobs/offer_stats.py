@@ -0,0 +1,143 @@
+from statistics import median
+from pymongo import UpdateOne
+
+# Price discovery fields kept on each crop under "offer_stats". Offer writes
+# keep offer_count, best_offer and last_bid_at with $inc/$max in one update and
+# bump "version"; the median, and a best offer that was lowered or deleted, are
+# recomputed from the offers off the request path. A recomputation is only
+# written if no offer write landed since it read the version, and each of
+# those writes schedules its own.
+
+def _as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def compute_offer_stats(offers):
+    prices = []
+    last_bid_at = None
+    count = 0
+    
+    for offer in offers:
+        count += 1
+        price = _as_number(offer.get('offered_price'))
+        if price is not None:
+            prices.append(price)
+        
+        bid_at = offer.get('updated_at') or offer.get('created_at')
+        if bid_at and (last_bid_at is None or bid_at > last_bid_at):
+            last_bid_at = bid_at
+    
+    return {
+        "best_offer": max(prices) if prices else None,
+        "median_offer": median(prices) if prices else None,
+        "offer_count": count,
+        "last_bid_at": last_bid_at
+    }
+
+def _crop_offers(db, crop_ids):
+    return db.offers.find(
+        {"crop_id": {"$in": crop_ids}},
+        {"_id": 0, "crop_id": 1, "offered_price": 1, "created_at": 1, "updated_at": 1}
+    )
+
+def _recorded(count=0, price=None, bid_at=None):
+    update = {"$inc": {"offer_stats.version": 1, "offer_stats.offer_count": count}}
+    highs = {}
+    if price is not None:
+        highs["offer_stats.best_offer"] = price
+    if bid_at is not None:
+        highs["offer_stats.last_bid_at"] = bid_at
+    if highs:
+        update["$max"] = highs
+    return update
+
+def record_offer(db, crop_id, count=0, price=None, bid_at=None):
+    # One offer written: count is 1 for a new offer, -1 for a deleted one and
+    # 0 for a new price
+    db.crops.update_one({"_id": crop_id}, _recorded(count, _as_number(price), bid_at))
+
+def record_offers(db, offers):
+    # New offers on several crops, one update per crop in one round trip
+    by_crop = {}
+    for offer in offers:
+        count, price, bid_at = by_crop.get(offer['crop_id'], (0, None, None))
+        offered = _as_number(offer.get('offered_price'))
+        if offered is not None and (price is None or offered > price):
+            price = offered
+        created_at = offer.get('created_at')
+        if created_at and (bid_at is None or created_at > bid_at):
+            bid_at = created_at
+        by_crop[offer['crop_id']] = (count + 1, price, bid_at)
+    
+    if by_crop:
+        db.crops.bulk_write(
+            [UpdateOne({"_id": crop_id}, _recorded(*recorded)) for crop_id, recorded in by_crop.items()],
+            ordered=False
+        )
+
+def _versions(db, crop_ids):
+    return {
+        crop['_id']: crop.get('offer_stats', {}).get('version')
+        for crop in db.crops.find({"_id": {"$in": crop_ids}}, {"offer_stats.version": 1})
+    }
+
+def _recomputed(crop_id, version, offers):
+    return UpdateOne(
+        {"_id": crop_id, "offer_stats.version": version},
+        {"$set": {f"offer_stats.{field}": value for field, value in compute_offer_stats(offers).items()}}
+    )
+
+def refresh_offer_stats(db, crop_id, on_change=None):
+    refresh_many_offer_stats(db, [crop_id], on_change)
+
+def refresh_many_offer_stats(db, crop_ids, on_change=None):
+    # Recompute every field from the offers in three round trips. The version
+    # is read before the offers, so a write the read missed has changed it.
+    versions = _versions(db, list(set(crop_ids)))
+    if not versions:
+        return
+    
+    offers_by_crop = {crop_id: [] for crop_id in versions}
+    for offer in _crop_offers(db, list(versions)):
+        offers_by_crop[offer['crop_id']].append(offer)
+    
+    result = db.crops.bulk_write(
+        [_recomputed(crop_id, versions[crop_id], offers) for crop_id, offers in offers_by_crop.items()],
+        ordered=False
+    )
+    if result.modified_count and on_change:
+        on_change()
+
+def rebuild_offer_stats(db, batch_size=1000):
+    # Reconcile every crop's stats with the offers collection, one batch of
+    # crops at a time
+    rebuilt = 0
+    last_id = None
+    
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id else {}
+        crop_ids = [crop['_id'] for crop in db.crops.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size)]
+        if not crop_ids:
+            return rebuilt
+        
+        offers_by_crop = {crop_id: [] for crop_id in crop_ids}
+        for offer in _crop_offers(db, crop_ids):
+            offers_by_crop[offer['crop_id']].append(offer)
+        
+        updates = []
+        for crop_id, offers in offers_by_crop.items():
+            stats = compute_offer_stats(offers)
+            updates.append(UpdateOne(
+                {"_id": crop_id},
+                {
+                    "$set": {f"offer_stats.{field}": value for field, value in stats.items()},
+                    # Version counter from before it moved under offer_stats
+                    "$unset": {"offer_stats_version": ""}
+                }
+            ))
+        db.crops.bulk_write(updates, ordered=False)
+        
+        rebuilt += len(crop_ids)
+        last_id = crop_ids[-1]
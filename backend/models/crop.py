@@ -0,0 +1,85 @@
+from datetime import datetime
+from jobs.farmer_snapshots import farmer_snapshot
+from utils.search import search_terms
+from utils.units import UNITS, InvalidMeasure, quantity_in_kg, price_per_kg
+
+# Fields a farmer sets on a listing; all are required on create
+CROP_FIELDS = ['crop_type', 'quantity', 'price', 'location', 'harvest_date']
+
+# Listing lifecycle. Only active crops are in the marketplace and take
+# offers; sold crops stay visible to their farmer, deleted ones to nobody.
+CROP_STATUSES = ('active', 'sold', 'deleted')
+
+# Stored as numbers: quantity in kg, price per kg
+MEASURE_FIELDS = {
+    'quantity': quantity_in_kg,
+    'price': price_per_kg
+}
+
+def normalize_measures(data):
+    # Canonical quantity/price for the measure fields present in data. Values
+    # may carry their own unit ("2 tons", "3000/ton"); otherwise the optional
+    # "unit" field applies, defaulting to kg.
+    unit = data.get('unit') or 'kg'
+    if not isinstance(unit, str) or unit.casefold() not in UNITS:
+        raise InvalidMeasure("unit must be a weight unit such as kg, quintal or ton")
+    
+    measures = {}
+    for field, normalize in MEASURE_FIELDS.items():
+        if field in data:
+            try:
+                measures[field] = normalize(data[field], unit)
+            except InvalidMeasure as e:
+                raise InvalidMeasure(f"{field} {e}") from e
+    return measures
+
+def validate_crop_data(data):
+    if not isinstance(data, dict):
+        return {"valid": False, "error": "Crop must be a JSON object"}
+    
+    missing_fields = [field for field in CROP_FIELDS if not data.get(field)]
+    
+    if missing_fields:
+        return {"valid": False, "missing_fields": missing_fields}
+    
+    try:
+        normalize_measures(data)
+    except InvalidMeasure as e:
+        return {"valid": False, "error": str(e)}
+    
+    return {"valid": True}
+
+def validate_crop_update(data):
+    if not isinstance(data, dict):
+        return {"valid": False, "error": "Crop must be a JSON object"}
+    
+    # An update may leave fields out, but not clear them
+    empty_fields = [field for field in CROP_FIELDS if field in data and not data[field]]
+    if empty_fields:
+        return {"valid": False, "error": f"Required fields cannot be empty: {', '.join(empty_fields)}"}
+    
+    return {"valid": True}
+
+def validation_error(validation):
+    if 'missing_fields' in validation:
+        return f"Missing required fields: {', '.join(validation['missing_fields'])}"
+    return validation['error']
+
+def build_crop_doc(data, user_id, farmer, gazetteer=None):
+    crop_doc = {field: data[field] for field in CROP_FIELDS}
+    crop_doc.update(normalize_measures(data))
+    crop_doc.update({
+        "user_id": user_id,
+        # Farmer contact info is embedded so the marketplace needs no join
+        "farmer": farmer_snapshot(farmer),
+        "status": "active",
+        "created_at": datetime.utcnow()
+    })
+    crop_doc.update(search_terms(crop_doc))
+    
+    # Point for nearby search and place for market rollups, when the
+    # location names a known place
+    found = gazetteer.locate(crop_doc['location']) if gazetteer else None
+    if found:
+        crop_doc['place'], crop_doc['geo'] = found
+    return crop_doc
@@ -1,21 +1,27 @@
 from datetime import datetime
-import bcrypt
+from pymongo import ReturnDocument
 from pymongo.errors import DuplicateKeyError
 
 class User:
-    def __init__(self, db):
-        self.collection = db.users
-        # Create unique index on username
-        self.collection.create_index("username", unique=True)
+    def __init__(self, db, hasher):
+        # Built once per app in create_app; the unique username index is
+        # declared in utils.indexes
+        self.db = db
+        self.hasher = hasher
+    
+    @property
+    def collection(self):
+        # Looked up per use, so building the model does not connect to MongoDB
+        return self.db.users
     
     def create_user(self, user_data):
         # Hash password
-        password_hash = bcrypt.hashpw(user_data['password'].encode('utf-8'), bcrypt.gensalt())
+        password_hash = self.hasher.hash_password(user_data['password'])
         
         # Prepare user document
         user_doc = {
             "username": user_data['username'],
-            "password": password_hash.decode('utf-8'),
+            "password": password_hash,
             "role": user_data['role'],
             "full_name": user_data['full_name'],
             "phone": user_data['phone'],
@@ -25,7 +31,7 @@ class User:
         
         try:
             result = self.collection.insert_one(user_doc)
-            user_doc['_id'] = str(result.inserted_id)
+            user_doc['_id'] = result.inserted_id
             user_doc.pop('password')  # Remove password from response
             return {"success": True, "user": user_doc}
         except DuplicateKeyError:
@@ -43,14 +49,40 @@ class User:
         
         return {"valid": True}
     
+    def update_profile(self, user_id, data):
+        allowed_fields = ['full_name', 'phone', 'location']
+        update_data = {field: data[field] for field in allowed_fields if data.get(field)}
+        
+        if not update_data:
+            return {"success": False, "error": f"Provide at least one of: {', '.join(allowed_fields)}"}
+        
+        update_data['updated_at'] = datetime.utcnow().isoformat() + "Z"
+        user = self.collection.find_one_and_update(
+            {"_id": user_id},
+            {"$set": update_data},
+            projection={"password": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        
+        if not user:
+            return {"success": False, "error": "User not found"}
+        
+        return {"success": True, "user": user}
+    
     def authenticate_user(self, username, password):
         user = self.collection.find_one({"username": username})
         
         if not user:
             return {"success": False, "error": "User not found"}
         
-        if bcrypt.checkpw(password.encode('utf-8'), user['password'].encode('utf-8')):
-            user['_id'] = str(user['_id'])
+        if self.hasher.check_password(password, user['password']):
+            # Upgrade hashes made with a different cost factor
+            if self.hasher.needs_rehash(user['password']):
+                self.collection.update_one(
+                    {"_id": user['_id']},
+                    {"$set": {"password": self.hasher.hash_password(password)}}
+                )
+            
             user.pop('password')  # Remove password from response
             return {"success": True, "user": user}
         else:
@@ -1,13 +1,17 @@
 from flask import Blueprint, request, jsonify, current_app
-from models.user import User
 import jwt
 from datetime import datetime, timedelta
 from bson import ObjectId
-from utils.verify_token import verify_token
+from utils.verify_token import verify_token, current_user
+from utils.passwords import PasswordPoolFull
+from utils.ratelimit import rate_limit
+from utils.background import run_in_background
+from jobs.farmer_snapshots import propagate_farmer_snapshot
 
 auth_bp = Blueprint('auth', __name__)
 
 @auth_bp.route('/register', methods=['POST'])
+@rate_limit('register')
 def register():
     try:
         data = request.get_json(force=True)
@@ -18,8 +22,7 @@ def register():
         return jsonify({"error": "No data provided"}), 400
     
     try:
-        
-        user_model = User(current_app.db)
+        user_model = current_app.users
         
         # Validate user data
         validation = user_model.validate_user_data(data)
@@ -36,7 +39,7 @@ def register():
             
             # Generate JWT token
             payload = {
-                'id': user['_id'],
+                'id': str(user['_id']),
                 'role': user['role'],
                 'exp': datetime.utcnow() + timedelta(days=7)
             }
@@ -50,10 +53,14 @@ def register():
         else:
             return jsonify({"error": result['error']}), 409
             
+    except PasswordPoolFull:
+        return jsonify({"error": "Server is busy, please try again later"}), 503, {"Retry-After": "1"}
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
 @auth_bp.route('/login', methods=['POST'])
+@rate_limit('login')
 def login():
     try:
         data = request.get_json(force=True)
@@ -68,7 +75,7 @@ def login():
         return jsonify({"error": "Username and password are required"}), 400
     
     try:
-        user_model = User(current_app.db)
+        user_model = current_app.users
         
         # Authenticate user
         result = user_model.authenticate_user(data['username'], data['password'])
@@ -78,7 +85,7 @@ def login():
             
             # Generate JWT token
             payload = {
-                'id': user['_id'],
+                'id': str(user['_id']),
                 'role': user['role'],
                 'exp': datetime.utcnow() + timedelta(days=7)
             }
@@ -92,23 +99,59 @@ def login():
         else:
             return jsonify({"error": result['error']}), 401
             
+    except PasswordPoolFull:
+        return jsonify({"error": "Server is busy, please try again later"}), 503, {"Retry-After": "1"}
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
 @auth_bp.route('/profile', methods=['GET'])
 @verify_token
 def get_profile(current_user_id, current_user_role):
     try:
-        user = current_app.db.users.find_one(
-            {"_id": ObjectId(current_user_id)}, 
-            {"password": 0}
-        )
+        user = current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
         
-        user['_id'] = str(user['_id'])
         return jsonify({"user": user}), 200
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
+        return jsonify({"error": "Internal server error"}), 500
+
+@auth_bp.route('/profile', methods=['PUT'])
+@verify_token
+def update_profile(current_user_id, current_user_role):
+    try:
+        data = request.get_json(force=True)
+    except:
+        return jsonify({"error": "Invalid JSON data"}), 400
+    
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+    
+    try:
+        result = current_app.users.update_profile(ObjectId(current_user_id), data)
+        
+        if not result['success']:
+            status = 404 if result['error'] == "User not found" else 400
+            return jsonify({"error": result['error']}), status
+        
+        # Crops carry a copy of the farmer's contact info, refresh it off the request path
+        if current_user_role == "farmer":
+            run_in_background(
+                propagate_farmer_snapshot,
+                current_app.db,
+                ObjectId(current_user_id),
+                on_change=current_app.response_cache.bump_version
+            )
+        
+        return jsonify({
+            "message": "Profile updated successfully",
+            "user": result['user']
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
\ No newline at end of file
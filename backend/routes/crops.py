@@ -1,10 +1,87 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, stream_with_context
 from bson import ObjectId
-from datetime import datetime
-from utils.verify_token import verify_token
+from pymongo import ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, OperationFailure
+from datetime import datetime, timedelta
+import json
+import math
+import queue
+from models.crop import CROP_FIELDS, validate_crop_data, validate_crop_update, validation_error, build_crop_doc, normalize_measures
+from jobs.offer_stats import record_offer, record_offers, refresh_offer_stats, refresh_many_offer_stats
+from jobs.crop_cleanup import delete_crop_offers, close_crop_offers
+from jobs.market_rollups import (
+    MARKET_FIELDS, record_listings, record_listing_change, record_bid_change, record_bids,
+    day_of, summarize_rollups
+)
+from utils.verify_token import verify_token, current_user
+from utils.pagination import parse_limit, encode_cursor, decode_cursor, after_cursor, InvalidCursor
+from utils.search import SEARCH_MODES, normalize_terms, search_terms, term_filter
+from utils.geo import parse_near, parse_radius
+from utils.units import InvalidMeasure
+from utils.cache import cached_response
+from utils.streaming import wants_stream, ndjson_response
+from utils.events import TooManySubscribers
+from utils.concurrency import run_concurrently
+from utils.background import run_in_background
+from utils.uploads import iter_upload_rows, MalformedUpload, UnsupportedUpload
+from utils.ratelimit import rate_limit, charge
 
 crops_bp = Blueprint('crops', __name__)
 
+MARKETPLACE_PROJECTION = {
+    '_id': 1,
+    'crop_type': 1,
+    'quantity': 1,
+    'price': 1,
+    'location': 1,
+    'harvest_date': 1,
+    'created_at': 1,
+    'farmer': 1,
+    'offer_stats': 1
+}
+
+# Marketplace orderings, each served by an index and ending in _id so
+# keyset cursors are unambiguous
+MARKETPLACE_SORTS = {
+    'newest': [('created_at', DESCENDING), ('_id', DESCENDING)],
+    'price': [('price', ASCENDING), ('_id', ASCENDING)],
+    '-price': [('price', DESCENDING), ('_id', DESCENDING)]
+}
+NEARBY_SORT = [('distance_km', ASCENDING), ('_id', ASCENDING)]
+
+def marketplace_cache_key(request):
+    # Streamed exports bypass the cache
+    if wants_stream(request):
+        return None
+    
+    # Normalized filter set, so equivalent searches share a cache entry
+    args = request.args
+    key = {
+        'crop_type': ' '.join(normalize_terms(args.get('crop_type', ''))),
+        'location': ' '.join(normalize_terms(args.get('location', ''))),
+        'match': args.get('match', 'prefix'),
+        'min_price': args.get('min_price', '').strip(),
+        'max_price': args.get('max_price', '').strip(),
+        'near': ' '.join(args.get('near', '').split()),
+        'radius_km': args.get('radius_km', '').strip(),
+        'sort': args.get('sort', ''),
+        'limit': args.get('limit', '').strip(),
+        'cursor': args.get('cursor', '')
+    }
+    return 'marketplace:' + json.dumps(key, sort_keys=True, separators=(',', ':'))
+
+ANALYTICS_GROUPS = ('crop_type', 'location')
+
+def analytics_cache_key(request):
+    args = request.args
+    key = {
+        'crop_type': ' '.join(normalize_terms(args.get('crop_type', ''))),
+        'location': ' '.join(normalize_terms(args.get('location', ''))),
+        'group_by': args.get('group_by', 'crop_type'),
+        'days': args.get('days', '').strip()
+    }
+    return 'analytics:' + json.dumps(key, sort_keys=True, separators=(',', ':'))
+
 @crops_bp.route('/', methods=['POST'])
 @verify_token
 def create_crop(current_user_id, current_user_role):
@@ -20,27 +97,24 @@ def create_crop(current_user_id, current_user_role):
         return jsonify({"error": "No data provided"}), 400
     
     # Validate required fields
-    required_fields = ['crop_type', 'quantity', 'price', 'location', 'harvest_date']
-    missing_fields = [field for field in required_fields if not data.get(field)]
-    
-    if missing_fields:
-        return jsonify({"error": f"Missing required fields: {', '.join(missing_fields)}"}), 400
+    validation = validate_crop_data(data)
+    if not validation['valid']:
+        return jsonify({"error": validation_error(validation)}), 400
     
     try:
+        farmer = current_user()
+        if not farmer:
+            return jsonify({"error": "User not found"}), 404
+        
         # Create crop document
-        crop_doc = {
-            "crop_type": data['crop_type'],
-            "quantity": data['quantity'],
-            "price": data['price'],
-            "location": data['location'],
-            "harvest_date": data['harvest_date'],
-            "user_id": ObjectId(current_user_id),
-            "created_at": datetime.utcnow()
-        }
+        crop_doc = build_crop_doc(data, ObjectId(current_user_id), farmer, current_app.gazetteer)
         
-        result = current_app.db.crops.insert_one(crop_doc)
-        crop_doc['_id'] = str(result.inserted_id)
-        crop_doc['user_id'] = str(crop_doc['user_id'])
+        current_app.db.crops.insert_one(crop_doc)
+        current_app.response_cache.bump_version()
+        run_in_background(
+            record_listings, current_app.db, [crop_doc],
+            on_change=current_app.response_cache.bump_version
+        )
         
         return jsonify({
             "message": "Crop created successfully",
@@ -48,6 +122,94 @@ def create_crop(current_user_id, current_user_role):
         }), 201
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
+        return jsonify({"error": "Internal server error"}), 500
+
+def _record_row_error(report, row_number, error):
+    report['failed'] += 1
+    # Only the first errors are kept so the report size stays bounded
+    if len(report['errors']) < current_app.config['BULK_IMPORT_MAX_ERRORS']:
+        report['errors'].append({"row": row_number, "error": error})
+    else:
+        report['errors_truncated'] = True
+
+def _insert_crop_batch(crop_docs, row_numbers, report):
+    try:
+        current_app.db.crops.insert_many(crop_docs, ordered=False)
+        report['inserted'] += len(crop_docs)
+        inserted = crop_docs
+    except BulkWriteError as e:
+        report['inserted'] += e.details['nInserted']
+        failed = set()
+        for write_error in e.details['writeErrors']:
+            failed.add(write_error['index'])
+            _record_row_error(report, row_numbers[write_error['index']], write_error['errmsg'])
+        inserted = [doc for index, doc in enumerate(crop_docs) if index not in failed]
+    run_in_background(
+        record_listings, current_app.db, inserted,
+        on_change=current_app.response_cache.bump_version
+    )
+
+@crops_bp.route('/bulk', methods=['POST'])
+@verify_token
+def bulk_create_crops(current_user_id, current_user_role):
+    if current_user_role != "farmer":
+        return jsonify({"error": "Only farmers can create crops"}), 403
+    
+    try:
+        rows = iter_upload_rows(request)
+    except UnsupportedUpload as e:
+        return jsonify({"error": str(e)}), 415
+    
+    report = {"inserted": 0, "failed": 0, "errors": [], "errors_truncated": False}
+    
+    try:
+        farmer = current_user()
+        if not farmer:
+            return jsonify({"error": "User not found"}), 404
+        
+        user_id = ObjectId(current_user_id)
+        batch_size = current_app.config['BULK_IMPORT_BATCH_SIZE']
+        crop_docs = []
+        row_numbers = []
+        
+        try:
+            # Rows are validated like create_crop and written in unordered batches
+            for row_number, (row, error) in enumerate(rows, start=1):
+                if error is None:
+                    validation = validate_crop_data(row)
+                    if not validation['valid']:
+                        error = validation_error(validation)
+                if error is not None:
+                    _record_row_error(report, row_number, error)
+                    continue
+                
+                crop_docs.append(build_crop_doc(row, user_id, farmer, current_app.gazetteer))
+                row_numbers.append(row_number)
+                
+                if len(crop_docs) >= batch_size:
+                    _insert_crop_batch(crop_docs, row_numbers, report)
+                    crop_docs = []
+                    row_numbers = []
+            
+            if crop_docs:
+                _insert_crop_batch(crop_docs, row_numbers, report)
+        except (MalformedUpload, UnicodeDecodeError) as e:
+            # Rows before the malformed part are still imported
+            if crop_docs:
+                _insert_crop_batch(crop_docs, row_numbers, report)
+            return jsonify({"error": f"Malformed upload: {e}", "report": report}), 400
+        finally:
+            if report['inserted']:
+                current_app.response_cache.bump_version()
+        
+        return jsonify({
+            "message": "Bulk import finished",
+            "report": report
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
 @crops_bp.route('/<crop_id>', methods=['PUT'])
@@ -64,35 +226,65 @@ def update_crop(current_user_id, current_user_role, crop_id):
     if not data:
         return jsonify({"error": "No data provided"}), 400
     
+    validation = validate_crop_update(data)
+    if not validation['valid']:
+        return jsonify({"error": validation_error(validation)}), 400
+    
     try:
-        # Check if crop exists and belongs to user
-        crop = current_app.db.crops.find_one({
-            "_id": ObjectId(crop_id),
-            "user_id": ObjectId(current_user_id)
-        })
-        
-        if not crop:
-            return jsonify({"error": "Crop not found or access denied"}), 404
-        
         # Update crop document
         update_data = {}
-        allowed_fields = ['crop_type', 'quantity', 'price', 'location', 'harvest_date']
-        
-        for field in allowed_fields:
+        for field in CROP_FIELDS:
             if field in data:
                 update_data[field] = data[field]
         
+        # Same numeric quantity (kg) and price (per kg) as on create
+        try:
+            update_data.update(normalize_measures(data))
+        except InvalidMeasure as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Ownership check, update and read back in one round trip
+        ownership = {
+            "_id": ObjectId(crop_id),
+            "user_id": ObjectId(current_user_id),
+            "status": {"$ne": "deleted"}
+        }
         if update_data:
+            update_data.update(search_terms(update_data))
             update_data['updated_at'] = datetime.utcnow()
-            current_app.db.crops.update_one(
-                {"_id": ObjectId(crop_id)},
-                {"$set": update_data}
+            update = {"$set": update_data}
+            
+            # Re-geocode a moved listing; drop the point if the place is unknown
+            if 'location' in update_data:
+                found = current_app.gazetteer.locate(update_data['location'])
+                if found:
+                    update_data['place'], update_data['geo'] = found
+                else:
+                    update['$unset'] = {"place": "", "geo": ""}
+            
+            # The previous version is needed to move the crop's market rollup
+            previous_crop = current_app.db.crops.find_one_and_update(
+                ownership,
+                update,
+                return_document=ReturnDocument.BEFORE
             )
+            updated_crop = None
+            if previous_crop:
+                updated_crop = dict(previous_crop, **update_data)
+                for field in update.get('$unset', {}):
+                    updated_crop.pop(field, None)
+        else:
+            updated_crop = current_app.db.crops.find_one(ownership)
+        
+        if not updated_crop:
+            return jsonify({"error": "Crop not found or access denied"}), 404
         
-        # Get updated crop
-        updated_crop = current_app.db.crops.find_one({"_id": ObjectId(crop_id)})
-        updated_crop['_id'] = str(updated_crop['_id'])
-        updated_crop['user_id'] = str(updated_crop['user_id'])
+        if update_data:
+            current_app.response_cache.bump_version()
+            run_in_background(
+                record_listing_change, current_app.db, previous_crop, updated_crop,
+                on_change=current_app.response_cache.bump_version
+            )
         
         return jsonify({
             "message": "Crop updated successfully",
@@ -100,6 +292,7 @@ def update_crop(current_user_id, current_user_role, crop_id):
         }), 200
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
 @crops_bp.route('/', methods=['GET'])
@@ -110,17 +303,13 @@ def get_crops(current_user_id, current_user_role):
     
     try:
         crops = list(current_app.db.crops.find(
-            {"user_id": ObjectId(current_user_id)}
+            {"user_id": ObjectId(current_user_id), "status": {"$ne": "deleted"}}
         ).sort("created_at", -1))
         
-        # Convert ObjectIds to strings
-        for crop in crops:
-            crop['_id'] = str(crop['_id'])
-            crop['user_id'] = str(crop['user_id'])
-        
         return jsonify({"crops": crops}), 200
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
 @crops_bp.route('/<crop_id>', methods=['DELETE'])
@@ -130,80 +319,293 @@ def delete_crop(current_user_id, current_user_role, crop_id):
         return jsonify({"error": "Only farmers can delete crops"}), 403
     
     try:
-        result = current_app.db.crops.delete_one({
-            "_id": ObjectId(crop_id),
-            "user_id": ObjectId(current_user_id)
-        })
+        # Soft delete: the crop leaves the marketplace at once, its offers
+        # are removed in the background
+        now = datetime.utcnow()
+        crop = current_app.db.crops.find_one_and_update(
+            {
+                "_id": ObjectId(crop_id),
+                "user_id": ObjectId(current_user_id),
+                "status": {"$ne": "deleted"}
+            },
+            {"$set": {"status": "deleted", "deleted_at": now, "updated_at": now}},
+            projection=MARKET_FIELDS
+        )
         
-        if result.deleted_count == 0:
+        if not crop:
             return jsonify({"error": "Crop not found or access denied"}), 404
         
+        current_app.response_cache.bump_version()
+        run_in_background(
+            record_listings, current_app.db, [crop], -1,
+            on_change=current_app.response_cache.bump_version
+        )
+        run_in_background(
+            delete_crop_offers, current_app.db, crop, current_app.config['OFFER_CLEANUP_BATCH_SIZE'],
+            on_change=current_app.response_cache.bump_version
+        )
+        
         return jsonify({"message": "Crop deleted successfully"}), 200
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
+        return jsonify({"error": "Internal server error"}), 500
+
+@crops_bp.route('/<crop_id>/sold', methods=['POST'])
+@verify_token
+def mark_crop_sold(current_user_id, current_user_role, crop_id):
+    if current_user_role != "farmer":
+        return jsonify({"error": "Only farmers can update crops"}), 403
+    
+    try:
+        # Leaves the marketplace; its offers are closed in the background and
+        # still count in the market analytics
+        now = datetime.utcnow()
+        crop = current_app.db.crops.find_one_and_update(
+            {
+                "_id": ObjectId(crop_id),
+                "user_id": ObjectId(current_user_id),
+                "status": {"$nin": ["sold", "deleted"]}
+            },
+            {"$set": {"status": "sold", "sold_at": now, "updated_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        
+        if not crop:
+            return jsonify({"error": "Crop not found, already sold or access denied"}), 404
+        
+        current_app.response_cache.bump_version()
+        run_in_background(close_crop_offers, current_app.db, crop['_id'], current_app.config['OFFER_CLEANUP_BATCH_SIZE'])
+        
+        return jsonify({
+            "message": "Crop marked as sold",
+            "crop": crop
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
 @crops_bp.route('/marketplace', methods=['GET'])
+@cached_response(marketplace_cache_key)
 def get_marketplace():
     try:
-        # Build query filters
-        query = {}
+        limit = parse_limit(
+            request.args.get('limit'),
+            current_app.config['MARKETPLACE_PAGE_SIZE'],
+            current_app.config['MARKETPLACE_MAX_PAGE_SIZE']
+        )
+    except ValueError:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    
+    match_mode = request.args.get('match', 'prefix')
+    if match_mode not in SEARCH_MODES:
+        return jsonify({"error": f"match must be one of: {', '.join(SEARCH_MODES)}"}), 400
+    
+    sort_name = request.args.get('sort')
+    if sort_name and sort_name not in MARKETPLACE_SORTS:
+        return jsonify({"error": f"sort must be one of: {', '.join(MARKETPLACE_SORTS)}"}), 400
+    
+    # Prices are stored per kg, so the range is per kg too
+    price_range = {}
+    try:
+        for param, operator in (('min_price', '$gte'), ('max_price', '$lte')):
+            if request.args.get(param):
+                price_range[operator] = float(request.args[param])
+                if not math.isfinite(price_range[operator]):
+                    raise ValueError(param)
+    except ValueError:
+        return jsonify({"error": "min_price and max_price must be numbers"}), 400
+    
+    stream = wants_stream(request)
+    
+    # Nearby search: crops within radius_km of a "lat,lon" or place name
+    near = request.args.get('near')
+    if near:
+        if sort_name:
+            return jsonify({"error": "sort cannot be combined with near, nearby crops are sorted by distance"}), 400
+        try:
+            near_point = parse_near(near, current_app.gazetteer)
+        except ValueError:
+            return jsonify({"error": "near must be 'lat,lon' or a known place name"}), 400
+        try:
+            radius_km = parse_radius(
+                request.args.get('radius_km'),
+                current_app.config['MARKETPLACE_DEFAULT_RADIUS_KM'],
+                current_app.config['MARKETPLACE_MAX_RADIUS_KM']
+            )
+        except ValueError:
+            return jsonify({"error": "radius_km must be a positive number"}), 400
+    elif request.args.get('radius_km'):
+        return jsonify({"error": "radius_km requires near"}), 400
+    
+    sort = NEARBY_SORT if near else MARKETPLACE_SORTS[sort_name or 'newest']
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_values = decode_cursor(cursor, sort)
+        except InvalidCursor:
+            return jsonify({"error": "Invalid cursor"}), 400
+    
+    try:
+        # Build query filters; every marketplace index is partial on status
+        query = {'status': 'active'}
+        conditions = []
         
         # Search filters from query parameters
         crop_type = request.args.get('crop_type')
         location = request.args.get('location')
-        min_price = request.args.get('min_price')
-        max_price = request.args.get('max_price')
-        
-        if crop_type:
-            query['crop_type'] = {'$regex': crop_type, '$options': 'i'}
-        if location:
-            query['location'] = {'$regex': location, '$options': 'i'}
-        if min_price:
-            query['price'] = query.get('price', {})
-            query['price']['$gte'] = float(min_price)
-        if max_price:
-            query['price'] = query.get('price', {})
-            query['price']['$lte'] = float(max_price)
-        
-        # Get crops with farmer info
-        pipeline = [
-            {'$match': query},
-            {'$lookup': {
-                'from': 'users',
-                'localField': 'user_id',
-                'foreignField': '_id',
-                'as': 'farmer'
-            }},
-            {'$unwind': '$farmer'},
-            {'$project': {
-                '_id': 1,
-                'crop_type': 1,
-                'quantity': 1,
-                'price': 1,
-                'location': 1,
-                'harvest_date': 1,
-                'created_at': 1,
-                'farmer.full_name': 1,
-                'farmer.phone': 1,
-                'farmer.location': 1
-            }},
-            {'$sort': {'created_at': -1}}
-        ]
         
-        crops = list(current_app.db.crops.aggregate(pipeline))
+        # Text filters match the normalized search terms, never a raw regex
+        for field, value in (('crop_type', crop_type), ('location', location)):
+            if value:
+                condition = term_filter(field, value, match_mode)
+                if condition is None:
+                    if stream:
+                        return ndjson_response([])
+                    return jsonify({"crops": [], "next": None}), 200
+                conditions.append(condition)
+        if price_range:
+            query['price'] = price_range
+        elif sort[0][0] == 'price':
+            # Price order lists numerically priced crops; older free-text
+            # prices are converted by normalize-crop-measures
+            query['price'] = {'$type': 'number'}
+        
+        if cursor and not near:
+            conditions.append(after_cursor(sort, cursor_values))
+        if conditions:
+            query = {'$and': [query] + conditions}
+        
+        if near:
+            return _nearby_crops(query, near_point, radius_km, limit, stream,
+                                 cursor_values if cursor else None)
+        
+        # Export the whole filtered catalog, one document at a time
+        if stream:
+            crops = (current_app.db.crops.find(query, MARKETPLACE_PROJECTION)
+                     .sort(sort)
+                     .batch_size(current_app.config['EXPORT_BATCH_SIZE']))
+            return ndjson_response(crops)
+        
+        # Farmer contact info is denormalized onto crops, so a page is a
+        # single indexed read. One extra row tells whether another page exists.
+        crops = list(current_app.db.crops.find(query, MARKETPLACE_PROJECTION)
+                     .sort(sort)
+                     .limit(limit + 1))
+        
+        next_cursor = None
+        if len(crops) > limit:
+            crops = crops[:limit]
+            next_cursor = encode_cursor(crops[-1], sort)
+        
+        return jsonify({"crops": crops, "next": next_cursor}), 200
         
-        # Convert ObjectIds to strings
-        for crop in crops:
-            crop['_id'] = str(crop['_id'])
+    except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
+        return jsonify({"error": "Internal server error"}), 500
+
+def _geo_near(query, point, min_distance_m, max_distance_m):
+    # $geoNear must be the first stage; it walks the 2dsphere index outwards
+    # from the point, so the work is bounded by the ring, not the catalog
+    return {'$geoNear': {
+        'near': point,
+        'key': 'geo',
+        'spherical': True,
+        'query': query,
+        'distanceField': 'distance_km',
+        'distanceMultiplier': 0.001,
+        'minDistance': min_distance_m,
+        'maxDistance': max_distance_m
+    }}
+
+def _nearby_crops(query, point, radius_km, limit, stream, cursor_values=None):
+    # Skip closer rings in the index; the 1 m slack absorbs the km <-> m
+    # rounding and the exact cut is made on distance_km
+    min_distance = max(0.0, cursor_values[0] * 1000 - 1) if cursor_values else 0.0
+    after = [{'$match': after_cursor(NEARBY_SORT, cursor_values)}] if cursor_values else []
+    projection = {'$project': dict(MARKETPLACE_PROJECTION, distance_km=1)}
+    
+    if stream:
+        crops = current_app.db.crops.aggregate(
+            [_geo_near(query, point, min_distance, radius_km * 1000), *after, projection],
+            batchSize=current_app.config['EXPORT_BATCH_SIZE']
+        )
+        return ndjson_response(crops)
+    
+    # $geoNear already returns crops by distance, so the page is cut there
+    # instead of sorting everything in the radius. Crops geocoded to the same
+    # place are equally far and come in any order: the ring at the page's last
+    # distance is re-read in _id order, which keeps pages stable.
+    crops = list(current_app.db.crops.aggregate([
+        _geo_near(query, point, min_distance, radius_km * 1000), *after, {'$limit': limit + 1}, projection
+    ]))
+    if len(crops) > limit:
+        boundary = crops[-1]['distance_km']
+        crops = [crop for crop in crops if crop['distance_km'] < boundary]
+        crops += current_app.db.crops.aggregate([
+            _geo_near(query, point, max(0.0, boundary * 1000 - 1), boundary * 1000 + 1),
+            {'$match': {'distance_km': boundary}},
+            *after,
+            {'$sort': {'_id': 1}},
+            {'$limit': limit + 1 - len(crops)},
+            projection
+        ])
+    crops.sort(key=lambda crop: (crop['distance_km'], crop['_id']))
+    
+    next_cursor = None
+    if len(crops) > limit:
+        crops = crops[:limit]
+        next_cursor = encode_cursor(crops[-1], NEARBY_SORT)
+    
+    return jsonify({"crops": crops, "next": next_cursor}), 200
+
+@crops_bp.route('/analytics', methods=['GET'])
+@cached_response(analytics_cache_key)
+def market_analytics():
+    try:
+        days = parse_limit(
+            request.args.get('days'),
+            current_app.config['ANALYTICS_DEFAULT_DAYS'],
+            current_app.config['ANALYTICS_MAX_DAYS']
+        )
+    except ValueError:
+        return jsonify({"error": "days must be a positive integer"}), 400
+    
+    group_by = request.args.get('group_by', 'crop_type')
+    if group_by not in ANALYTICS_GROUPS:
+        return jsonify({"error": f"group_by must be one of: {', '.join(ANALYTICS_GROUPS)}"}), 400
+    
+    try:
+        # Reads the daily rollups, a row per day and market, never crops or offers
+        since = day_of(datetime.utcnow()) - timedelta(days=days - 1)
+        query = {'day': {'$gte': since}}
+        for field in ANALYTICS_GROUPS:
+            if request.args.get(field):
+                query[field] = ' '.join(normalize_terms(request.args[field]))
+        # Rollups are kept per gazetteer place, so "Mansoura, Dakahlia" and
+        # "mansoura" are the same market
+        if request.args.get('location'):
+            found = current_app.gazetteer.locate(request.args['location'])
+            if found:
+                query['location'] = found[0]
+        
+        rows = current_app.db.market_daily.find(query, {'_id': 0, 'rebuilt_at': 0, 'updated_at': 0})
         
-        return jsonify({"crops": crops}), 200
+        return jsonify({
+            "days": days,
+            "group_by": group_by,
+            **summarize_rollups(rows, group_by)
+        }), 200
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
 @crops_bp.route('/<crop_id>/offer', methods=['POST'])
 @verify_token
+@rate_limit('offer')
 def create_offer(current_user_id, current_user_role, crop_id):
     if current_user_role != "trader":
         return jsonify({"error": "Only traders can create offers"}), 403
@@ -217,31 +619,50 @@ def create_offer(current_user_id, current_user_role, crop_id):
         return jsonify({"error": "Offered price is required"}), 400
     
     try:
-        # Check if crop exists
-        crop = current_app.db.crops.find_one({"_id": ObjectId(crop_id)})
+        # Check if crop exists and get trader info, at the same time
+        crop, trader = run_concurrently(
+            lambda: current_app.db.crops.find_one(
+                {"_id": ObjectId(crop_id), "status": {"$ne": "deleted"}}, {"user_id": 1, "status": 1}
+            ),
+            current_user
+        )
         if not crop:
             return jsonify({"error": "Crop not found"}), 404
         
-        # Get trader info
-        trader = current_app.db.users.find_one(
-            {"_id": ObjectId(current_user_id)},
-            {"full_name": 1, "phone": 1}
-        )
+        # Crops from before listings had a status are active
+        if crop.get('status', 'active') != 'active':
+            return jsonify({"error": "Crop is no longer available"}), 409
+        
+        if not trader:
+            return jsonify({"error": "User not found"}), 404
         
         # Create offer document
         offer_doc = {
             "crop_id": ObjectId(crop_id),
             "trader_id": ObjectId(current_user_id),
+            # Lets offer events be routed to the crop's farmer
+            "farmer_id": crop['user_id'],
             "offered_price": data['offered_price'],
             "trader_name": trader['full_name'],
             "trader_phone": trader['phone'],
             "created_at": datetime.utcnow()
         }
         
-        result = current_app.db.offers.insert_one(offer_doc)
-        offer_doc['_id'] = str(result.inserted_id)
-        offer_doc['crop_id'] = str(offer_doc['crop_id'])
-        offer_doc['trader_id'] = str(offer_doc['trader_id'])
+        current_app.db.offers.insert_one(offer_doc)
+        
+        # The crop's count, best bid and last bid time move with the offer;
+        # the median follows in the background
+        record_offer(current_app.db, offer_doc['crop_id'], 1, offer_doc['offered_price'], offer_doc['created_at'])
+        current_app.response_cache.bump_version()
+        current_app.offer_events.publish_local(crop['user_id'], 'insert', offer_doc)
+        run_in_background(
+            refresh_offer_stats, current_app.db, offer_doc['crop_id'],
+            on_change=current_app.response_cache.bump_version
+        )
+        run_in_background(
+            record_bid_change, current_app.db, None, offer_doc,
+            on_change=current_app.response_cache.bump_version
+        )
         
         return jsonify({
             "message": "Offer created successfully",
@@ -249,6 +670,125 @@ def create_offer(current_user_id, current_user_role, crop_id):
         }), 201
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
+        return jsonify({"error": "Internal server error"}), 500
+
+@crops_bp.route('/offers/bulk', methods=['POST'])
+@verify_token
+@rate_limit('offer_bulk')
+def bulk_create_offers(current_user_id, current_user_role):
+    if current_user_role != "trader":
+        return jsonify({"error": "Only traders can create offers"}), 403
+    
+    try:
+        data = request.get_json(force=True)
+    except:
+        return jsonify({"error": "Invalid JSON data"}), 400
+    
+    # A list of {crop_id, offered_price}, bare or under "offers"
+    items = data.get('offers') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "A non-empty list of offers is required"}), 400
+    
+    # Each item spends a token of the single offer limit, so no more items
+    # than that limit holds
+    max_items = current_app.config['BULK_OFFER_MAX_ITEMS']
+    offer_capacity = current_app.rate_limiter.capacity('offer')
+    if offer_capacity is not None:
+        max_items = min(max_items, offer_capacity)
+    if len(items) > max_items:
+        return jsonify({"error": f"At most {max_items} offers per request"}), 400
+    
+    limited = charge('offer', len(items))
+    if limited:
+        return limited
+    
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not ObjectId.is_valid(item.get('crop_id')):
+            results[index] = {"index": index, "status": 400, "error": "A valid crop_id is required"}
+        elif not item.get('offered_price'):
+            results[index] = {"index": index, "status": 400, "error": "Offered price is required"}
+        else:
+            valid.append((index, ObjectId(item['crop_id']), item['offered_price']))
+    
+    try:
+        # Every crop in one $in query, the trader once, both at the same time
+        crop_ids = list({crop_id for _, crop_id, _ in valid})
+        crop_list, trader = run_concurrently(
+            lambda: list(current_app.db.crops.find(
+                {"_id": {"$in": crop_ids}, "status": {"$ne": "deleted"}}, dict(MARKET_FIELDS, user_id=1, status=1)
+            )) if crop_ids else [],
+            current_user
+        )
+        if not trader:
+            return jsonify({"error": "User not found"}), 404
+        crops = {crop['_id']: crop for crop in crop_list}
+        
+        now = datetime.utcnow()
+        offer_docs = []
+        indexes = []
+        for index, crop_id, offered_price in valid:
+            crop = crops.get(crop_id)
+            if not crop:
+                results[index] = {"index": index, "status": 404, "error": "Crop not found"}
+                continue
+            if crop.get('status', 'active') != 'active':
+                results[index] = {"index": index, "status": 409, "error": "Crop is no longer available"}
+                continue
+            offer_docs.append({
+                "_id": ObjectId(),
+                "crop_id": crop_id,
+                "trader_id": ObjectId(current_user_id),
+                "farmer_id": crop['user_id'],
+                "offered_price": offered_price,
+                "trader_name": trader['full_name'],
+                "trader_phone": trader['phone'],
+                "created_at": now
+            })
+            indexes.append(index)
+        
+        # One unordered write for the whole batch; a failed insert only
+        # fails its own item
+        failed = set()
+        if offer_docs:
+            try:
+                current_app.db.offers.insert_many(offer_docs, ordered=False)
+            except BulkWriteError as e:
+                failed = {write_error['index'] for write_error in e.details['writeErrors']}
+        
+        created = []
+        for position, (index, offer_doc) in enumerate(zip(indexes, offer_docs)):
+            if position in failed:
+                results[index] = {"index": index, "status": 500, "error": "Offer could not be saved"}
+            else:
+                results[index] = {"index": index, "status": 201, "offer": offer_doc}
+                created.append(offer_doc)
+        
+        if created:
+            record_offers(current_app.db, created)
+            current_app.response_cache.bump_version()
+            for offer_doc in created:
+                current_app.offer_events.publish_local(offer_doc['farmer_id'], 'insert', offer_doc)
+            run_in_background(
+                refresh_many_offer_stats, current_app.db, [offer['crop_id'] for offer in created],
+                on_change=current_app.response_cache.bump_version
+            )
+            run_in_background(
+                record_bids, current_app.db, created, crops,
+                on_change=current_app.response_cache.bump_version
+            )
+        
+        return jsonify({
+            "message": "Bulk offers finished",
+            "created": len(created),
+            "failed": len(items) - len(created),
+            "results": results
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
 @crops_bp.route('/<crop_id>/offers', methods=['GET'])
@@ -259,10 +799,14 @@ def get_crop_offers(current_user_id, current_user_role, crop_id):
     
     try:
         # Check if crop exists and belongs to farmer
-        crop = current_app.db.crops.find_one({
-            "_id": ObjectId(crop_id),
-            "user_id": ObjectId(current_user_id)
-        })
+        crop = current_app.db.crops.find_one(
+            {
+                "_id": ObjectId(crop_id),
+                "user_id": ObjectId(current_user_id),
+                "status": {"$ne": "deleted"}
+            },
+            {"_id": 1}
+        )
         
         if not crop:
             return jsonify({"error": "Crop not found or access denied"}), 404
@@ -272,15 +816,10 @@ def get_crop_offers(current_user_id, current_user_role, crop_id):
             {"crop_id": ObjectId(crop_id)}
         ).sort("offered_price", -1))
         
-        # Convert ObjectIds to strings
-        for offer in offers:
-            offer['_id'] = str(offer['_id'])
-            offer['crop_id'] = str(offer['crop_id'])
-            offer['trader_id'] = str(offer['trader_id'])
-        
         return jsonify({"offers": offers}), 200
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
 @crops_bp.route('/offers/', methods=['GET'])
@@ -293,6 +832,7 @@ def get_offers(current_user_id, current_user_role):
         # Get trader's offers with crop details
         pipeline = [
             {'$match': {'trader_id': ObjectId(current_user_id)}},
+            {'$sort': {'created_at': -1}},
             {'$lookup': {
                 'from': 'crops',
                 'localField': 'crop_id',
@@ -300,24 +840,63 @@ def get_offers(current_user_id, current_user_role):
                 'as': 'crop'
             }},
             {'$unwind': '$crop'},
-            {'$sort': {'created_at': -1}}
+            # Offers of a deleted crop until the background cleanup removes them
+            {'$match': {'crop.status': {'$ne': 'deleted'}}}
         ]
         
-        offers = list(current_app.db.offers.aggregate(pipeline))
+        if wants_stream(request):
+            return ndjson_response(current_app.db.offers.aggregate(
+                pipeline,
+                batchSize=current_app.config['EXPORT_BATCH_SIZE']
+            ))
         
-        # Convert ObjectIds to strings
-        for offer in offers:
-            offer['_id'] = str(offer['_id'])
-            offer['crop_id'] = str(offer['crop_id'])
-            offer['trader_id'] = str(offer['trader_id'])
-            offer['crop']['_id'] = str(offer['crop']['_id'])
-            offer['crop']['user_id'] = str(offer['crop']['user_id'])
+        offers = list(current_app.db.offers.aggregate(pipeline))
         
         return jsonify({"offers": offers}), 200
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
+@crops_bp.route('/offers/events', methods=['GET'])
+@verify_token
+def offer_events(current_user_id, current_user_role):
+    if current_user_role != "farmer":
+        return jsonify({"error": "Only farmers can subscribe to offer events"}), 403
+    
+    events = current_app.offer_events
+    try:
+        subscriber = events.subscribe(current_app.db, current_user_id)
+    except TooManySubscribers:
+        return jsonify({"error": "Too many subscribers, please try again later"}), 503, {"Retry-After": "5"}
+    except OperationFailure:
+        # The change stream could not be opened; the next subscriber retries it
+        current_app.logger.exception("Could not open the offer change stream")
+        return jsonify({"error": "Offer events are unavailable, please try again later"}), 503, {"Retry-After": "5"}
+    
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    
+    # Server-Sent Events: new and updated offers on the farmer's crops are
+    # pushed as they happen, with a comment line as keepalive
+    def generate():
+        try:
+            yield f"retry: {heartbeat * 1000}\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: offer\ndata: {current_app.json.dumps(event)}\n\n"
+        finally:
+            events.unsubscribe(current_user_id, subscriber)
+    
+    return current_app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @crops_bp.route('/offers/<offer_id>', methods=['PUT'])
 @verify_token
 def update_offer(current_user_id, current_user_role, offer_id):
@@ -333,29 +912,39 @@ def update_offer(current_user_id, current_user_role, offer_id):
         return jsonify({"error": "Offered price is required"}), 400
     
     try:
-        # Check if offer exists and belongs to trader
-        offer = current_app.db.offers.find_one({
-            "_id": ObjectId(offer_id),
-            "trader_id": ObjectId(current_user_id)
-        })
+        # Ownership check and update in one round trip; the previous price
+        # is kept so the market rollups can swap it for the new one
+        changes = {
+            "offered_price": data['offered_price'],
+            "updated_at": datetime.utcnow()
+        }
+        previous_offer = current_app.db.offers.find_one_and_update(
+            {
+                "_id": ObjectId(offer_id),
+                "trader_id": ObjectId(current_user_id),
+                "status": {"$ne": "closed"}
+            },
+            {"$set": changes},
+            return_document=ReturnDocument.BEFORE
+        )
         
-        if not offer:
-            return jsonify({"error": "Offer not found or access denied"}), 404
+        if not previous_offer:
+            return jsonify({"error": "Offer not found, closed or access denied"}), 404
         
-        # Update offer
-        current_app.db.offers.update_one(
-            {"_id": ObjectId(offer_id)},
-            {"$set": {
-                "offered_price": data['offered_price'],
-                "updated_at": datetime.utcnow()
-            }}
+        updated_offer = dict(previous_offer, **changes)
+        # A lower price can leave best_offer too high until the refresh
+        record_offer(current_app.db, updated_offer['crop_id'], 0, changes['offered_price'], changes['updated_at'])
+        current_app.response_cache.bump_version()
+        run_in_background(
+            refresh_offer_stats, current_app.db, updated_offer['crop_id'],
+            on_change=current_app.response_cache.bump_version
         )
-        
-        # Get updated offer
-        updated_offer = current_app.db.offers.find_one({"_id": ObjectId(offer_id)})
-        updated_offer['_id'] = str(updated_offer['_id'])
-        updated_offer['crop_id'] = str(updated_offer['crop_id'])
-        updated_offer['trader_id'] = str(updated_offer['trader_id'])
+        run_in_background(
+            record_bid_change, current_app.db, previous_offer, updated_offer,
+            on_change=current_app.response_cache.bump_version
+        )
+        if updated_offer.get('farmer_id'):
+            current_app.offer_events.publish_local(updated_offer['farmer_id'], 'update', updated_offer)
         
         return jsonify({
             "message": "Offer updated successfully",
@@ -363,6 +952,7 @@ def update_offer(current_user_id, current_user_role, offer_id):
         }), 200
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
 
 @crops_bp.route('/offers/<offer_id>', methods=['DELETE'])
@@ -372,15 +962,30 @@ def delete_offer(current_user_id, current_user_role, offer_id):
         return jsonify({"error": "Only traders can delete offers"}), 403
     
     try:
-        result = current_app.db.offers.delete_one({
-            "_id": ObjectId(offer_id),
-            "trader_id": ObjectId(current_user_id)
-        })
+        offer = current_app.db.offers.find_one_and_delete(
+            {
+                "_id": ObjectId(offer_id),
+                "trader_id": ObjectId(current_user_id)
+            },
+            projection={"crop_id": 1, "offered_price": 1, "created_at": 1}
+        )
         
-        if result.deleted_count == 0:
+        if not offer:
             return jsonify({"error": "Offer not found or access denied"}), 404
         
+        record_offer(current_app.db, offer['crop_id'], -1)
+        current_app.response_cache.bump_version()
+        run_in_background(
+            refresh_offer_stats, current_app.db, offer['crop_id'],
+            on_change=current_app.response_cache.bump_version
+        )
+        run_in_background(
+            record_bid_change, current_app.db, offer, None,
+            on_change=current_app.response_cache.bump_version
+        )
+        
         return jsonify({"message": "Offer deleted successfully"}), 200
         
     except Exception as e:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         return jsonify({"error": "Internal server error"}), 500
\ No newline at end of file
@@ -0,0 +1,89 @@
+import os
+
+# The suite runs on the in-process MongoDB stand-in, with cheap password
+# hashes and no rate limits. Set before config is imported.
+os.environ['MONGODB_URI'] = 'memory://'
+os.environ['BCRYPT_ROUNDS'] = '4'
+os.environ['BCRYPT_POOL_WORKERS'] = '0'
+for name in ('LOGIN', 'REGISTER', 'OFFER', 'OFFER_BULK'):
+    os.environ[f'RATELIMIT_{name}'] = 'off'
+
+from concurrent.futures import Future
+import pytest
+import app as app_module
+import routes.auth
+import routes.crops
+
+def _run_now(fn, *args, **kwargs):
+    # run_in_background, finished before the request returns; errors surface
+    # in the test instead of the job log
+    future = Future()
+    future.set_result(fn(*args, **kwargs))
+    return future
+
+@pytest.fixture
+def app(monkeypatch):
+    # A fresh app and empty database per test. Background jobs (index builds,
+    # rollups, offer cleanup) run inline so their writes can be asserted on.
+    for module in (app_module, routes.auth, routes.crops):
+        monkeypatch.setattr(module, 'run_in_background', _run_now)
+    return app_module.create_app()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_user(client):
+    # Registers a user through the API; returns its id, token and auth headers
+    def make_user(username, role, location='Giza'):
+        response = client.post('/api/user/register', json={
+            'username': username,
+            'password': 'password',
+            'role': role,
+            'full_name': username.title(),
+            'phone': '0100000000',
+            'location': location
+        })
+        assert response.status_code == 201, response.get_json()
+        body = response.get_json()
+        return {
+            'id': body['user']['_id'],
+            'token': body['token'],
+            'headers': {'Authorization': f"Bearer {body['token']}"}
+        }
+    return make_user
+
+@pytest.fixture
+def farmer(make_user):
+    return make_user('farmer', 'farmer')
+
+@pytest.fixture
+def trader(make_user):
+    return make_user('trader', 'trader', location='Cairo')
+
+@pytest.fixture
+def make_crop(client, farmer):
+    # Lists a crop as the farmer; fields override the defaults
+    def make_crop(**fields):
+        data = dict({
+            'crop_type': 'Wheat',
+            'quantity': 1000,
+            'price': 8,
+            'location': 'Giza',
+            'harvest_date': '2026-05-01'
+        }, **fields)
+        response = client.post('/api/crops/', json=data, headers=farmer['headers'])
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()['crop']
+    return make_crop
+
+@pytest.fixture
+def crop(make_crop):
+    return make_crop()
+
+@pytest.fixture
+def offer(client, trader, crop):
+    response = client.post(f"/api/crops/{crop['_id']}/offer", json={'offered_price': 9}, headers=trader['headers'])
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['offer']
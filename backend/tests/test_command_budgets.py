@@ -0,0 +1,84 @@
+from collections import Counter
+from contextlib import contextmanager
+import pytest
+import routes.crops
+
+# MongoDB commands each hot endpoint may send on the request path, counted by
+# the metrics command listener. Background jobs are queued, not run, while a
+# request is counted; a budget change should be a deliberate one.
+
+# record_offer: count, best offer and last bid time in one update; the median
+# is refreshed in the background
+STATS_UPDATE = Counter({('crops', 'update'): 1})
+
+@pytest.fixture
+def background_jobs(monkeypatch):
+    jobs = []
+    monkeypatch.setattr(routes.crops, 'run_in_background', lambda fn, *args, **kwargs: jobs.append(fn.__name__))
+    return jobs
+
+@pytest.fixture
+def count_commands(app, background_jobs):
+    # with count_commands() as commands: ... fills a Counter of (collection, command)
+    def totals():
+        return Counter({key: histogram.count for key, histogram in app.metrics.commands.items()})
+    
+    @contextmanager
+    def count_commands():
+        commands = Counter()
+        before = totals()
+        yield commands
+        commands.update(totals() - before)
+    return count_commands
+
+def test_update_crop(client, farmer, crop, count_commands, background_jobs):
+    # Ownership check, update and the previous version in one round trip
+    with count_commands() as commands:
+        response = client.put(f"/api/crops/{crop['_id']}", json={'price': 10, 'location': 'Cairo'}, headers=farmer['headers'])
+    assert response.status_code == 200
+    assert commands == {('crops', 'findAndModify'): 1}
+    assert background_jobs == ['record_listing_change']
+
+def test_update_offer(client, trader, offer, count_commands, background_jobs):
+    with count_commands() as commands:
+        response = client.put(f"/api/crops/offers/{offer['_id']}", json={'offered_price': 11}, headers=trader['headers'])
+    assert response.status_code == 200
+    assert commands == STATS_UPDATE + Counter({('offers', 'findAndModify'): 1})
+    assert background_jobs == ['refresh_offer_stats', 'record_bid_change']
+
+def test_create_offer(client, trader, crop, count_commands, background_jobs):
+    # The crop and the trader are read at the same time
+    with count_commands() as commands:
+        response = client.post(f"/api/crops/{crop['_id']}/offer", json={'offered_price': 12}, headers=trader['headers'])
+    assert response.status_code == 201
+    assert commands == STATS_UPDATE + Counter({('crops', 'find'): 1, ('users', 'find'): 1, ('offers', 'insert'): 1})
+    assert background_jobs == ['refresh_offer_stats', 'record_bid_change']
+
+def test_get_crop_offers(client, farmer, crop, offer, count_commands):
+    with count_commands() as commands:
+        response = client.get(f"/api/crops/{crop['_id']}/offers", headers=farmer['headers'])
+    assert response.status_code == 200
+    assert commands == {('crops', 'find'): 1, ('offers', 'find'): 1}
+
+@pytest.mark.parametrize('items', [1, 30])
+def test_bulk_create_offers_does_not_grow_with_items(client, trader, make_crop, count_commands, background_jobs, items):
+    crop_ids = [make_crop()['_id'] for _ in range(3)]
+    offers = [{'crop_id': crop_ids[i % 3], 'offered_price': 5 + i} for i in range(items)]
+    background_jobs.clear()
+    with count_commands() as commands:
+        response = client.post('/api/crops/offers/bulk', json=offers, headers=trader['headers'])
+    assert response.status_code == 200
+    assert response.get_json()['created'] == items
+    # record_offers is one round trip for all the crops
+    assert commands == STATS_UPDATE + Counter({('crops', 'find'): 1, ('users', 'find'): 1, ('offers', 'insert'): 1})
+    assert background_jobs == ['refresh_many_offer_stats', 'record_bids']
+
+def test_marketplace_page(client, crop, count_commands):
+    with count_commands() as commands:
+        client.get('/api/crops/marketplace?crop_type=whe')
+    assert commands == {('crops', 'find'): 1}
+    
+    # Served from the response cache until a write bumps its version
+    with count_commands() as commands:
+        client.get('/api/crops/marketplace?crop_type=whe')
+    assert commands == {}
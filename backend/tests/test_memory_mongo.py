@@ -0,0 +1,202 @@
+import random
+from datetime import datetime
+import pytest
+from pymongo import monitoring, InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from utils.memory_mongo import MemoryClient
+
+# The stand-in must answer like MongoDB for the operators the app relies on
+
+@pytest.fixture
+def db():
+    return MemoryClient()['test']
+
+def _ids(docs):
+    return [doc['_id'] for doc in docs]
+
+def test_filter_operators(db):
+    db.things.insert_many([
+        {'_id': 1, 'n': 5, 'tags': ['a', 'b'], 'meta': {'kind': 'x'}},
+        {'_id': 2, 'n': 7.5, 'tags': ['b'], 'meta': {'kind': 'y'}},
+        {'_id': 3, 'n': '7', 'tags': []},
+        {'_id': 4, 'n': None}
+    ])
+    find = lambda query: sorted(_ids(db.things.find(query)))
+    
+    assert find({'n': {'$gt': 5}}) == [2]
+    assert find({'n': {'$type': 'number'}}) == [1, 2]
+    assert find({'n': None}) == [4]
+    assert find({'tags': 'b'}) == [1, 2]
+    assert find({'tags': {'$all': ['a', 'b']}}) == [1]
+    assert find({'tags': {'$in': ['a', 'z']}}) == [1]
+    assert find({'tags': {'$size': 0}}) == [3]
+    assert find({'meta.kind': {'$ne': 'x'}}) == [2, 3, 4]
+    assert find({'meta': {'$exists': False}}) == [3, 4]
+    assert find({'$or': [{'_id': 1}, {'n': {'$regex': '^7'}}]}) == [1, 3]
+    assert find({'n': {'$not': {'$gte': 6}}}) == [1, 3, 4]
+
+def test_datetimes_are_stored_at_millisecond_precision(db):
+    db.things.insert_one({'_id': 1, 'at': datetime(2026, 1, 2, 3, 4, 5, 678901)})
+    assert db.things.find_one()['at'] == datetime(2026, 1, 2, 3, 4, 5, 678000)
+    assert db.things.count_documents({'at': datetime(2026, 1, 2, 3, 4, 5, 678999)}) == 1
+
+def test_sort_orders_types_and_missing_fields(db):
+    db.things.insert_many([
+        {'_id': 1, 'n': 'b'}, {'_id': 2, 'n': 3}, {'_id': 3},
+        {'_id': 4, 'n': 'a'}, {'_id': 5, 'n': 1.5}, {'_id': 6, 'n': 3}
+    ])
+    # Missing sorts as null, before numbers, before strings; ties keep the next key
+    assert _ids(db.things.find().sort([('n', 1), ('_id', -1)])) == [3, 5, 6, 2, 4, 1]
+    assert _ids(db.things.find().sort([('n', -1), ('_id', 1)]).skip(1).limit(3)) == [4, 2, 6]
+    assert db.things.find_one({}, sort=[('n', -1)])['_id'] == 1
+
+def test_multikey_sort_uses_the_smallest_element_ascending(db):
+    db.things.insert_many([{'_id': 1, 'v': [5, 1]}, {'_id': 2, 'v': [2, 3]}, {'_id': 3, 'v': 4}])
+    assert _ids(db.things.find().sort('v', 1)) == [1, 2, 3]
+    assert _ids(db.things.find().sort('v', -1)) == [1, 3, 2]
+
+def test_indexed_sort_matches_a_full_sort(db):
+    # The same writes to a collection whose sort an index serves and one without
+    db.indexed.create_index([('n', -1), ('_id', -1)])
+    db.indexed.create_index('tags')
+    rng = random.Random(7)
+    for collection in (db.indexed, db.plain):
+        rng.seed(7)
+        collection.insert_many([{'_id': i, 'n': rng.choice([None, 1, 2.5, 3, 'x']), 'tags': rng.sample('abc', 2)}
+                                for i in range(60)])
+        collection.insert_one({'_id': 60, 'n': [0, 9]})
+        collection.update_many({'_id': {'$lt': 10}}, {'$set': {'n': 4}})
+        collection.delete_many({'_id': {'$gte': 50, '$lt': 55}})
+    
+    for query in ({}, {'n': {'$lt': 3}}, {'n': {'$gte': 2.5, '$lte': 4}}, {'tags': {'$all': ['a', 'b']}}):
+        for order in ([('n', -1), ('_id', -1)], [('n', 1), ('_id', 1)]):
+            expected = _ids(db.plain.find(query).sort(order))
+            assert _ids(db.indexed.find(query).sort(order)) == expected
+            assert _ids(db.indexed.find(query).sort(order).skip(3).limit(5)) == expected[3:8]
+
+def test_unique_index(db):
+    db.users.create_index('username', unique=True)
+    db.users.insert_one({'username': 'a'})
+    with pytest.raises(DuplicateKeyError):
+        db.users.insert_one({'username': 'a'})
+    assert db.users.count_documents({}) == 1
+
+CAIRO = {'type': 'Point', 'coordinates': [31.2357, 30.0444]}
+
+def _geo_crops(db):
+    db.crops.insert_many([
+        {'_id': 'giza', 'status': 'active', 'geo': {'type': 'Point', 'coordinates': [31.2089, 30.0131]}},
+        {'_id': 'cairo', 'status': 'active', 'geo': CAIRO},
+        {'_id': 'alexandria', 'status': 'active', 'geo': {'type': 'Point', 'coordinates': [29.9187, 31.2001]}},
+        {'_id': 'sold', 'status': 'sold', 'geo': CAIRO},
+        {'_id': 'unplaced', 'status': 'active'}
+    ])
+
+def test_geo_near_orders_by_distance_within_range(db):
+    _geo_crops(db)
+    results = list(db.crops.aggregate([{'$geoNear': {
+        'near': CAIRO, 'key': 'geo', 'spherical': True, 'query': {'status': 'active'},
+        'distanceField': 'distance_km', 'distanceMultiplier': 0.001, 'maxDistance': 200000
+    }}]))
+    assert _ids(results) == ['cairo', 'giza', 'alexandria']
+    assert results[0]['distance_km'] == 0
+    assert results[1]['distance_km'] == pytest.approx(4.34, abs=0.01)
+    assert results[2]['distance_km'] == pytest.approx(180.18, abs=0.01)
+
+def test_geo_near_min_distance_and_later_stages(db):
+    _geo_crops(db)
+    results = list(db.crops.aggregate([
+        {'$geoNear': {'near': CAIRO, 'key': 'geo', 'distanceField': 'd', 'minDistance': 1000, 'maxDistance': 10000}},
+        {'$project': {'d': 0}}
+    ]))
+    assert results == [{'_id': 'giza', 'status': 'active', 'geo': {'type': 'Point', 'coordinates': [31.2089, 30.0131]}}]
+
+def test_geo_near_must_be_the_first_stage(db):
+    _geo_crops(db)
+    with pytest.raises(OperationFailure):
+        list(db.crops.aggregate([{'$match': {}}, {'$geoNear': {'near': CAIRO, 'distanceField': 'd'}}]))
+
+def test_geo_near_with_a_2dsphere_index(db):
+    _geo_crops(db)
+    db.crops.insert_one({'_id': 'fiji', 'status': 'active', 'geo': {'type': 'Point', 'coordinates': [179.9, -17.7]}})
+    pipeline = lambda near, distance: [
+        {'$geoNear': {'near': near, 'key': 'geo', 'distanceField': 'd', 'maxDistance': distance, 'query': {'status': 'active'}}},
+        {'$limit': 2}
+    ]
+    unindexed = [_ids(db.crops.aggregate(pipeline(CAIRO, 200000))), _ids(db.crops.aggregate(pipeline([-179.9, -17.7], 50000)))]
+    db.crops.create_index([('geo', '2dsphere')])
+    assert [_ids(db.crops.aggregate(pipeline(CAIRO, 200000))), _ids(db.crops.aggregate(pipeline([-179.9, -17.7], 50000)))] == unindexed
+    assert unindexed == [['cairo', 'giza'], ['fiji']]
+    
+    # Results are copies, not the stored documents
+    result = next(db.crops.aggregate(pipeline(CAIRO, 1000)))
+    result['geo']['coordinates'][0] = 0
+    assert db.crops.find_one({'_id': 'cairo'})['geo'] == CAIRO
+
+def test_merge_when_matched(db):
+    db.target.insert_many([{'_id': 1, 'a': 1, 'b': 1}, {'_id': 2, 'a': 2, 'b': 2}])
+    db.source.insert_many([{'_id': 1, 'a': 10}, {'_id': 3, 'a': 30}])
+    
+    db.source.aggregate([{'$merge': {'into': 'target', 'whenMatched': 'merge', 'whenNotMatched': 'insert'}}])
+    assert list(db.target.find().sort('_id', 1)) == [
+        {'_id': 1, 'a': 10, 'b': 1}, {'_id': 2, 'a': 2, 'b': 2}, {'_id': 3, 'a': 30}
+    ]
+    
+    db.source.aggregate([{'$merge': {'into': 'target', 'whenMatched': 'replace', 'whenNotMatched': 'discard'}}])
+    assert db.target.find_one({'_id': 1}) == {'_id': 1, 'a': 10}
+    
+    db.source.update_one({'_id': 1}, {'$set': {'a': 11}})
+    db.source.aggregate([{'$merge': {'into': 'target', 'whenMatched': 'keepExisting'}}])
+    assert db.target.find_one({'_id': 1}) == {'_id': 1, 'a': 10}
+    
+    with pytest.raises(OperationFailure):
+        db.source.aggregate([{'$merge': {'into': 'target', 'whenMatched': 'fail'}}])
+
+def test_merge_on_other_fields_after_group(db):
+    db.sales.insert_many([{'day': 1, 'kg': 5}, {'day': 1, 'kg': 7}, {'day': 2, 'kg': 1}])
+    db.totals.insert_one({'_id': 'keep', 'day': 1, 'kg': 0, 'note': 'x'})
+    db.sales.aggregate([
+        {'$group': {'_id': '$day', 'kg': {'$sum': '$kg'}}},
+        {'$project': {'_id': 0, 'day': '$_id', 'kg': 1}},
+        {'$merge': {'into': 'totals', 'on': 'day', 'whenMatched': 'merge', 'whenNotMatched': 'insert'}}
+    ])
+    totals = {doc['day']: doc for doc in db.totals.find()}
+    assert totals[1] == {'_id': 'keep', 'day': 1, 'kg': 12, 'note': 'x'}
+    assert totals[2]['kg'] == 1
+
+class _Recorder(monitoring.CommandListener):
+    def __init__(self):
+        self.started_events = []
+        self.outcomes = []
+    
+    def started(self, event):
+        self.started_events.append((event.command_name, event.command[event.command_name]))
+    
+    def succeeded(self, event):
+        self.outcomes.append(('succeeded', event.command_name))
+    
+    def failed(self, event):
+        self.outcomes.append(('failed', event.command_name))
+
+def test_command_listeners_see_each_operation():
+    recorder = _Recorder()
+    db = MemoryClient(event_listeners=[recorder])['test']
+    
+    db.things.insert_one({'_id': 1})
+    cursor = db.things.find({})
+    assert recorder.started_events == [('insert', 'things')]
+    list(cursor)
+    db.things.replace_one({'_id': 1}, {'n': 1})
+    db.things.bulk_write([InsertOne({'_id': 2}), UpdateOne({'_id': 2}, {'$set': {'n': 2}}), DeleteOne({'_id': 1})])
+    db.things.bulk_write([InsertOne({'_id': 3}), DeleteOne({'_id': 2}), InsertOne({'_id': 4})], ordered=False)
+    with pytest.raises(OperationFailure):
+        list(db.things.aggregate([{'$bogus': {}}]))
+    
+    assert recorder.started_events == [
+        ('insert', 'things'), ('find', 'things'), ('update', 'things'),
+        ('insert', 'things'), ('update', 'things'), ('delete', 'things'),
+        ('insert', 'things'), ('delete', 'things'),
+        ('aggregate', 'things')
+    ]
+    assert recorder.outcomes[-1] == ('failed', 'aggregate')
+    assert all(outcome == 'succeeded' for outcome, _ in recorder.outcomes[:-1])
@@ -0,0 +1,43 @@
+from bson import ObjectId
+from jobs import offer_stats
+from jobs.offer_stats import record_offer, refresh_offer_stats
+
+# Per-crop offer stats: $inc/$max on every offer write, the rest recomputed
+# in the background (run inline by the app fixture)
+
+def stats(app, crop):
+    found = app.db.crops.find_one({'_id': ObjectId(crop['_id'])})['offer_stats']
+    return {field: found.get(field) for field in ('offer_count', 'best_offer', 'median_offer')}
+
+def test_offer_writes_keep_the_stats(client, app, make_user, crop):
+    first, second = make_user('first', 'trader'), make_user('second', 'trader')
+    url = f"/api/crops/{crop['_id']}/offer"
+    low = client.post(url, json={'offered_price': 9}, headers=first['headers']).get_json()['offer']
+    high = client.post(url, json={'offered_price': 12}, headers=second['headers']).get_json()['offer']
+    assert stats(app, crop) == {'offer_count': 2, 'best_offer': 12, 'median_offer': 10.5}
+    
+    # Lowering the best offer needs the recomputation
+    client.put(f"/api/crops/offers/{high['_id']}", json={'offered_price': 5}, headers=second['headers'])
+    assert stats(app, crop) == {'offer_count': 2, 'best_offer': 9, 'median_offer': 7}
+    
+    client.delete(f"/api/crops/offers/{low['_id']}", headers=first['headers'])
+    assert stats(app, crop) == {'offer_count': 1, 'best_offer': 5, 'median_offer': 5}
+
+def test_a_refresh_overtaken_by_an_offer_write_is_dropped(app, crop, monkeypatch):
+    crop_id = ObjectId(crop['_id'])
+    read_offers = offer_stats._crop_offers
+    
+    def offer_lands_meanwhile(db, crop_ids):
+        offers = list(read_offers(db, crop_ids))
+        record_offer(db, crop_id, 1, 20)
+        return offers
+    monkeypatch.setattr(offer_stats, '_crop_offers', offer_lands_meanwhile)
+    
+    refresh_offer_stats(app.db, crop_id)
+    assert stats(app, crop) == {'offer_count': 1, 'best_offer': 20, 'median_offer': None}
+
+def test_crop_responses_have_no_stats_version(client, farmer, crop, offer):
+    crops = client.get('/api/crops/', headers=farmer['headers']).get_json()['crops']
+    assert 'offer_stats_version' not in crops[0]
+    response = client.put(f"/api/crops/{crop['_id']}", json={'price': 10}, headers=farmer['headers'])
+    assert 'offer_stats_version' not in response.get_json()['crop']
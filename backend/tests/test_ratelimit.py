@@ -0,0 +1,86 @@
+import pytest
+from utils.ratelimit import LocalBuckets, RateLimiter, parse_rate
+
+# Rate limits and admission control; the rest of the suite runs with both
+# effectively off
+
+@pytest.fixture
+def limits(app):
+    # Replaces the app's limiter with these rules, e.g. limits(login='2/minute')
+    def limits(**rules):
+        app.rate_limiter = RateLimiter({name: parse_rate(rule) for name, rule in rules.items()})
+        return app.rate_limiter
+    return limits
+
+def _from(ip, headers=None):
+    return {'environ_base': {'REMOTE_ADDR': ip}, 'headers': headers or {}}
+
+def test_a_rejected_request_takes_no_tokens():
+    limiter = RateLimiter({'offer': parse_rate('5/minute')})
+    for _ in range(5):
+        assert limiter.check('offer', ['ip:1', 'user:b']) == 0
+    
+    # b's own bucket is empty, so retries from another address are rejected
+    # without spending that address's tokens
+    for _ in range(5):
+        assert limiter.check('offer', ['ip:2', 'user:b']) > 0
+    assert limiter.check('offer', ['ip:2', 'user:c']) == 0
+    assert limiter.limited == 5
+
+def test_a_cost_is_taken_from_every_bucket_or_none():
+    buckets = LocalBuckets(100)
+    assert buckets.take(['ip:1'], 10, 1, cost=8) == 0
+    assert buckets.take(['ip:1', 'user:a'], 10, 1, cost=5) == pytest.approx(3, abs=0.01)
+    assert buckets.take(['user:a'], 10, 1, cost=10) == 0
+
+def test_least_recently_used_buckets_are_evicted():
+    buckets = LocalBuckets(2)
+    buckets.take(['a', 'b', 'c'], 1, 1)
+    assert len(buckets) == 2
+    # 'a' was forgotten, so it starts full again
+    assert buckets.take(['a'], 1, 1) == 0
+
+def test_login_is_limited_per_address(client, farmer, limits):
+    limits(login='2/minute')
+    credentials = {'username': 'farmer', 'password': 'password'}
+    for _ in range(2):
+        assert client.post('/api/user/login', json=credentials, **_from('10.0.0.1')).status_code == 200
+    
+    response = client.post('/api/user/login', json=credentials, **_from('10.0.0.1'))
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == 30
+    assert client.post('/api/user/login', json=credentials, **_from('10.0.0.2')).status_code == 200
+
+def test_offers_are_limited_per_trader(client, make_user, crop, limits):
+    limits(offer='2/minute')
+    first, second = make_user('first', 'trader'), make_user('second', 'trader')
+    url = f"/api/crops/{crop['_id']}/offer"
+    for _ in range(2):
+        assert client.post(url, json={'offered_price': 9}, **_from('10.0.0.1', first['headers'])).status_code == 201
+    
+    for _ in range(3):
+        assert client.post(url, json={'offered_price': 9}, **_from('10.0.0.2', first['headers'])).status_code == 429
+    assert client.post(url, json={'offered_price': 9}, **_from('10.0.0.2', second['headers'])).status_code == 201
+
+def test_bulk_offers_spend_a_token_per_item(client, trader, crop, limits):
+    limits(offer='5/minute', offer_bulk='5/minute')
+    item = {'crop_id': crop['_id'], 'offered_price': 9}
+    
+    response = client.post('/api/crops/offers/bulk', json=[item] * 6, headers=trader['headers'])
+    assert response.status_code == 400
+    assert client.post('/api/crops/offers/bulk', json=[item] * 4, headers=trader['headers']).status_code == 200
+    assert client.post('/api/crops/offers/bulk', json=[item] * 2, headers=trader['headers']).status_code == 429
+    assert client.post(f"/api/crops/{crop['_id']}/offer", json={'offered_price': 9}, headers=trader['headers']).status_code == 201
+
+def test_a_full_worker_sheds_requests(client, app):
+    app.admission.in_flight = app.admission.max_concurrent
+    response = client.get('/api/crops/marketplace')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    # Probes stay answerable
+    assert client.get('/health').status_code == 200
+    assert app.admission.rejected == 1
+    
+    app.admission.in_flight = 0
+    assert client.get('/api/crops/marketplace').status_code == 200
+    assert app.admission.in_flight == 0
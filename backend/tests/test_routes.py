@@ -0,0 +1,188 @@
+import json
+import queue
+from bson import ObjectId
+
+# One or two requests per route: the happy path and the check that guards it
+
+def test_home_and_health(client):
+    assert client.get('/').status_code == 200
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.get_json()['indexes'] == 'ready'
+
+def test_metrics_count_mongodb_commands(client, farmer):
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'agripal_mongo_command_duration_seconds_count{collection="users",command="insert"} 1' in body
+    assert 'agripal_http_requests_total{route="auth.register",method="POST",status="201"} 1' in body
+
+def test_register(client, farmer):
+    response = client.post('/api/user/register', json={
+        'username': 'farmer', 'password': 'x', 'role': 'farmer',
+        'full_name': 'Again', 'phone': '1', 'location': 'Giza'
+    })
+    assert response.status_code == 409
+    response = client.post('/api/user/register', json={'username': 'someone'})
+    assert response.status_code == 400
+
+def test_login(client, farmer):
+    response = client.post('/api/user/login', json={'username': 'farmer', 'password': 'password'})
+    assert response.status_code == 200
+    assert response.get_json()['user']['_id'] == farmer['id']
+    response = client.post('/api/user/login', json={'username': 'farmer', 'password': 'wrong'})
+    assert response.status_code == 401
+
+def test_profile(client, farmer):
+    response = client.get('/api/user/profile', headers=farmer['headers'])
+    assert response.status_code == 200
+    assert 'password' not in response.get_json()['user']
+    assert client.get('/api/user/profile').status_code == 401
+    
+    response = client.put('/api/user/profile', json={'phone': '0111111111'}, headers=farmer['headers'])
+    assert response.status_code == 200
+    assert response.get_json()['user']['phone'] == '0111111111'
+
+def test_create_crop(client, trader, crop):
+    assert crop['price'] == 8.0
+    assert crop['place'] == 'giza'
+    response = client.post('/api/crops/', json={'crop_type': 'Rice'}, headers=trader['headers'])
+    assert response.status_code == 403
+
+def test_bulk_create_crops(client, farmer):
+    rows = [
+        {'crop_type': 'Rice', 'quantity': 5, 'price': 3, 'location': 'Cairo', 'harvest_date': '2026-05-01'},
+        {'crop_type': 'Rice'}
+    ]
+    response = client.post('/api/crops/bulk', data=json.dumps(rows), content_type='application/json',
+                           headers=farmer['headers'])
+    assert response.status_code == 200
+    report = response.get_json()['report']
+    assert (report['inserted'], report['failed']) == (1, 1)
+
+def test_get_crops(client, farmer, crop):
+    response = client.get('/api/crops/', headers=farmer['headers'])
+    assert response.status_code == 200
+    assert [c['_id'] for c in response.get_json()['crops']] == [crop['_id']]
+
+def test_update_crop(client, farmer, trader, crop):
+    response = client.put(f"/api/crops/{crop['_id']}", json={'price': 10, 'location': 'Cairo'}, headers=farmer['headers'])
+    assert response.status_code == 200
+    assert response.get_json()['crop']['price'] == 10.0
+    response = client.put(f"/api/crops/{crop['_id']}", json={'price': 10}, headers=trader['headers'])
+    assert response.status_code == 403
+
+def test_update_crop_cannot_clear_required_fields(client, app, farmer, crop):
+    for update in ({'crop_type': None}, {'location': ''}):
+        response = client.put(f"/api/crops/{crop['_id']}", json=update, headers=farmer['headers'])
+        assert response.status_code == 400
+    stored = app.db.crops.find_one()
+    assert (stored['crop_type'], stored['crop_type_terms']) == ('Wheat', ['wheat'])
+    assert client.get('/api/crops/marketplace?crop_type=none').get_json()['crops'] == []
+
+def test_delete_crop(client, app, farmer, crop, offer):
+    response = client.delete(f"/api/crops/{crop['_id']}", headers=farmer['headers'])
+    assert response.status_code == 200
+    assert app.db.offers.count_documents({}) == 0
+    assert client.delete(f"/api/crops/{crop['_id']}", headers=farmer['headers']).status_code == 404
+
+def test_mark_crop_sold(client, app, farmer, crop, offer):
+    response = client.post(f"/api/crops/{crop['_id']}/sold", headers=farmer['headers'])
+    assert response.status_code == 200
+    assert app.db.offers.find_one()['status'] == 'closed'
+
+def test_marketplace(client, make_crop):
+    older = make_crop(crop_type='Rice')
+    newer = make_crop(crop_type='Wheat')
+    response = client.get('/api/crops/marketplace?limit=1')
+    assert response.status_code == 200
+    page = response.get_json()
+    assert [c['_id'] for c in page['crops']] == [newer['_id']]
+    
+    response = client.get(f"/api/crops/marketplace?limit=1&cursor={page['next']}")
+    assert [c['_id'] for c in response.get_json()['crops']] == [older['_id']]
+    
+    response = client.get('/api/crops/marketplace?crop_type=whe')
+    assert [c['_id'] for c in response.get_json()['crops']] == [newer['_id']]
+    
+    response = client.get('/api/crops/marketplace?near=Cairo&radius_km=50')
+    assert {c['_id'] for c in response.get_json()['crops']} == {older['_id'], newer['_id']}
+    
+    response = client.get('/api/crops/marketplace?stream=1')
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)['_id'] for line in lines] == [newer['_id'], older['_id']]
+    
+    assert client.get('/api/crops/marketplace?sort=cheapest').status_code == 400
+
+def test_analytics(client, crop, offer):
+    response = client.get('/api/crops/analytics?group_by=location')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['summary']['listings'] == 1
+    assert body['summary']['best_bid'] == 9
+    assert [group['location'] for group in body['groups']] == ['giza']
+
+def test_analytics_follow_an_edited_crop(client, farmer, crop, offer):
+    response = client.put(f"/api/crops/{crop['_id']}", json={'crop_type': 'Rice'}, headers=farmer['headers'])
+    assert response.status_code == 200
+    groups = client.get('/api/crops/analytics').get_json()['groups']
+    assert [(group['crop_type'], group['listings'], group['bids'], group['best_bid']) for group in groups] == [
+        ('rice', 1, 1, 9)
+    ]
+
+def test_create_offer(client, farmer, crop, offer):
+    assert offer['crop_id'] == crop['_id']
+    response = client.post(f"/api/crops/{crop['_id']}/offer", json={'offered_price': 9}, headers=farmer['headers'])
+    assert response.status_code == 403
+
+def test_bulk_create_offers(client, trader, crop):
+    items = [{'crop_id': crop['_id'], 'offered_price': 7}, {'crop_id': str(ObjectId()), 'offered_price': 7}]
+    response = client.post('/api/crops/offers/bulk', json=items, headers=trader['headers'])
+    assert response.status_code == 200
+    assert [result['status'] for result in response.get_json()['results']] == [201, 404]
+
+def test_get_crop_offers(client, farmer, trader, crop, offer):
+    response = client.get(f"/api/crops/{crop['_id']}/offers", headers=farmer['headers'])
+    assert response.status_code == 200
+    assert [o['_id'] for o in response.get_json()['offers']] == [offer['_id']]
+    assert client.get(f"/api/crops/{crop['_id']}/offers", headers=trader['headers']).status_code == 403
+
+def test_get_offers(client, trader, crop, offer):
+    response = client.get('/api/crops/offers/', headers=trader['headers'])
+    assert response.status_code == 200
+    offers = response.get_json()['offers']
+    assert [(o['_id'], o['crop']['_id']) for o in offers] == [(offer['_id'], crop['_id'])]
+
+def test_offer_events(client, farmer, trader):
+    response = client.get('/api/crops/offers/events', headers=farmer['headers'], buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert next(response.response).startswith(b'retry:')
+    response.close()
+    assert client.get('/api/crops/offers/events', headers=trader['headers']).status_code == 403
+
+def test_offer_events_without_a_change_stream(client, app, farmer, monkeypatch):
+    # Every subscriber retries a change stream that could not be opened
+    app.offer_events.source = 'change_stream'
+    for _ in range(2):
+        response = client.get('/api/crops/offers/events', headers=farmer['headers'])
+        assert response.status_code == 503
+        assert app.offer_events.stats() == {'mode': None, 'subscribers': 0}
+    
+    # Once it opens, the bus starts on the next subscription; this stream never yields
+    monkeypatch.setattr(app.offer_events, '_open_stream', lambda db: iter(queue.Queue().get, None))
+    response = client.get('/api/crops/offers/events', headers=farmer['headers'], buffered=False)
+    assert response.status_code == 200
+    assert app.offer_events.stats() == {'mode': 'change_stream', 'subscribers': 1}
+    response.close()
+
+def test_update_offer(client, app, trader, crop, offer):
+    response = client.put(f"/api/crops/offers/{offer['_id']}", json={'offered_price': 12}, headers=trader['headers'])
+    assert response.status_code == 200
+    assert app.db.crops.find_one()['offer_stats']['best_offer'] == 12
+    response = client.put(f"/api/crops/offers/{ObjectId()}", json={'offered_price': 12}, headers=trader['headers'])
+    assert response.status_code == 404
+
+def test_delete_offer(client, app, trader, crop, offer):
+    response = client.delete(f"/api/crops/offers/{offer['_id']}", headers=trader['headers'])
+    assert response.status_code == 200
+    assert app.db.crops.find_one()['offer_stats']['offer_count'] == 0
+    assert client.delete(f"/api/crops/offers/{offer['_id']}", headers=trader['headers']).status_code == 404
@@ -0,0 +1,70 @@
+import io
+import json
+import pytest
+from utils import uploads
+from utils.uploads import MalformedUpload, iter_csv, iter_json_array, iter_ndjson
+
+# Streaming parsers for bulk crop uploads, read in small chunks so elements
+# straddle chunk boundaries
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(uploads, 'CHUNK_SIZE', 8)
+    monkeypatch.setattr(uploads, 'MAX_ELEMENT_SIZE', 64)
+
+def rows(reader, data):
+    return list(reader(io.BytesIO(data.encode('utf-8'))))
+
+def test_json_array_elements_split_across_chunks():
+    data = json.dumps([{'crop_type': 'Rice', 'quantity': 12345}, 'é', 3.25])
+    assert rows(iter_json_array, data) == [({'crop_type': 'Rice', 'quantity': 12345}, None), ('é', None), (3.25, None)]
+
+@pytest.mark.parametrize('data, message', [
+    ('{"a": 1}', "Expected a JSON array"),
+    ('[{"crop_type": "Rice"}, {"crop_type": "Wh', "Invalid JSON array"),
+    ('[{"crop_type": "Rice"},', "Unterminated JSON array"),
+    ('[{"crop_type": nope}, {"crop_type": "Rice"}]', "Invalid JSON array"),
+    ('[{"crop_type": "' + 'x' * 100 + '"}]', "Array element is too large")
+])
+def test_malformed_json_arrays(data, message):
+    with pytest.raises(MalformedUpload, match=message):
+        rows(iter_json_array, data)
+
+def test_ndjson_reports_bad_and_oversize_lines_per_row():
+    data = '\n'.join([
+        '{"crop_type": "Rice"}',
+        '{"crop_type": ',
+        '{"crop_type": "' + 'x' * 100 + '"}',
+        '',
+        '{"crop_type": "Wheat"}'
+    ])
+    assert rows(iter_ndjson, data) == [
+        ({'crop_type': 'Rice'}, None),
+        (None, "Invalid JSON"),
+        (None, "Line is too large"),
+        ({'crop_type': 'Wheat'}, None)
+    ]
+
+def test_ndjson_oversize_last_line():
+    data = '{"crop_type": "Rice"}\n' + 'x' * 100
+    assert rows(iter_ndjson, data) == [({'crop_type': 'Rice'}, None), (None, "Line is too large")]
+
+def test_csv_rows():
+    data = 'crop_type,quantity\r\nRice,5\r\n"Wheat, durum",7\r\n'
+    assert rows(iter_csv, data) == [({'crop_type': 'Rice', 'quantity': '5'}, None),
+                                    ({'crop_type': 'Wheat, durum', 'quantity': '7'}, None)]
+
+def test_csv_error_is_a_malformed_upload():
+    data = 'crop_type,quantity\nRice,5\n"' + 'x' * 200000 + '",7\n'
+    with pytest.raises(MalformedUpload, match="Invalid CSV on line"):
+        rows(iter_csv, data)
+
+def test_malformed_csv_keeps_earlier_rows(client, farmer):
+    data = ('crop_type,quantity,price,location,harvest_date\n'
+            'Rice,5,3,Cairo,2026-05-01\n'
+            '"' + 'x' * 200000 + '",5,3,Cairo,2026-05-01\n')
+    response = client.post('/api/crops/bulk', data=data, content_type='text/csv', headers=farmer['headers'])
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body['error'].startswith("Malformed upload: Invalid CSV")
+    assert body['report']['inserted'] == 1
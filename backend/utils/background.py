@@ -0,0 +1,28 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_executor = None
+_pid = None
+
+def _get_executor():
+    # One executor per process so forked gunicorn workers get their own threads
+    global _executor, _pid
+    with _lock:
+        if _pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='agripal-jobs')
+            _pid = os.getpid()
+    return _executor
+
+def _run(fn, args, kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception("Background job %s failed", fn.__name__)
+
+def run_in_background(fn, *args, **kwargs):
+    return _get_executor().submit(_run, fn, args, kwargs)
@@ -0,0 +1,158 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, current_app, make_response
+
+class TTLCache:
+    # Thread-safe LRU with a per-entry expiry
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
+
+class RedisBackend:
+    # Shared entries and catalog version across workers and hosts
+    VERSION_KEY = 'agripal:cache:version'
+    
+    def __init__(self, url, ttl):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_REDIS_URL is set but the 'redis' package is not installed")
+        
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+    
+    def get(self, key):
+        raw = self.client.get('agripal:cache:' + key)
+        if raw is None:
+            return None
+        etag, body = raw.split(b'\n', 1)
+        return body, etag.decode('ascii')
+    
+    def set(self, key, value):
+        body, etag = value
+        self.client.set('agripal:cache:' + key, etag.encode('ascii') + b'\n' + body, ex=self.ttl)
+    
+    def version(self):
+        return int(self.client.get(self.VERSION_KEY) or 0)
+    
+    def bump_version(self):
+        self.client.incr(self.VERSION_KEY)
+
+class ResponseCache:
+    def __init__(self, maxsize, ttl, redis_url=None):
+        self.local = TTLCache(maxsize, ttl)
+        self.shared = RedisBackend(redis_url, ttl) if redis_url else None
+        self.hits = 0
+        self.misses = 0
+        self._version = 0
+    
+    def version(self):
+        return self.shared.version() if self.shared else self._version
+    
+    def bump_version(self):
+        # Entries are keyed by catalog version, so bumping it invalidates them all.
+        # Without a shared backend other workers catch up when their entries expire.
+        self._version += 1
+        if self.shared:
+            self.shared.bump_version()
+        self.local.clear()
+    
+    def get(self, key, version):
+        # Callers read version() once per request and pass it to both get and
+        # set, so a body built before a concurrent bump is stored under the
+        # version it was built from
+        key = f"{version}:{key}"
+        value = self.local.get(key)
+        if value is None and self.shared:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+    
+    def set(self, key, value, version):
+        key = f"{version}:{key}"
+        self.local.set(key, value)
+        if self.shared:
+            self.shared.set(key, value)
+    
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.local),
+            "version": self.version()
+        }
+
+def cached_response(key_func):
+    # Cache successful responses under key_func(request) and answer
+    # If-None-Match with 304 when the ETag still matches.
+    # A key of None skips the cache for that request.
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = key_func(request)
+            if key is None:
+                return f(*args, **kwargs)
+            
+            cache = current_app.response_cache
+            version = cache.version()
+            entry = cache.get(key, version)
+            status = 'HIT'
+            
+            if entry is None:
+                status = 'MISS'
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                
+                body = response.get_data()
+                entry = (body, hashlib.sha1(body).hexdigest())
+                cache.set(key, entry, version)
+            
+            body, etag = entry
+            response = current_app.response_class(body, mimetype='application/json')
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+            response.headers['X-Cache'] = status
+            return response.make_conditional(request)
+        return decorated
+    return decorator
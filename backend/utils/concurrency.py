@@ -0,0 +1,26 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Under gevent workers the threading module is monkey-patched, so these
+# threads are greenlets
+_lock = threading.Lock()
+_executor = None
+_pid = None
+
+def _get_executor():
+    global _executor, _pid
+    with _lock:
+        if _pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='agripal-lookups')
+            _pid = os.getpid()
+    return _executor
+
+def run_concurrently(*calls):
+    # Run independent lookups at the same time and return their results in
+    # order. Each call runs in a copy of the caller's context, so it can use
+    # current_app and g.
+    executor = _get_executor()
+    futures = [executor.submit(contextvars.copy_context().run, call) for call in calls]
+    return [future.result() for future in futures]
@@ -0,0 +1,126 @@
+import logging
+import os
+import queue
+import threading
+import time
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+class TooManySubscribers(Exception):
+    pass
+
+class OfferEventBus:
+    # Fans offer inserts/updates out to the subscribed farmers of this worker.
+    # Fed by one MongoDB change stream per process, or by the routes publishing
+    # locally when change streams are unavailable (standalone mongod).
+    def __init__(self, queue_size, max_subscribers, source='auto'):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.source = source
+        self.mode = None
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._count = 0
+        self._pid = None
+    
+    def start(self, db):
+        # One watcher per worker process, started on first subscription. The
+        # process only counts as started once its source is running, so a
+        # stream that failed to open is retried by the next subscriber.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._subscribers = {}
+            self._count = 0
+            
+            mode = 'local'
+            if self.source != 'local':
+                try:
+                    stream = self._open_stream(db)
+                except OperationFailure:
+                    if self.source == 'change_stream':
+                        raise
+                else:
+                    mode = 'change_stream'
+                    threading.Thread(target=self._watch, args=(db, stream), daemon=True).start()
+            
+            self.mode = mode
+            self._pid = os.getpid()
+    
+    def _open_stream(self, db, resume_after=None):
+        return db.offers.watch(
+            [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace']}}}],
+            full_document='updateLookup',
+            resume_after=resume_after
+        )
+    
+    def _watch(self, db, stream):
+        resume_token = None
+        while True:
+            try:
+                for change in stream:
+                    resume_token = change['_id']
+                    offer = change.get('fullDocument')
+                    if not offer:
+                        continue
+                    
+                    # Offers created before farmer_id was stored need a lookup
+                    farmer_id = offer.get('farmer_id')
+                    if farmer_id is None:
+                        crop = db.crops.find_one({"_id": offer['crop_id']}, {"user_id": 1})
+                        farmer_id = crop and crop['user_id']
+                    if farmer_id is not None:
+                        self._dispatch(str(farmer_id), change['operationType'], offer)
+            except PyMongoError:
+                logger.exception("Offer change stream failed, reopening")
+                time.sleep(1)
+                try:
+                    stream = self._open_stream(db, resume_token)
+                except PyMongoError:
+                    logger.exception("Could not reopen the offer change stream")
+    
+    def _dispatch(self, farmer_id, event_type, offer):
+        event = {"type": event_type, "offer": offer}
+        with self._lock:
+            subscribers = list(self._subscribers.get(farmer_id, ()))
+        
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Slow client: drop its oldest event rather than block the fan-out
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+    
+    def publish_local(self, farmer_id, event_type, offer):
+        # Called by the routes; a no-op when the change stream already delivers
+        # the event or nobody in this process is listening
+        if self._pid != os.getpid() or self.mode != 'local':
+            return
+        self._dispatch(str(farmer_id), event_type, offer)
+    
+    def subscribe(self, db, farmer_id):
+        self.start(db)
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise TooManySubscribers()
+            self._subscribers.setdefault(farmer_id, set()).add(subscriber)
+            self._count += 1
+        return subscriber
+    
+    def unsubscribe(self, farmer_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(farmer_id)
+            if subscribers and subscriber in subscribers:
+                subscribers.discard(subscriber)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[farmer_id]
+    
+    def stats(self):
+        return {"mode": self.mode, "subscribers": self._count}
@@ -0,0 +1,75 @@
+import csv
+import re
+from utils.search import normalize_terms
+
+# "lat,lon" as typed by clients, e.g. "30.04,31.23"
+COORDINATES = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+def geo_point(longitude, latitude):
+    # GeoJSON order is [longitude, latitude]
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+class Gazetteer:
+    # Offline place name -> (place, coordinates) lookup, loaded once per
+    # process. Aliases resolve to the same place as its main name.
+    def __init__(self, places):
+        self.places = places
+        self.max_terms = max((len(key.split()) for key in places), default=0)
+    
+    @classmethod
+    def load(cls, path):
+        places = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                point = (float(row['longitude']), float(row['latitude']))
+                place = ' '.join(normalize_terms(row['name']))
+                names = [row['name']] + [alias for alias in (row.get('aliases') or '').split(';') if alias]
+                for name in names:
+                    key = ' '.join(normalize_terms(name))
+                    if key:
+                        places.setdefault(key, (place, point))
+        return cls(places)
+    
+    def __len__(self):
+        return len(self.places)
+    
+    def locate(self, text):
+        # (place, GeoJSON point) of the first known place in free text, longest
+        # name first at each position, so "Mansoura, Dakahlia" resolves to the
+        # city, not the governorate. place is the normalized main name.
+        terms = normalize_terms(text)
+        for start in range(len(terms)):
+            for end in range(min(len(terms), start + self.max_terms), start, -1):
+                found = self.places.get(' '.join(terms[start:end]))
+                if found:
+                    place, point = found
+                    return place, geo_point(*point)
+        return None
+    
+    def geocode(self, text):
+        found = self.locate(text)
+        return found[1] if found else None
+
+def parse_near(value, gazetteer):
+    # "lat,lon" or a place name known to the gazetteer
+    match = COORDINATES.match(value)
+    if match:
+        latitude, longitude = float(match.group(1)), float(match.group(2))
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError("Coordinates out of range")
+        return geo_point(longitude, latitude)
+    
+    point = gazetteer.geocode(value)
+    if point is None:
+        raise ValueError("Unknown place")
+    return point
+
+def parse_radius(value, default, maximum):
+    if value is None or value == '':
+        return default
+    
+    radius = float(value)
+    if not radius > 0:
+        raise ValueError("radius_km must be a positive number")
+    
+    return min(radius, maximum)
@@ -0,0 +1,177 @@
+from pymongo import IndexModel, ASCENDING, DESCENDING, GEOSPHERE
+from bson import ObjectId
+from datetime import datetime
+from utils.search import term_filter
+
+# Marketplace indexes only cover active crops, so sold and deleted listings
+# cost nothing to skip. Queries must filter on {'status': 'active'} to use them.
+ACTIVE = {'partialFilterExpression': {'status': 'active'}}
+
+def _marketplace_index(keys):
+    name = '_'.join(f'{field}_{direction}' for field, direction in keys) + '_active'
+    return IndexModel(keys, name=name, **ACTIVE)
+
+# Indexes needed by the routes, keyed by collection
+INDEXES = {
+    'users': [
+        IndexModel([('username', ASCENDING)], unique=True),
+    ],
+    'crops': [
+        # Farmer's own listings: find({user_id}).sort(created_at)
+        IndexModel([('user_id', ASCENDING), ('created_at', DESCENDING)]),
+        # Marketplace keyset pagination: sort(created_at, _id)
+        _marketplace_index([('created_at', DESCENDING), ('_id', DESCENDING)]),
+        # Marketplace crop_type / location search, prefix or exact, by
+        # equality on the terms' leading characters
+        _marketplace_index([('crop_type_prefixes', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        _marketplace_index([('location_prefixes', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        # Marketplace sort=price / -price, alone or with a price range
+        _marketplace_index([('price', ASCENDING), ('_id', ASCENDING)]),
+        _marketplace_index([('crop_type_prefixes', ASCENDING), ('price', ASCENDING), ('_id', ASCENDING)]),
+        _marketplace_index([('location_prefixes', ASCENDING), ('price', ASCENDING), ('_id', ASCENDING)]),
+        # Marketplace nearby search: $geoNear on the geocoded location
+        _marketplace_index([('geo', GEOSPHERE)]),
+        # Crops still missing a status, for backfill-crop-status
+        IndexModel([('status', ASCENDING)]),
+    ],
+    'offers': [
+        # Offers on a crop: find({crop_id}).sort(offered_price)
+        IndexModel([('crop_id', ASCENDING), ('offered_price', DESCENDING)]),
+        # Trader portfolio: $match {trader_id} + $sort created_at
+        IndexModel([('trader_id', ASCENDING), ('created_at', DESCENDING)]),
+        # Windowed market rollup rebuilds: $match {created_at: {$gte}}
+        IndexModel([('created_at', DESCENDING)]),
+    ],
+    'market_daily': [
+        # Market analytics over the last N days, overall or for one market
+        IndexModel([('day', ASCENDING)]),
+        IndexModel([('crop_type', ASCENDING), ('day', ASCENDING)]),
+        IndexModel([('location', ASCENDING), ('day', ASCENDING)]),
+    ],
+}
+
+# Replaced indexes, dropped by ensure_indexes
+OBSOLETE_INDEXES = {
+    'crops': [
+        'created_at_-1__id_-1',
+        'crop_type_terms_1_created_at_-1__id_-1',
+        'location_terms_1_created_at_-1__id_-1',
+        'price_1__id_1',
+        'crop_type_terms_1_price_1__id_1',
+        'location_terms_1_price_1__id_1',
+        'geo_2dsphere',
+        'crop_type_terms_1_created_at_-1__id_-1_active',
+        'location_terms_1_created_at_-1__id_-1_active',
+        'crop_type_terms_1_price_1__id_1_active',
+        'location_terms_1_price_1__id_1_active',
+    ],
+}
+
+# Plan stages that mean a query is not served by an index
+BAD_STAGES = {'COLLSCAN', 'SORT'}
+
+def ensure_indexes(db):
+    # create_indexes is a no-op for indexes that already exist with the same spec
+    for collection_name, models in INDEXES.items():
+        db[collection_name].create_indexes(models)
+    
+    # Only after their replacements exist, so queries always have an index
+    for collection_name, names in OBSOLETE_INDEXES.items():
+        existing = db[collection_name].index_information()
+        for name in names:
+            if name in existing:
+                db[collection_name].drop_index(name)
+
+def _explain_find(db, collection_name, query, sort, limit=0):
+    return db[collection_name].find(query).sort(sort).limit(limit).explain()
+
+def _explain_aggregate(db, collection_name, pipeline):
+    return db.command(
+        'explain',
+        {'aggregate': collection_name, 'pipeline': pipeline, 'cursor': {}},
+        verbosity='queryPlanner'
+    )
+
+def _route_queries(db):
+    # Representative shapes of the hot route queries, keep in sync with
+    # routes/crops.py; text filters come from term_filter as in the route
+    some_id = ObjectId()
+    some_day = datetime(2024, 1, 1)
+    return {
+        'crops.get_crops': lambda: _explain_find(
+            db, 'crops', {'user_id': some_id, 'status': {'$ne': 'deleted'}}, [('created_at', DESCENDING)]
+        ),
+        'crops.get_marketplace': lambda: _explain_find(
+            db, 'crops', {'status': 'active'}, [('created_at', DESCENDING), ('_id', DESCENDING)], 21
+        ),
+        'crops.get_marketplace[crop_type]': lambda: _explain_find(
+            db, 'crops', dict(term_filter('crop_type', 'whe'), status='active'), [('created_at', DESCENDING), ('_id', DESCENDING)], 21
+        ),
+        'crops.get_marketplace[crop_type,match=exact]': lambda: _explain_find(
+            db, 'crops', dict(term_filter('crop_type', 'wheat', 'exact'), status='active'),
+            [('created_at', DESCENDING), ('_id', DESCENDING)], 21
+        ),
+        'crops.get_marketplace[location]': lambda: _explain_find(
+            db, 'crops', dict(term_filter('location', 'giz'), status='active'), [('created_at', DESCENDING), ('_id', DESCENDING)], 21
+        ),
+        'crops.get_marketplace[location,long prefix]': lambda: _explain_find(
+            db, 'crops', dict(term_filter('location', 'alexandria governorate'), status='active'),
+            [('created_at', DESCENDING), ('_id', DESCENDING)], 21
+        ),
+        'crops.get_marketplace[sort=price]': lambda: _explain_find(
+            db, 'crops', {'status': 'active', 'price': {'$gte': 5.0, '$lte': 20.0}}, [('price', ASCENDING), ('_id', ASCENDING)], 21
+        ),
+        'crops.get_marketplace[sort=-price]': lambda: _explain_find(
+            db, 'crops', {'status': 'active', 'price': {'$type': 'number'}}, [('price', DESCENDING), ('_id', DESCENDING)], 21
+        ),
+        'crops.get_marketplace[crop_type,sort=price]': lambda: _explain_find(
+            db, 'crops', dict(term_filter('crop_type', 'whe'), status='active', price={'$type': 'number'}),
+            [('price', ASCENDING), ('_id', ASCENDING)], 21
+        ),
+        'crops.get_marketplace[near]': lambda: _explain_aggregate(db, 'crops', [
+            {'$geoNear': {
+                'near': {'type': 'Point', 'coordinates': [31.2, 30.0]},
+                'distanceField': 'distance_km',
+                'maxDistance': 100000,
+                'key': 'geo',
+                'query': {'status': 'active'},
+                'spherical': True
+            }},
+            {'$limit': 21}
+        ]),
+        'crops.get_crop_offers': lambda: _explain_find(
+            db, 'offers', {'crop_id': some_id}, [('offered_price', DESCENDING)]
+        ),
+        'crops.market_analytics': lambda: _explain_find(
+            db, 'market_daily', {'day': {'$gte': some_day}}, [('day', ASCENDING)]
+        ),
+        'crops.market_analytics[crop_type]': lambda: _explain_find(
+            db, 'market_daily', {'day': {'$gte': some_day}, 'crop_type': 'wheat'}, [('day', ASCENDING)]
+        ),
+        'crops.get_offers': lambda: _explain_aggregate(db, 'offers', [
+            {'$match': {'trader_id': some_id}},
+            {'$sort': {'created_at': -1}}
+        ]),
+    }
+
+def _plan_stages(node):
+    # Collect stage names from the winning plan only
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in ('rejectedPlans', 'allPlansExecution'):
+                continue
+            if key == 'stage' and isinstance(value, str):
+                yield value
+            else:
+                yield from _plan_stages(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _plan_stages(item)
+
+def check_query_plans(db):
+    failures = {}
+    for route, explain in _route_queries(db).items():
+        bad_stages = sorted(set(_plan_stages(explain())) & BAD_STAGES)
+        if bad_stages:
+            failures[route] = bad_stages
+    return failures
@@ -0,0 +1,1754 @@
+import functools
+import heapq
+import itertools
+import math
+import random
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import monitoring
+from pymongo import IndexModel, ReturnDocument, InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import BulkWriteError, DuplicateKeyError, InvalidOperation, OperationFailure, WriteError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+# In-process stand-in for the parts of pymongo the app uses, selected with
+# MONGODB_URI=memory://. It covers the queries, updates, sorts and aggregation
+# stages of the routes, jobs and benchmarks ($geoNear, $lookup, $group and
+# $merge included), unique indexes, and hash lookups on indexed fields.
+# Data lives in the process and is lost when it exits. There are no change
+# streams and no query plans. Command listeners passed as event_listeners get
+# an event per operation, named like the command a MongoClient would send.
+
+# Radius MongoDB uses for spherical distances, in meters
+EARTH_RADIUS_M = 6378100
+
+_MISSING = object()
+
+def _store(value):
+    # Copy on the way in, with BSON's effect on values: datetimes are naive
+    # UTC with millisecond precision and tuples become arrays
+    if isinstance(value, dict):
+        return {key: _store(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_store(item) for item in value]
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+def _copy(value):
+    # Copy on the way out, so callers never hold stored documents
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+_RANKS = {type(None): 1, int: 2, float: 2, str: 3, dict: 4, list: 5, bytes: 6, ObjectId: 7, bool: 8, datetime: 9}
+
+def _rank(value):
+    # BSON comparison order of types
+    rank = _RANKS.get(type(value))
+    if rank is not None:
+        return rank
+    if value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+def _sort_key(value):
+    rank = _rank(value)
+    if rank == 1:
+        return (1, 0)
+    if rank == 4:
+        return (4, tuple((key, _sort_key(item)) for key, item in value.items()))
+    if rank == 5:
+        return (5, tuple(_sort_key(item) for item in value))
+    if rank == 10:
+        return (10, str(value))
+    return (rank, value)
+
+def _hash_key(value):
+    # Hashable identity for index lookups and grouping, or None when the value
+    # cannot be hashed (documents, arrays, NaN)
+    rank = _rank(value)
+    if rank in (4, 5, 10) or (rank == 2 and value != value):
+        return None
+    return (rank, None if rank == 1 else value)
+
+def _freeze(value):
+    # Hashable form of any value, for $group keys and hash joins
+    if isinstance(value, dict):
+        return ('doc', tuple((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return ('array', tuple(_freeze(item) for item in value))
+    return _hash_key(value) or ('other', str(value))
+
+def _equal(a, b):
+    if type(a) is type(b) and type(a) in _RANKS:
+        return a == b
+    return _rank(a) == _rank(b) and (_rank(a) == 1 or a == b)
+
+def _compare(a, b):
+    a, b = _sort_key(a), _sort_key(b)
+    return (a > b) - (a < b)
+
+def _get(doc, path):
+    # Value at a dotted path as aggregation expressions see it: through an
+    # array of documents it is the array of their values
+    value = doc
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list):
+            if part.isdigit():
+                index = int(part)
+                value = value[index] if index < len(value) else _MISSING
+            else:
+                value = [item[part] for item in value if isinstance(item, dict) and part in item]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+def _query_values(doc, path):
+    # Values a query condition is tested against: the field and, when it is
+    # an array, each of its elements
+    if '.' not in path:
+        value = doc.get(path, _MISSING) if isinstance(doc, dict) else _MISSING
+        if value is _MISSING:
+            return []
+        return [value] + value if isinstance(value, list) else [value]
+    
+    values = []
+    
+    def walk(value, parts):
+        if not parts:
+            values.append(value)
+            if isinstance(value, list):
+                values.extend(value)
+            return
+        if isinstance(value, dict):
+            if parts[0] in value:
+                walk(value[parts[0]], parts[1:])
+        elif isinstance(value, list):
+            if parts[0].isdigit():
+                index = int(parts[0])
+                if index < len(value):
+                    walk(value[index], parts[1:])
+            for item in value:
+                if isinstance(item, dict):
+                    walk(item, parts)
+    
+    walk(doc, path.split('.'))
+    return values
+
+def _set_path(doc, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if not isinstance(doc.get(part), dict):
+            doc[part] = {}
+        doc = doc[part]
+    doc[parts[-1]] = value
+
+def _unset_path(doc, path):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+TYPE_CHECKS = {
+    'double': lambda v: isinstance(v, float),
+    'int': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'long': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'string': lambda v: isinstance(v, str),
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, list),
+    'objectId': lambda v: isinstance(v, ObjectId),
+    'bool': lambda v: isinstance(v, bool),
+    'date': lambda v: isinstance(v, datetime),
+    'null': lambda v: v is None,
+}
+
+def _regex(pattern, options=''):
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for option, flag in (('i', re.IGNORECASE), ('m', re.MULTILINE), ('s', re.DOTALL), ('x', re.VERBOSE)):
+        if option in options:
+            flags |= flag
+    return re.compile(pattern, flags)
+
+def _equals_test(target):
+    # Equality against a query field's values; None also matches a missing field
+    if isinstance(target, re.Pattern):
+        return lambda values: any(isinstance(value, str) and target.search(value) for value in values)
+    if target is None:
+        return lambda values: not values or any(value is None for value in values)
+    return lambda values: any(_equal(value, target) for value in values)
+
+class _InList:
+    # $in/$nin operand, hashable values in a set and the rest tested one by one
+    def __init__(self, items):
+        self.keys = set()
+        self.others = []
+        for item in items:
+            key = _hash_key(item)
+            if key is None or key[0] == 1:
+                self.others.append(_equals_test(item))
+            else:
+                self.keys.add(key)
+    
+    def __call__(self, values):
+        if any(_hash_key(value) in self.keys for value in values):
+            return True
+        return any(test(values) for test in self.others)
+
+def _range_test(operator, argument):
+    # Only values of the same type bracket compare, as in MongoDB
+    rank, bound = _rank(argument), _sort_key(argument)
+    check = {
+        '$gt': lambda key: key > bound, '$gte': lambda key: key >= bound,
+        '$lt': lambda key: key < bound, '$lte': lambda key: key <= bound
+    }[operator]
+    return lambda values: any(
+        _rank(value) == rank and check(_sort_key(value)) for value in values if not isinstance(value, list)
+    )
+
+def _operator_test(operator, argument, condition):
+    if operator == '$eq':
+        return _equals_test(argument)
+    if operator == '$ne':
+        test = _equals_test(argument)
+        return lambda values: not test(values)
+    if operator in ('$gt', '$gte', '$lt', '$lte'):
+        return _range_test(operator, argument)
+    if operator == '$in':
+        return _InList(argument)
+    if operator == '$nin':
+        test = _InList(argument)
+        return lambda values: not test(values)
+    if operator == '$exists':
+        return lambda values: bool(values) == bool(argument)
+    if operator == '$all':
+        tests = [_equals_test(item) for item in argument]
+        return lambda values: bool(tests) and all(test(values) for test in tests)
+    if operator == '$regex':
+        pattern = _regex(argument, condition.get('$options', ''))
+        return lambda values: any(isinstance(value, str) and pattern.search(value) for value in values)
+    if operator == '$type':
+        checks = [TYPE_CHECKS[name] for name in (argument if isinstance(argument, list) else [argument])]
+        return lambda values: any(check(value) for check in checks for value in values)
+    if operator == '$size':
+        return lambda values: any(isinstance(value, list) and len(value) == argument for value in values)
+    if operator == '$not':
+        test = _condition_test(argument) if isinstance(argument, dict) else _equals_test(_regex(argument))
+        return lambda values: not test(values)
+    if operator == '$elemMatch':
+        if _is_operator_doc(argument):
+            element = _condition_test(argument)
+            matches = lambda item: element([item])
+        else:
+            document = _compile(argument)
+            matches = lambda item: isinstance(item, dict) and document(item)
+        return lambda values: any(
+            isinstance(value, list) and any(matches(item) for item in value) for value in values
+        )
+    raise OperationFailure(f"Unsupported query operator {operator}")
+
+def _is_operator_doc(condition):
+    return isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)
+
+def _condition_test(condition):
+    # Test over the values of one query field
+    if not _is_operator_doc(condition):
+        return _equals_test(condition)
+    tests = [
+        _operator_test(operator, argument, condition)
+        for operator, argument in condition.items() if operator != '$options'
+    ]
+    if len(tests) == 1:
+        return tests[0]
+    return lambda values: all(test(values) for test in tests)
+
+def _compile(query):
+    # A query as a function of a document, so operators, patterns and $in
+    # sets are worked out once rather than for every document
+    tests = []
+    for key, condition in query.items():
+        if key in ('$and', '$or', '$nor'):
+            parts = [_compile(part) for part in condition]
+            if key == '$and':
+                tests.append(lambda doc, parts=parts: all(part(doc) for part in parts))
+            elif key == '$or':
+                tests.append(lambda doc, parts=parts: any(part(doc) for part in parts))
+            else:
+                tests.append(lambda doc, parts=parts: not any(part(doc) for part in parts))
+        elif key == '$expr':
+            tests.append(lambda doc, expression=condition: _truthy(_eval(expression, doc, {})))
+        elif key.startswith('$'):
+            raise OperationFailure(f"Unsupported query operator {key}")
+        else:
+            test = _condition_test(condition)
+            tests.append(lambda doc, path=key, test=test: test(_query_values(doc, path)))
+    if len(tests) == 1:
+        return tests[0]
+    return lambda doc: all(test(doc) for test in tests)
+
+def _conjuncts(query):
+    # Top-level conditions that must all hold, looking through $and
+    for key, condition in query.items():
+        if key == '$and':
+            for part in condition:
+                yield from _conjuncts(part)
+        elif not key.startswith('$'):
+            yield key, condition
+
+def _lookup_targets(condition):
+    # Values an equality or $in condition selects, or None when an index
+    # lookup cannot answer it exactly
+    if _is_operator_doc(condition):
+        if set(condition) == {'$eq'}:
+            targets = [condition['$eq']]
+        elif set(condition) == {'$in'}:
+            targets = list(condition['$in'])
+        else:
+            return None
+    elif isinstance(condition, dict):
+        return None
+    else:
+        targets = [condition]
+    keys = [_hash_key(target) for target in targets]
+    if any(key is None or key[0] == 1 for key in keys):
+        return None
+    return keys
+
+def _all_targets(condition):
+    # Values an $all condition requires, or None when an index lookup cannot
+    # answer it exactly
+    if not _is_operator_doc(condition) or set(condition) != {'$all'} or not condition['$all']:
+        return None
+    keys = [_hash_key(target) for target in condition['$all']]
+    if any(key is None or key[0] == 1 for key in keys):
+        return None
+    return keys
+
+def _project(doc, projection):
+    if not projection:
+        return doc
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    
+    fields = {field: flag for field, flag in projection.items() if field != '_id'}
+    include_id = projection.get('_id', 1)
+    
+    if any(fields.values()):
+        result = {}
+        if include_id and '_id' in doc:
+            result['_id'] = doc['_id']
+        for path in fields:
+            value = _get(doc, path)
+            if value is not _MISSING:
+                _set_path(result, path, value)
+        return result
+    
+    result = dict(doc)
+    for path in fields:
+        if '.' in path:
+            head = path.split('.')[0]
+            if isinstance(result.get(head), dict):
+                result[head] = _copy(result[head])
+                _unset_path(result, path)
+        else:
+            result.pop(path, None)
+    if not include_id:
+        result.pop('_id', None)
+    return result
+
+def _sort_spec(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(key, value) for key, value in key_or_list]
+
+class _SortKey:
+    # Orders documents by several fields with mixed directions
+    __slots__ = ('values', 'directions')
+    
+    def __init__(self, doc, spec):
+        self.directions = [direction for _, direction in spec]
+        self.values = []
+        for field, direction in spec:
+            value = _get(doc, field)
+            # Arrays sort by their smallest element ascending, largest descending
+            if isinstance(value, list) and value:
+                pick = min if direction == 1 else max
+                value = pick(value, key=_sort_key)
+            self.values.append(_sort_key(value))
+    
+    def __lt__(self, other):
+        for mine, theirs, direction in zip(self.values, other.values, self.directions):
+            if mine != theirs:
+                return (mine < theirs) if direction == 1 else (mine > theirs)
+        return False
+
+def _sorted(docs, spec, limit=0):
+    key = lambda doc: _SortKey(doc, spec)
+    if limit:
+        return heapq.nsmallest(limit, docs, key=key)
+    return sorted(docs, key=key)
+
+def _range(query, field):
+    # Lowest and highest sort keys top-level range conditions allow on field
+    lower = upper = None
+    for name, condition in _conjuncts(query):
+        if name != field or not _is_operator_doc(condition):
+            continue
+        for operator, bound in condition.items():
+            key = _sort_key(bound)
+            if operator in ('$gt', '$gte') and (lower is None or key > lower):
+                lower = key
+            elif operator in ('$lt', '$lte') and (upper is None or key < upper):
+                upper = key
+    return lower, upper
+
+class _SortedIndex:
+    # Ids of a collection kept in one sort order, so a sorted query walks them
+    # from the start of its range and stops at its limit instead of matching
+    # and sorting every document
+    def __init__(self, spec, docs):
+        self.spec = spec
+        self.field, self.direction = spec[0]
+        # Documents whose leading field is an array sort by one element only,
+        # so range bounds can't skip them
+        self.arrays = 0
+        self.keys = []
+        self.ids = []
+        for doc in sorted(docs, key=lambda doc: _SortKey(doc, spec)):
+            self.keys.append(_SortKey(doc, spec))
+            self.ids.append(doc['_id'])
+            self.arrays += isinstance(_get(doc, self.field), list)
+    
+    def add(self, doc):
+        key = _SortKey(doc, self.spec)
+        position = bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.ids.insert(position, doc['_id'])
+        self.arrays += isinstance(_get(doc, self.field), list)
+    
+    def remove(self, doc):
+        position = bisect_left(self.keys, _SortKey(doc, self.spec))
+        while self.ids[position] != doc['_id']:
+            position += 1
+        del self.keys[position]
+        del self.ids[position]
+        self.arrays -= isinstance(_get(doc, self.field), list)
+    
+    def _first(self, holds):
+        # First position from which holds(leading key) is true
+        low, high = 0, len(self.keys)
+        while low < high:
+            middle = (low + high) // 2
+            if holds(self.keys[middle].values[0]):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+    
+    def walk(self, query):
+        # Ids in sort order, narrowed to a range on the leading field
+        start, stop = 0, len(self.ids)
+        lower, upper = _range(query, self.field) if not self.arrays else (None, None)
+        if self.direction == 1:
+            if lower is not None:
+                start = self._first(lambda key: key >= lower)
+            if upper is not None:
+                stop = self._first(lambda key: key > upper)
+        else:
+            if upper is not None:
+                start = self._first(lambda key: key <= upper)
+            if lower is not None:
+                stop = self._first(lambda key: key < lower)
+        return itertools.islice(self.ids, start, stop)
+
+def _truthy(value):
+    return value not in (None, False, 0, _MISSING)
+
+def _value(value):
+    return None if value is _MISSING else value
+
+def _args(argument, doc, variables):
+    if not isinstance(argument, list):
+        argument = [argument]
+    return [_value(_eval(item, doc, variables)) for item in argument]
+
+def _date_arg(argument, doc, variables):
+    if isinstance(argument, dict) and 'date' in argument:
+        argument = argument['date']
+    return _value(_eval(argument, doc, variables))
+
+def _convert(value, to):
+    if to in ('double', 'decimal'):
+        if isinstance(value, datetime):
+            return (value - datetime(1970, 1, 1)).total_seconds() * 1000
+        if isinstance(value, str):
+            value = value.strip()
+        return float(value)
+    if to in ('int', 'long'):
+        if isinstance(value, str):
+            return int(value.strip())
+        return int(value)
+    if to == 'string':
+        return str(value)
+    if to == 'bool':
+        return _truthy(value)
+    if to == 'objectId':
+        return ObjectId(value)
+    if to == 'date':
+        if isinstance(value, datetime):
+            return value
+        return datetime(1970, 1, 1) + timedelta(milliseconds=value)
+    raise OperationFailure(f"Unsupported $convert target {to}")
+
+def _op_convert(argument, doc, variables):
+    value = _value(_eval(argument['input'], doc, variables))
+    if value is None:
+        return argument.get('onNull')
+    try:
+        return _convert(value, argument['to'])
+    except (TypeError, ValueError, OverflowError):
+        if 'onError' in argument:
+            return argument['onError']
+        raise OperationFailure(f"Failed to convert {value!r} to {argument['to']}")
+
+def _op_cond(argument, doc, variables):
+    if isinstance(argument, dict):
+        argument = [argument['if'], argument['then'], argument['else']]
+    condition, then, otherwise = argument
+    return _eval(then if _truthy(_eval(condition, doc, variables)) else otherwise, doc, variables)
+
+def _op_reduce(argument, doc, variables):
+    items = _value(_eval(argument['input'], doc, variables))
+    if items is None:
+        return None
+    accumulated = _eval(argument['initialValue'], doc, variables)
+    for item in items:
+        accumulated = _eval(argument['in'], doc, dict(variables, value=accumulated, this=item))
+    return accumulated
+
+def _op_concat(argument, doc, variables):
+    parts = _args(argument, doc, variables)
+    if any(part is None for part in parts):
+        return None
+    return ''.join(parts)
+
+def _op_if_null(argument, doc, variables):
+    values = _args(argument, doc, variables)
+    for value in values[:-1]:
+        if value is not None:
+            return value
+    return values[-1]
+
+def _op_date_from_parts(argument, doc, variables):
+    parts = {key: _value(_eval(value, doc, variables)) for key, value in argument.items()}
+    if any(value is None for value in parts.values()):
+        return None
+    return datetime(parts['year'], parts.get('month', 1), 1) + timedelta(
+        days=parts.get('day', 1) - 1, hours=parts.get('hour', 0), minutes=parts.get('minute', 0),
+        seconds=parts.get('second', 0), milliseconds=parts.get('millisecond', 0)
+    )
+
+def _op_date_to_string(argument, doc, variables):
+    moment = _value(_eval(argument['date'], doc, variables))
+    if moment is None:
+        return argument.get('onNull')
+    fmt = argument.get('format', '%Y-%m-%dT%H:%M:%S.%LZ')
+    return moment.strftime(fmt.replace('%L', f'{moment.microsecond // 1000:03d}'))
+
+def _date_part(part):
+    def operator(argument, doc, variables):
+        moment = _date_arg(argument, doc, variables)
+        return None if moment is None else getattr(moment, part)
+    return operator
+
+def _arithmetic(argument, doc, variables, combine):
+    values = _args(argument, doc, variables)
+    if any(value is None for value in values):
+        return None
+    result = values[0]
+    for value in values[1:]:
+        result = combine(result, value)
+    return result
+
+def _subtract(a, b):
+    if isinstance(a, datetime) and isinstance(b, datetime):
+        return (a - b).total_seconds() * 1000
+    if isinstance(a, datetime):
+        return a - timedelta(milliseconds=b)
+    return a - b
+
+def _add(a, b):
+    if isinstance(a, datetime):
+        return a + timedelta(milliseconds=b)
+    if isinstance(b, datetime):
+        return b + timedelta(milliseconds=a)
+    return a + b
+
+def _comparison(test):
+    def operator(argument, doc, variables):
+        a, b = _args(argument, doc, variables)
+        return test(_compare(a, b))
+    return operator
+
+def _extreme(pick):
+    def operator(argument, doc, variables):
+        values = _args(argument, doc, variables)
+        if len(values) == 1 and isinstance(values[0], list):
+            values = values[0]
+        values = [value for value in values if value is not None]
+        return pick(values, key=_sort_key) if values else None
+    return operator
+
+OPERATORS = {
+    '$literal': lambda argument, doc, variables: argument,
+    '$concat': _op_concat,
+    '$cond': _op_cond,
+    '$ifNull': _op_if_null,
+    '$reduce': _op_reduce,
+    '$convert': _op_convert,
+    '$toDouble': lambda a, d, v: _op_convert({'input': a, 'to': 'double'}, d, v),
+    '$toInt': lambda a, d, v: _op_convert({'input': a, 'to': 'int'}, d, v),
+    '$toString': lambda a, d, v: _op_convert({'input': a, 'to': 'string'}, d, v),
+    '$eq': _comparison(lambda c: c == 0),
+    '$ne': _comparison(lambda c: c != 0),
+    '$gt': _comparison(lambda c: c > 0),
+    '$gte': _comparison(lambda c: c >= 0),
+    '$lt': _comparison(lambda c: c < 0),
+    '$lte': _comparison(lambda c: c <= 0),
+    '$and': lambda a, d, v: all(_truthy(value) for value in _args(a, d, v)),
+    '$or': lambda a, d, v: any(_truthy(value) for value in _args(a, d, v)),
+    '$not': lambda a, d, v: not _truthy(_args(a, d, v)[0]),
+    '$in': lambda a, d, v: (lambda value, array: any(_equal(value, item) for item in array))(*_args(a, d, v)),
+    '$size': lambda a, d, v: len(_args(a, d, v)[0]),
+    '$add': lambda a, d, v: _arithmetic(a, d, v, _add),
+    '$subtract': lambda a, d, v: _arithmetic(a, d, v, _subtract),
+    '$multiply': lambda a, d, v: _arithmetic(a, d, v, lambda x, y: x * y),
+    '$divide': lambda a, d, v: _arithmetic(a, d, v, lambda x, y: x / y),
+    '$max': _extreme(max),
+    '$min': _extreme(min),
+    '$dateFromParts': _op_date_from_parts,
+    '$dateToString': _op_date_to_string,
+    '$year': _date_part('year'),
+    '$month': _date_part('month'),
+    '$dayOfMonth': _date_part('day'),
+    '$hour': _date_part('hour'),
+    '$minute': _date_part('minute'),
+    '$second': _date_part('second'),
+}
+
+def _eval(expression, doc, variables):
+    if isinstance(expression, str):
+        if expression.startswith('$$'):
+            name, _, path = expression[2:].partition('.')
+            value = doc if name in ('ROOT', 'CURRENT') else variables.get(name, _MISSING)
+            return _get(value, path) if path and value is not _MISSING else value
+        if expression.startswith('$'):
+            return _get(doc, expression[1:])
+        return expression
+    if isinstance(expression, list):
+        return [_value(_eval(item, doc, variables)) for item in expression]
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            (operator, argument), = expression.items()
+            if operator.startswith('$'):
+                function = OPERATORS.get(operator)
+                if function is None:
+                    raise OperationFailure(f"Unsupported expression operator {operator}")
+                return function(argument, doc, variables)
+        result = {}
+        for key, value in expression.items():
+            value = _eval(value, doc, variables)
+            if value is not _MISSING:
+                result[key] = value
+        return result
+    return expression
+
+class _Accumulator:
+    def __init__(self, operator, expression):
+        self.operator = operator
+        self.expression = expression
+        self.values = []
+    
+    def add(self, doc):
+        value = _eval(self.expression, doc, {}) if self.expression != {} else 1
+        self.values.append(value)
+    
+    def result(self):
+        values = [value for value in self.values if value is not _MISSING]
+        if self.operator == '$sum':
+            return sum(value for value in values if _rank(value) == 2)
+        if self.operator == '$count':
+            return len(self.values)
+        if self.operator == '$avg':
+            numbers = [value for value in values if _rank(value) == 2]
+            return sum(numbers) / len(numbers) if numbers else None
+        if self.operator in ('$min', '$max'):
+            present = [value for value in values if value is not None]
+            pick = min if self.operator == '$min' else max
+            return pick(present, key=_sort_key) if present else None
+        if self.operator == '$first':
+            return _value(self.values[0]) if self.values else None
+        if self.operator == '$last':
+            return _value(self.values[-1]) if self.values else None
+        if self.operator == '$push':
+            return values
+        if self.operator == '$addToSet':
+            unique = {}
+            for value in values:
+                unique.setdefault(_freeze(value), value)
+            return list(unique.values())
+        raise OperationFailure(f"Unsupported accumulator {self.operator}")
+
+def _stage_group(docs, spec):
+    groups = {}
+    for doc in docs:
+        key = _value(_eval(spec['_id'], doc, {}))
+        group = groups.get(_freeze(key))
+        if group is None:
+            group = groups[_freeze(key)] = (key, {
+                field: _Accumulator(*next(iter(accumulator.items())))
+                for field, accumulator in spec.items() if field != '_id'
+            })
+        for accumulator in group[1].values():
+            accumulator.add(doc)
+    return [
+        dict({'_id': key}, **{field: accumulator.result() for field, accumulator in accumulators.items()})
+        for key, accumulators in groups.values()
+    ]
+
+def _stage_project(docs, spec):
+    fields = {field: value for field, value in spec.items() if field != '_id'}
+    if fields and all(value in (0, False) for value in fields.values()) and spec.get('_id', 0) in (0, 1, False, True):
+        return [_project(doc, spec) for doc in docs]
+    
+    results = []
+    for doc in docs:
+        result = {}
+        id_spec = spec.get('_id', 1)
+        if id_spec in (1, True):
+            if '_id' in doc:
+                result['_id'] = doc['_id']
+        elif id_spec not in (0, False):
+            result['_id'] = _value(_eval(id_spec, doc, {}))
+        for field, value in fields.items():
+            if value in (1, True):
+                found = _get(doc, field)
+                if found is not _MISSING:
+                    _set_path(result, field, found)
+            else:
+                computed = _eval(value, doc, {})
+                if computed is not _MISSING:
+                    _set_path(result, field, computed)
+        results.append(result)
+    return results
+
+def _stage_add_fields(docs, spec):
+    for doc in docs:
+        for field, expression in spec.items():
+            value = _eval(expression, doc, {})
+            if value is not _MISSING:
+                _set_path(doc, field, _copy(value))
+    return docs
+
+def _stage_unwind(docs, spec):
+    if isinstance(spec, str):
+        spec = {'path': spec}
+    path = spec['path'][1:]
+    keep_empty = spec.get('preserveNullAndEmptyArrays', False)
+    index_field = spec.get('includeArrayIndex')
+    
+    for doc in docs:
+        value = _get(doc, path)
+        if isinstance(value, list) and value:
+            for index, item in enumerate(value):
+                unwound = _copy(doc)
+                _set_path(unwound, path, _copy(item))
+                if index_field:
+                    unwound[index_field] = index
+                yield unwound
+        elif isinstance(value, list) or value is _MISSING or value is None:
+            if keep_empty:
+                unwound = _copy(doc)
+                if isinstance(value, list):
+                    _unset_path(unwound, path)
+                if index_field:
+                    unwound[index_field] = None
+                yield unwound
+        else:
+            if index_field:
+                doc[index_field] = None
+            yield doc
+
+def _haversine_m(a, b):
+    (lng1, lat1), (lng2, lat2) = [(math.radians(point[0]), math.radians(point[1])) for point in (a, b)]
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
+
+def _coordinates(point):
+    # GeoJSON Point or legacy [lng, lat] pair
+    if isinstance(point, dict) and point.get('type') == 'Point':
+        return point['coordinates']
+    if isinstance(point, (list, tuple)) and len(point) == 2 and all(_rank(value) == 2 for value in point):
+        return point
+    return None
+
+class _CommandEvent:
+    # The fields of pymongo's command monitoring events that listeners read
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+def _monitored(command_name):
+    # Report a collection method to the client's command listeners as one
+    # command_name command
+    def decorator(method):
+        @functools.wraps(method)
+        def monitored(self, *args, **kwargs):
+            with self.database.client._command(self.database.name, command_name, {command_name: self.name}):
+                return method(self, *args, **kwargs)
+        return monitored
+    return decorator
+
+class MemoryCursor:
+    # Lazy like pymongo's Cursor: runs the query on first iteration
+    def __init__(self, collection, filter=None, projection=None, sort=None, limit=0, skip=0, **kwargs):
+        self._collection = collection
+        self._filter = filter or {}
+        self._projection = projection
+        self._sort = _sort_spec(sort) if sort else None
+        self._limit = limit
+        self._skip = skip
+        self._results = None
+    
+    def sort(self, key_or_list, direction=None):
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+    
+    def limit(self, limit):
+        self._limit = limit
+        return self
+    
+    def skip(self, skip):
+        self._skip = skip
+        return self
+    
+    def batch_size(self, batch_size):
+        return self
+    
+    def explain(self):
+        raise OperationFailure("explain is not supported by the in-memory database")
+    
+    def close(self):
+        self._results = iter(())
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if self._results is None:
+            collection = self._collection
+            with collection.database.client._command(collection.database.name, 'find', {'find': collection.name}):
+                self._results = collection._iter_find(
+                    self._filter, self._projection, self._sort, self._limit, self._skip
+                )
+        return next(self._results)
+
+class _ResultCursor:
+    # What aggregate() returns: already computed results
+    def __init__(self, results):
+        self._results = iter(results)
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        return next(self._results)
+    
+    def close(self):
+        self._results = iter(())
+
+_READ_ONLY_STAGES = {'$match', '$sort', '$limit', '$skip', '$project'}
+
+class MemoryCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._lock = database.client._lock
+        self._docs = {}
+        # _id -> insertion number, for natural order
+        self._order = {}
+        self._counter = itertools.count()
+        self._indexes = {'_id_': {'key': [('_id', 1)], 'v': 2}}
+        # field -> hash key -> ids, for the first field of each index
+        self._hashed = {}
+        # index name -> (fields, key tuple -> _id)
+        self._unique = {}
+        # sort spec -> _SortedIndex, built on first use for sorts an index covers
+        self._sorted = {}
+        # 2dsphere field -> (latitude, longitude) one-degree cell -> ids
+        self._geo = {}
+    
+    def _doc_keys(self, doc, field):
+        keys = set()
+        for value in _query_values(doc, field):
+            key = _hash_key(value)
+            if key is not None and key[0] != 1:
+                keys.add(key)
+        return keys
+    
+    def _unique_key(self, doc, fields):
+        return tuple(_freeze(_value(_get(doc, field))) for field in fields)
+    
+    def _check_unique(self, doc, ignore_id=_MISSING):
+        for name, (fields, entries) in self._unique.items():
+            owner = entries.get(self._unique_key(doc, fields), _MISSING)
+            if owner is not _MISSING and owner != ignore_id:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.full_name} index: {name}",
+                    11000, {'code': 11000, 'keyPattern': dict.fromkeys(fields, 1)}
+                )
+    
+    def _geo_cell(self, doc, field):
+        point = _coordinates(_get(doc, field))
+        if point is None:
+            return None
+        return math.floor(point[1]), math.floor(point[0])
+    
+    def _index(self, doc):
+        for field, entries in self._hashed.items():
+            for key in self._doc_keys(doc, field):
+                entries.setdefault(key, set()).add(doc['_id'])
+        for field, cells in self._geo.items():
+            cell = self._geo_cell(doc, field)
+            if cell is not None:
+                cells.setdefault(cell, set()).add(doc['_id'])
+        for fields, entries in self._unique.values():
+            entries[self._unique_key(doc, fields)] = doc['_id']
+        for order in self._sorted.values():
+            order.add(doc)
+    
+    def _unindex(self, doc):
+        for field, entries in self._hashed.items():
+            for key in self._doc_keys(doc, field):
+                ids = entries.get(key)
+                if ids:
+                    ids.discard(doc['_id'])
+                    if not ids:
+                        del entries[key]
+        for field, cells in self._geo.items():
+            cell = self._geo_cell(doc, field)
+            ids = cells.get(cell)
+            if ids:
+                ids.discard(doc['_id'])
+                if not ids:
+                    del cells[cell]
+        for fields, entries in self._unique.values():
+            entries.pop(self._unique_key(doc, fields), None)
+        for order in self._sorted.values():
+            order.remove(doc)
+    
+    def _insert(self, doc):
+        if '_id' not in doc:
+            doc['_id'] = ObjectId()
+        stored = _store(doc)
+        if stored['_id'] in self._docs:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.full_name} index: _id_",
+                11000, {'code': 11000, 'keyPattern': {'_id': 1}}
+            )
+        self._check_unique(stored)
+        self._docs[stored['_id']] = stored
+        self._order[stored['_id']] = next(self._counter)
+        self._index(stored)
+        return stored['_id']
+    
+    def _replace(self, old, new):
+        # Swap a stored document for its updated version in place
+        self._check_unique(new, ignore_id=old['_id'])
+        self._unindex(old)
+        self._docs[old['_id']] = new
+        self._index(new)
+    
+    def _remove(self, doc):
+        self._unindex(doc)
+        del self._docs[doc['_id']]
+        del self._order[doc['_id']]
+    
+    def _candidate_ids(self, query):
+        # Ids narrowed by an _id or indexed equality/$in condition when the
+        # query has one, else None
+        best = None
+        for field, condition in _conjuncts(query):
+            if field != '_id' and field not in self._hashed:
+                continue
+            keys = _lookup_targets(condition)
+            required = _all_targets(condition) if keys is None and field != '_id' else None
+            if required is not None:
+                # Every value must be present, the smallest set first
+                sets = sorted((self._hashed[field].get(key, set()) for key in required), key=len)
+                ids = sets[0].intersection(*sets[1:]) if len(sets) > 1 else sets[0]
+            elif keys is None:
+                continue
+            elif field == '_id':
+                ids = {key[1] for key in keys if key[1] in self._docs}
+            else:
+                # Index sets are read, never changed, so one is used as is
+                sets = [self._hashed[field].get(key, set()) for key in keys]
+                ids = set().union(*sets) if len(sets) > 1 else sets[0]
+            if best is None or len(ids) < len(best):
+                best = ids
+        return best
+    
+    def _candidates(self, query):
+        # Documents to test, in natural order
+        ids = self._candidate_ids(query)
+        if ids is None:
+            return list(self._docs.values())
+        return [self._docs[doc_id] for doc_id in sorted(ids, key=self._order.__getitem__)]
+    
+    def _covers(self, spec):
+        # Whether an ascending/descending index ends in exactly these keys, so
+        # a server would read them in order instead of sorting
+        spec = [(field, direction) for field, direction in spec]
+        for info in self._indexes.values():
+            keys = [(field, direction) for field, direction in info['key']]
+            if len(keys) >= len(spec) and keys[len(keys) - len(spec):] == spec:
+                return True
+        return False
+    
+    def _sorted_index(self, spec):
+        key = tuple(spec)
+        order = self._sorted.get(key)
+        if order is None and self._covers(spec):
+            order = self._sorted[key] = _SortedIndex(spec, self._docs.values())
+        return order
+    
+    def _select(self, query, sort=None, limit=0, skip=0):
+        if query is not None and not isinstance(query, dict):
+            query = {'_id': query}
+        # Query values go through BSON too, so datetimes compare at millisecond precision
+        query = _store(query or {})
+        matches = _compile(query)
+        
+        ids = self._candidate_ids(query)
+        order = self._sorted_index(sort) if sort else None
+        # A few equality matches are cheaper to sort than to find in the walk
+        if order is not None and (ids is None or len(ids) * 16 > len(self._docs)):
+            wanted = limit + skip if limit else 0
+            docs = []
+            for doc_id in order.walk(query):
+                if ids is not None and doc_id not in ids:
+                    continue
+                doc = self._docs[doc_id]
+                if matches(doc):
+                    docs.append(doc)
+                    if len(docs) == wanted:
+                        break
+        else:
+            docs = [doc for doc in self._candidates(query) if matches(doc)]
+            if sort:
+                docs = _sorted(docs, sort, (limit + skip) if limit else 0)
+        if skip:
+            docs = docs[skip:]
+        if limit:
+            docs = docs[:limit]
+        return docs
+    
+    def _find(self, query, projection=None, sort=None, limit=0, skip=0):
+        with self._lock:
+            return [_copy(_project(doc, projection)) for doc in self._select(query, sort, limit, skip)]
+    
+    def _iter_find(self, query, projection=None, sort=None, limit=0, skip=0):
+        # Stored documents are swapped on update, never changed in place, so
+        # the matches can be copied out one at a time after the lock is released
+        with self._lock:
+            docs = self._select(query, sort, limit, skip)
+        return (_copy(_project(doc, projection)) for doc in docs)
+    
+    def find(self, filter=None, projection=None, **kwargs):
+        return MemoryCursor(self, filter, projection, **kwargs)
+    
+    @_monitored('find')
+    def find_one(self, filter=None, projection=None, **kwargs):
+        results = self._find(filter, projection, _sort_spec(kwargs['sort']) if kwargs.get('sort') else None, 1)
+        return results[0] if results else None
+    
+    @_monitored('aggregate')
+    def count_documents(self, filter, **kwargs):
+        with self._lock:
+            return len(self._select(filter, limit=kwargs.get('limit', 0), skip=kwargs.get('skip', 0)))
+    
+    @_monitored('count')
+    def estimated_document_count(self, **kwargs):
+        return len(self._docs)
+    
+    @_monitored('distinct')
+    def distinct(self, key, filter=None, **kwargs):
+        with self._lock:
+            values = {}
+            for doc in self._select(filter):
+                for value in _query_values(doc, key):
+                    if not isinstance(value, list):
+                        values.setdefault(_freeze(value), value)
+            return [_copy(value) for value in values.values()]
+    
+    @_monitored('insert')
+    def insert_one(self, document, **kwargs):
+        with self._lock:
+            return InsertOneResult(self._insert(document), True)
+    
+    @_monitored('insert')
+    def insert_many(self, documents, ordered=True, **kwargs):
+        documents = list(documents)
+        if not documents:
+            raise TypeError("documents must be a non-empty list")
+        with self._lock:
+            inserted, errors = [], []
+            for index, document in enumerate(documents):
+                try:
+                    inserted.append(self._insert(document))
+                except DuplicateKeyError as e:
+                    errors.append({'index': index, 'code': 11000, 'errmsg': str(e), 'op': document})
+                    if ordered:
+                        break
+            if errors:
+                raise BulkWriteError(self._bulk_result(nInserted=len(inserted), writeErrors=errors))
+            return InsertManyResult(inserted, True)
+    
+    def _upsert_doc(self, query):
+        # New document from the equality conditions of an upsert's filter
+        doc = {}
+        for field, condition in _conjuncts(query):
+            if _is_operator_doc(condition):
+                if set(condition) == {'$eq'}:
+                    _set_path(doc, field, condition['$eq'])
+            elif not isinstance(condition, re.Pattern):
+                _set_path(doc, field, condition)
+        return doc
+    
+    def _apply(self, doc, update, inserting=False):
+        update = _store(update)
+        if not any(key.startswith('$') for key in update):
+            replaced = _store(update)
+            replaced['_id'] = doc['_id']
+            return replaced
+        
+        doc = _copy(doc)
+        for operator, fields in update.items():
+            for path, value in fields.items():
+                current = _get(doc, path)
+                if operator == '$set':
+                    _set_path(doc, path, _store(value))
+                elif operator == '$setOnInsert':
+                    if inserting:
+                        _set_path(doc, path, _store(value))
+                elif operator == '$unset':
+                    _unset_path(doc, path)
+                elif operator == '$inc':
+                    if current is _MISSING:
+                        current = 0
+                    if _rank(current) != 2:
+                        raise OperationFailure(f"Cannot apply $inc to a non-numeric value at {path}")
+                    _set_path(doc, path, current + value)
+                elif operator in ('$min', '$max'):
+                    better = _compare(value, current) < 0 if operator == '$min' else _compare(value, current) > 0
+                    if current is _MISSING or better:
+                        _set_path(doc, path, _store(value))
+                elif operator == '$push':
+                    if current is _MISSING:
+                        current = []
+                    _set_path(doc, path, list(current) + [_store(value)])
+                else:
+                    raise OperationFailure(f"Unsupported update operator {operator}")
+        if '_id' in update.get('$set', {}) and update['$set']['_id'] != doc['_id']:
+            raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'")
+        return doc
+    
+    def _update(self, query, update, upsert=False, multi=False, sort=None):
+        # (matched, modified, upserted _id, [(before, after)])
+        targets = self._select(query, sort, 0 if multi else 1)
+        if not targets:
+            if not upsert:
+                return 0, 0, None, []
+            base = self._upsert_doc(query)
+            base.setdefault('_id', ObjectId())
+            doc = self._apply(base, update, inserting=True)
+            doc.setdefault('_id', base['_id'])
+            self._insert(doc)
+            return 0, 0, doc['_id'], [(None, self._docs[doc['_id']])]
+        
+        changes = []
+        for old in targets:
+            new = self._apply(old, update)
+            if new != old:
+                self._replace(old, new)
+            changes.append((old, new))
+        modified = sum(1 for old, new in changes if old != new)
+        return len(targets), modified, None, changes
+    
+    @_monitored('update')
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        with self._lock:
+            matched, modified, upserted, _ = self._update(filter, update, upsert)
+            raw = {'n': matched or (1 if upserted is not None else 0), 'nModified': modified}
+            if upserted is not None:
+                raw['upserted'] = upserted
+            return UpdateResult(raw, True)
+    
+    @_monitored('update')
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        with self._lock:
+            matched, modified, upserted, _ = self._update(filter, update, upsert, multi=True)
+            raw = {'n': matched or (1 if upserted is not None else 0), 'nModified': modified}
+            if upserted is not None:
+                raw['upserted'] = upserted
+            return UpdateResult(raw, True)
+    
+    @_monitored('update')
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        return self.update_one(filter, replacement, upsert)
+    
+    @_monitored('findAndModify')
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        with self._lock:
+            _, _, _, changes = self._update(filter, update, upsert, sort=_sort_spec(sort) if sort else None)
+            if not changes:
+                return None
+            before, after = changes[0]
+            doc = after if return_document == ReturnDocument.AFTER else before
+            return None if doc is None else _copy(_project(doc, projection))
+    
+    @_monitored('findAndModify')
+    def find_one_and_replace(self, filter, replacement, **kwargs):
+        return self.find_one_and_update(filter, replacement, **kwargs)
+    
+    def _delete(self, query, multi):
+        targets = self._select(query, limit=0 if multi else 1)
+        for doc in targets:
+            self._remove(doc)
+        return targets
+    
+    @_monitored('delete')
+    def delete_one(self, filter, **kwargs):
+        with self._lock:
+            return DeleteResult({'n': len(self._delete(filter, False))}, True)
+    
+    @_monitored('delete')
+    def delete_many(self, filter, **kwargs):
+        with self._lock:
+            return DeleteResult({'n': len(self._delete(filter, True))}, True)
+    
+    @_monitored('findAndModify')
+    def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        with self._lock:
+            targets = self._select(filter, _sort_spec(sort) if sort else None, 1)
+            if not targets:
+                return None
+            self._remove(targets[0])
+            return _copy(_project(targets[0], projection))
+    
+    @staticmethod
+    def _bulk_result(**counts):
+        result = {
+            'writeErrors': [], 'writeConcernErrors': [], 'nInserted': 0, 'nUpserted': 0,
+            'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []
+        }
+        result.update(counts)
+        return result
+    
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        requests = list(requests)
+        if not requests:
+            raise InvalidOperation("No operations to execute")
+        
+        # Sent as one insert, update or delete command per batch of the same
+        # kind: consecutive runs when ordered, one per kind otherwise
+        batches = []
+        for index, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                kind = 'insert'
+            elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                kind = 'update'
+            elif isinstance(request, (DeleteOne, DeleteMany)):
+                kind = 'delete'
+            else:
+                raise TypeError(f"{request!r} is not a valid request")
+            if ordered and batches and batches[-1][0] == kind:
+                batches[-1][1].append((index, request))
+            else:
+                batches.append((kind, [(index, request)]))
+        if not ordered:
+            batches = [(kind, [item for batch_kind, batch in batches if batch_kind == kind for item in batch])
+                       for kind in ('insert', 'update', 'delete')]
+            batches = [(kind, batch) for kind, batch in batches if batch]
+        
+        with self._lock:
+            result = self._bulk_result()
+            for kind, batch in batches:
+                with self.database.client._command(self.database.name, kind, {kind: self.name}):
+                    for index, request in batch:
+                        try:
+                            self._bulk_apply(kind, index, request, result)
+                        except DuplicateKeyError as e:
+                            result['writeErrors'].append({'index': index, 'code': 11000, 'errmsg': str(e)})
+                            if ordered:
+                                break
+                if ordered and result['writeErrors']:
+                    break
+            if result['writeErrors']:
+                raise BulkWriteError(result)
+            return BulkWriteResult(result, True)
+    
+    def _bulk_apply(self, kind, index, request, result):
+        if kind == 'insert':
+            self._insert(request._doc)
+            result['nInserted'] += 1
+        elif kind == 'update':
+            multi = isinstance(request, UpdateMany)
+            matched, modified, upserted, _ = self._update(
+                request._filter, request._doc, request._upsert, multi=multi
+            )
+            result['nMatched'] += matched
+            result['nModified'] += modified
+            if upserted is not None:
+                result['nUpserted'] += 1
+                result['upserted'].append({'index': index, '_id': upserted})
+        else:
+            result['nRemoved'] += len(self._delete(request._filter, isinstance(request, DeleteMany)))
+    
+    @_monitored('aggregate')
+    def aggregate(self, pipeline, **kwargs):
+        with self._lock:
+            return _ResultCursor(self._aggregate(list(pipeline)))
+    
+    def _aggregate(self, pipeline):
+        stages = [next(iter(stage.items())) for stage in _store(pipeline)]
+        
+        # The first stage reads the collection, using the indexes when it can
+        # Stages that never change a document in place, so they can work on
+        # shallow copies that are copied in full once at the end
+        shallow = False
+        if stages and stages[0][0] == '$geoNear':
+            # Only the nearest documents a following $limit keeps are copied
+            limit = stages[1][1] if len(stages) > 1 and stages[1][0] == '$limit' else 0
+            spec = stages.pop(0)[1]
+            shallow = '.' not in spec['distanceField'] and all(name in _READ_ONLY_STAGES for name, _ in stages)
+            docs = self._geo_near(spec, limit, shallow)
+        elif stages and stages[0][0] == '$match':
+            docs = [_copy(doc) for doc in self._select(stages.pop(0)[1])]
+        else:
+            docs = [_copy(doc) for doc in self._docs.values()]
+        
+        for position, (name, spec) in enumerate(stages):
+            if name == '$match':
+                matches = _compile(spec)
+                docs = [doc for doc in docs if matches(doc)]
+            elif name == '$sort':
+                following = stages[position + 1] if position + 1 < len(stages) else None
+                limit = following[1] if following and following[0] == '$limit' else 0
+                docs = _sorted(docs, _sort_spec(spec), limit)
+            elif name == '$limit':
+                docs = list(docs)[:spec]
+            elif name == '$skip':
+                docs = list(docs)[spec:]
+            elif name == '$project':
+                docs = _stage_project(docs, spec)
+            elif name in ('$addFields', '$set'):
+                docs = _stage_add_fields(list(docs), spec)
+            elif name == '$unset':
+                fields = [spec] if isinstance(spec, str) else spec
+                docs = _stage_project(docs, dict.fromkeys(fields, 0))
+            elif name == '$unwind':
+                docs = list(_stage_unwind(docs, spec))
+            elif name == '$group':
+                docs = _stage_group(docs, spec)
+            elif name == '$lookup':
+                docs = self._lookup(list(docs), spec)
+            elif name == '$sample':
+                docs = list(docs)
+                docs = random.sample(docs, min(spec['size'], len(docs)))
+            elif name == '$count':
+                docs = list(docs)
+                docs = [{spec: len(docs)}] if docs else []
+            elif name == '$replaceRoot':
+                docs = [_eval(spec['newRoot'], doc, {}) for doc in docs]
+            elif name == '$merge':
+                if position != len(stages) - 1:
+                    raise OperationFailure("$merge can only be the final stage in the pipeline")
+                self._merge(list(docs), spec)
+                return []
+            elif name == '$geoNear':
+                raise OperationFailure("$geoNear is only valid as the first stage in a pipeline")
+            else:
+                raise OperationFailure(f"Unsupported pipeline stage {name}")
+        if shallow:
+            return [_copy(doc) for doc in docs]
+        return list(docs)
+    
+    def _geo_near(self, spec, limit=0, shallow=False):
+        origin = _coordinates(spec['near'])
+        key = spec.get('key', 'geo')
+        multiplier = spec.get('distanceMultiplier', 1)
+        max_distance = spec.get('maxDistance')
+        min_distance = spec.get('minDistance', 0)
+        # Points further north or south than maxDistance are out of range
+        # whatever their longitude
+        max_latitude_delta = math.degrees(max_distance / EARTH_RADIUS_M) if max_distance is not None else None
+        
+        found = []
+        distances = {}
+        matches = _compile(_store(spec.get('query') or {}))
+        for doc in self._near_candidates(key, origin, max_distance):
+            point = _coordinates(_get(doc, key))
+            if point is None:
+                continue
+            if max_latitude_delta is not None and abs(point[1] - origin[1]) > max_latitude_delta:
+                continue
+            # Listings share the coordinates of their place, so each point is
+            # measured once and the query only runs on documents in range
+            distance = distances.get(tuple(point))
+            if distance is None:
+                distance = distances[tuple(point)] = _haversine_m(origin, point)
+            if distance < min_distance or (max_distance is not None and distance > max_distance):
+                continue
+            if matches(doc):
+                found.append((distance, self._order[doc['_id']], doc))
+        
+        # Ties keep insertion order, as a collection scan would
+        by_distance = lambda item: item[:2]
+        found = heapq.nsmallest(limit, found, key=by_distance) if limit else sorted(found, key=by_distance)
+        results = []
+        for distance, _, doc in found:
+            doc = dict(doc) if shallow else _copy(doc)
+            _set_path(doc, spec['distanceField'], distance * multiplier)
+            results.append(doc)
+        return results
+    
+    def _near_candidates(self, key, origin, max_distance):
+        # Every document, or only those in the grid cells that can hold points
+        # within max_distance when key has a 2dsphere index
+        cells = self._geo.get(key)
+        if cells is None or max_distance is None:
+            return list(self._docs.values())
+        
+        reach = max_distance / EARTH_RADIUS_M
+        latitude = math.radians(origin[1])
+        latitude_delta = math.degrees(reach)
+        if reach >= math.pi / 2 - abs(latitude):
+            # The circle takes in a pole, so every longitude
+            longitude_delta = 180
+        else:
+            longitude_delta = math.degrees(math.asin(math.sin(reach) / math.cos(latitude)))
+        
+        docs = []
+        for (cell_latitude, cell_longitude), cell_ids in cells.items():
+            if cell_latitude + 1 < origin[1] - latitude_delta or cell_latitude > origin[1] + latitude_delta:
+                continue
+            offset = (cell_longitude + 0.5 - origin[0] + 180) % 360 - 180
+            if abs(offset) > longitude_delta + 0.5:
+                continue
+            docs.extend(self._docs[doc_id] for doc_id in cell_ids)
+        return docs
+    
+    def _lookup(self, docs, spec):
+        foreign = self.database[spec['from']]
+        local_field, foreign_field = spec['localField'], spec['foreignField']
+        
+        # Hash join on the foreign field, built once per stage
+        index = {}
+        if foreign_field != '_id':
+            for doc in foreign._docs.values():
+                values = _query_values(doc, foreign_field) or [None]
+                for value in values:
+                    index.setdefault(_freeze(value), []).append(doc)
+        
+        for doc in docs:
+            local = _get(doc, local_field)
+            values = local if isinstance(local, list) else [_value(local)]
+            matches = {}
+            for value in values:
+                if foreign_field == '_id':
+                    found = foreign._docs.get(value) if _hash_key(value) is not None else None
+                    candidates = [found] if found is not None else []
+                else:
+                    candidates = index.get(_freeze(value), [])
+                for candidate in candidates:
+                    matches[id(candidate)] = candidate
+            joined = [_copy(match) for match in matches.values()]
+            if spec.get('pipeline'):
+                joined = foreign._run_stages(joined, spec['pipeline'])
+            _set_path(doc, spec['as'], joined)
+        return docs
+    
+    def _run_stages(self, docs, pipeline):
+        # A sub-pipeline over given documents, e.g. $lookup's
+        scratch = MemoryCollection(self.database, self.name)
+        for doc in docs:
+            scratch._insert(doc)
+        return scratch._aggregate(pipeline)
+    
+    def _merge(self, docs, spec):
+        into = spec['into'] if isinstance(spec, dict) else spec
+        if isinstance(into, dict):
+            target = self.database.client[into.get('db', self.database.name)][into['coll']]
+        else:
+            target = self.database[into]
+        
+        on = spec.get('on', '_id') if isinstance(spec, dict) else '_id'
+        on = [on] if isinstance(on, str) else list(on)
+        when_matched = spec.get('whenMatched', 'merge') if isinstance(spec, dict) else 'merge'
+        when_not_matched = spec.get('whenNotMatched', 'insert') if isinstance(spec, dict) else 'insert'
+        
+        for doc in docs:
+            doc.setdefault('_id', ObjectId())
+            existing = target._select({field: _value(_get(doc, field)) for field in on}, limit=1)
+            if existing:
+                old = existing[0]
+                if when_matched == 'replace':
+                    new = _store(doc)
+                    new['_id'] = old['_id']
+                elif when_matched == 'merge':
+                    new = dict(_copy(old), **_store(doc))
+                    new['_id'] = old['_id']
+                elif when_matched == 'keepExisting':
+                    continue
+                elif when_matched == 'fail':
+                    raise OperationFailure("$merge found an existing document with the same key", 11000)
+                else:
+                    raise OperationFailure(f"Unsupported $merge whenMatched {when_matched!r}")
+                target._replace(old, new)
+            elif when_not_matched == 'insert':
+                target._insert(doc)
+            elif when_not_matched == 'fail':
+                raise OperationFailure("$merge could not find a matching document", 13113)
+    
+    @_monitored('createIndexes')
+    def create_indexes(self, indexes, **kwargs):
+        with self._lock:
+            names = []
+            for model in indexes:
+                document = dict(model.document)
+                name = document.pop('name')
+                keys = list(document.pop('key').items())
+                info = dict(document, key=keys, v=2)
+                
+                existing = self._indexes.get(name)
+                if existing is not None and existing != info:
+                    raise OperationFailure(f"An existing index has the same name as the requested index: {name}", 86)
+                self._indexes[name] = info
+                
+                field, direction = keys[0]
+                if field != '_id' and direction not in ('2dsphere', '2d', 'text') and field not in self._hashed:
+                    self._hashed[field] = {}
+                    for doc in self._docs.values():
+                        for key in self._doc_keys(doc, field):
+                            self._hashed[field].setdefault(key, set()).add(doc['_id'])
+                if direction == '2dsphere' and field not in self._geo:
+                    self._geo[field] = {}
+                    for doc in self._docs.values():
+                        cell = self._geo_cell(doc, field)
+                        if cell is not None:
+                            self._geo[field].setdefault(cell, set()).add(doc['_id'])
+                if info.get('unique') and name not in self._unique:
+                    fields = [key for key, _ in keys]
+                    entries = {}
+                    for doc in self._docs.values():
+                        key = self._unique_key(doc, fields)
+                        if key in entries:
+                            del self._indexes[name]
+                            raise DuplicateKeyError(f"E11000 duplicate key error building index {name}", 11000)
+                        entries[key] = doc['_id']
+                    self._unique[name] = (fields, entries)
+                names.append(name)
+            return names
+    
+    @_monitored('createIndexes')
+    def create_index(self, keys, **kwargs):
+        return self.create_indexes([IndexModel(keys, **kwargs)])[0]
+    
+    @_monitored('listIndexes')
+    def index_information(self):
+        with self._lock:
+            return {name: _copy(info) for name, info in self._indexes.items()}
+    
+    @_monitored('dropIndexes')
+    def drop_index(self, index_or_name):
+        with self._lock:
+            name = index_or_name if isinstance(index_or_name, str) else '_'.join(
+                f'{field}_{direction}' for field, direction in index_or_name
+            )
+            if name == '_id_' or name not in self._indexes:
+                raise OperationFailure(f"index not found with name [{name}]", 27)
+            del self._indexes[name]
+            self._unique.pop(name, None)
+            still_hashed = {info['key'][0][0] for info in self._indexes.values()}
+            for field in list(self._hashed):
+                if field not in still_hashed:
+                    del self._hashed[field]
+            for spec in list(self._sorted):
+                if not self._covers(spec):
+                    del self._sorted[spec]
+            still_geo = {info['key'][0][0] for info in self._indexes.values() if info['key'][0][1] == '2dsphere'}
+            for field in list(self._geo):
+                if field not in still_geo:
+                    del self._geo[field]
+    
+    @_monitored('drop')
+    def drop(self, **kwargs):
+        self.database.drop_collection(self.name)
+    
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+
+class MemoryDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+    
+    def get_collection(self, name, **kwargs):
+        with self.client._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = self._collections[name] = MemoryCollection(self, name)
+            return collection
+    
+    def __getitem__(self, name):
+        return self.get_collection(name)
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get_collection(name)
+    
+    def list_collection_names(self, **kwargs):
+        with self.client._command(self.name, 'listCollections', {'listCollections': 1}), self.client._lock:
+            return [name for name, collection in self._collections.items()
+                    if collection._docs or len(collection._indexes) > 1]
+    
+    def drop_collection(self, name, **kwargs):
+        name = name if isinstance(name, str) else name.name
+        with self.client._command(self.name, 'drop', {'drop': name}), self.client._lock:
+            self._collections.pop(name, None)
+    
+    def command(self, command, value=1, **kwargs):
+        name = command if isinstance(command, str) else next(iter(command))
+        with self.client._command(self.name, name, {name: value} if isinstance(command, str) else command):
+            if name in ('ping', 'ismaster', 'isMaster', 'hello'):
+                return {'ok': 1.0}
+            raise OperationFailure(f"The {name} command is not supported by the in-memory database")
+
+class MemoryClient:
+    # Drop-in for MongoClient(uri). Connection options other than
+    # event_listeners are accepted and ignored.
+    def __init__(self, uri='memory://', event_listeners=None, **options):
+        self._lock = threading.RLock()
+        self._databases = {}
+        self._listeners = [listener for listener in event_listeners or ()
+                           if isinstance(listener, monitoring.CommandListener)]
+        self._request_ids = itertools.count(1)
+        self._in_command = threading.local()
+    
+    @contextmanager
+    def _command(self, database_name, command_name, command):
+        # Started, then succeeded or failed events around one operation. Calls
+        # made inside it, e.g. replace_one -> update_one, are part of it.
+        # Replies carry no documents.
+        if not self._listeners or getattr(self._in_command, 'active', False):
+            yield
+            return
+        
+        request_id = next(self._request_ids)
+        fields = {
+            'command_name': command_name, 'database_name': database_name, 'request_id': request_id,
+            'operation_id': request_id, 'connection_id': ('memory', 27017), 'service_id': None
+        }
+        for listener in self._listeners:
+            listener.started(_CommandEvent(command=command, **fields))
+        
+        self._in_command.active = True
+        started = time.perf_counter()
+        try:
+            yield
+        except (WriteError, BulkWriteError):
+            # Write errors come back in a successful reply
+            self._finished(fields, started, reply={'ok': 1.0})
+            raise
+        except Exception as e:
+            self._finished(fields, started, failure={'ok': 0.0, 'errmsg': str(e)})
+            raise
+        else:
+            self._finished(fields, started, reply={'ok': 1.0})
+        finally:
+            self._in_command.active = False
+    
+    def _finished(self, fields, started, reply=None, failure=None):
+        duration_micros = int((time.perf_counter() - started) * 1e6)
+        for listener in self._listeners:
+            if failure is None:
+                listener.succeeded(_CommandEvent(duration_micros=duration_micros, reply=reply, **fields))
+            else:
+                listener.failed(_CommandEvent(duration_micros=duration_micros, failure=failure, **fields))
+    
+    def get_database(self, name, **kwargs):
+        with self._lock:
+            database = self._databases.get(name)
+            if database is None:
+                database = self._databases[name] = MemoryDatabase(self, name)
+            return database
+    
+    def __getitem__(self, name):
+        return self.get_database(name)
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get_database(name)
+    
+    def list_database_names(self, **kwargs):
+        with self._lock:
+            return list(self._databases)
+    
+    def drop_database(self, name_or_database, **kwargs):
+        with self._lock:
+            name = name_or_database if isinstance(name_or_database, str) else name_or_database.name
+            self._databases.pop(name, None)
+    
+    def close(self):
+        pass
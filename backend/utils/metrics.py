@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, g, request
+from pymongo import monitoring
+import bson
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    return ','.join(f'{name}="{value}"' for name, value in pairs)
+
+class Metrics:
+    # Per-worker request and MongoDB metrics, exposed in Prometheus text format
+    def __init__(self, slow_query_ms, measure_bytes=False):
+        self.slow_query_ms = slow_query_ms
+        self.measure_bytes = measure_bytes
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.statuses = {}
+        self.commands = {}
+        self.command_failures = {}
+        self.command_bytes = {}
+        self.command_listener = MongoCommandListener(self)
+        self.values = {}
+    
+    def observe_request(self, route, method, status, seconds):
+        with self._lock:
+            key = (route, method)
+            if key not in self.requests:
+                self.requests[key] = Histogram()
+            self.requests[key].observe(seconds)
+            status_key = (route, method, str(status))
+            self.statuses[status_key] = self.statuses.get(status_key, 0) + 1
+    
+    def observe_command(self, collection, command, seconds, reply_bytes=0, failed=False):
+        with self._lock:
+            key = (collection, command)
+            if key not in self.commands:
+                self.commands[key] = Histogram()
+            self.commands[key].observe(seconds)
+            if failed:
+                self.command_failures[key] = self.command_failures.get(key, 0) + 1
+            if reply_bytes:
+                self.command_bytes[key] = self.command_bytes.get(key, 0) + reply_bytes
+        
+        if seconds * 1000 >= self.slow_query_ms:
+            logger.warning("Slow MongoDB %s on %s: %.1f ms", command, collection, seconds * 1000)
+    
+    def register_value(self, name, kind, help_text, func):
+        # A counter or gauge owned elsewhere, func is read at scrape time
+        self.values[name] = (kind, help_text, func)
+    
+    def init_app(self, app):
+        @app.before_request
+        def start_timer():
+            g.request_started = time.perf_counter()
+        
+        @app.after_request
+        def record_request(response):
+            started = g.pop('request_started', None)
+            if started is not None:
+                route = request.url_rule.endpoint if request.url_rule else 'unmatched'
+                self.observe_request(route, request.method, response.status_code, time.perf_counter() - started)
+            return response
+        
+        @app.route('/metrics')
+        def metrics():
+            return Response(self.render(), mimetype='text/plain; version=0.0.4')
+    
+    def _render_histograms(self, lines, name, help_text, histograms, label_names):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{_labels(label_names, key, le=bound)}}} {cumulative}')
+            lines.append(f'{name}_bucket{{{_labels(label_names, key, le="+Inf")}}} {histogram.count}')
+            lines.append(f'{name}_sum{{{_labels(label_names, key)}}} {histogram.sum}')
+            lines.append(f'{name}_count{{{_labels(label_names, key)}}} {histogram.count}')
+    
+    def _render_counters(self, lines, name, help_text, counters, label_names):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(counters.items()):
+            lines.append(f'{name}{{{_labels(label_names, key)}}} {value}')
+    
+    def render(self):
+        lines = []
+        with self._lock:
+            self._render_histograms(lines, 'agripal_http_request_duration_seconds',
+                                    'Request latency by route', self.requests, ('route', 'method'))
+            self._render_counters(lines, 'agripal_http_requests_total',
+                                  'Requests by route and status', self.statuses, ('route', 'method', 'status'))
+            self._render_histograms(lines, 'agripal_mongo_command_duration_seconds',
+                                    'MongoDB command latency', self.commands, ('collection', 'command'))
+            self._render_counters(lines, 'agripal_mongo_command_failures_total',
+                                  'Failed MongoDB commands', self.command_failures, ('collection', 'command'))
+            self._render_counters(lines, 'agripal_mongo_reply_bytes_total',
+                                  'MongoDB reply bytes', self.command_bytes, ('collection', 'command'))
+        
+        for name, (kind, help_text, func) in sorted(self.values.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {func()}")
+        
+        return '\n'.join(lines) + '\n'
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._collections = {}
+    
+    def started(self, event):
+        # getMore names the collection in a separate field
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection')
+        else:
+            collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ''
+        self._collections[(event.connection_id, event.request_id)] = collection
+    
+    def _finish(self, event, reply_bytes=0, failed=False):
+        collection = self._collections.pop((event.connection_id, event.request_id), '')
+        self.metrics.observe_command(
+            collection,
+            event.command_name,
+            event.duration_micros / 1e6,
+            reply_bytes,
+            failed
+        )
+    
+    def succeeded(self, event):
+        reply_bytes = len(bson.encode(event.reply)) if self.metrics.measure_bytes else 0
+        self._finish(event, reply_bytes)
+    
+    def failed(self, event):
+        self._finish(event, failed=True)
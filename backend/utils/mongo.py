@@ -0,0 +1,61 @@
+import os
+import threading
+import weakref
+from pymongo import MongoClient
+
+def connect(uri, **client_options):
+    # A MongoClient, or the in-process stand-in for memory:// URIs
+    if uri.startswith('memory://'):
+        from utils.memory_mongo import MemoryClient
+        return MemoryClient(uri, **client_options)
+    return MongoClient(uri, **client_options)
+
+# Every LazyDatabase, so a post-fork hook can drop clients a worker inherited
+_databases = weakref.WeakSet()
+
+class LazyDatabase:
+    # Stands in for a pymongo Database. The MongoClient is built on first use
+    # in each process, so importing the app makes no network round trip and a
+    # forked worker never reuses its parent's sockets.
+    def __init__(self, uri, name, on_connect=None, **client_options):
+        self.uri = uri
+        self.name = name
+        self.on_connect = on_connect
+        self.client_options = client_options
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        _databases.add(self)
+    
+    @property
+    def connected(self):
+        # Whether this process has built its client yet
+        return self._pid == os.getpid()
+    
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    client = connect(self.uri, **self.client_options)
+                    self._db = client[self.name]
+                    self._pid = os.getpid()
+                    if self.on_connect:
+                        self.on_connect(self._db)
+        return self._db
+    
+    def reset(self):
+        # Forget the client without closing it, its sockets belong to the parent
+        with self._lock:
+            self._db = None
+            self._pid = None
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+    
+    def __getitem__(self, name):
+        return self.get()[name]
+
+def reset_after_fork():
+    # Called from gunicorn's post_fork hook
+    for database in list(_databases):
+        database.reset()
@@ -0,0 +1,56 @@
+import base64
+from datetime import datetime
+from bson import ObjectId, json_util
+from bson.json_util import RELAXED_JSON_OPTIONS
+from pymongo import ASCENDING
+
+# BSON types a cursor may carry for a sort key
+CURSOR_TYPES = (datetime, ObjectId, int, float)
+
+class InvalidCursor(ValueError):
+    pass
+
+def parse_limit(value, default, maximum):
+    if value is None or value == '':
+        return default
+    
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    
+    return min(limit, maximum)
+
+def encode_cursor(doc, sort):
+    # Opaque keyset token holding the document's values for the sort keys,
+    # e.g. sort=[('price', 1), ('_id', 1)]
+    payload = {field: doc[field] for field, _ in sort}
+    raw = json_util.dumps(payload, json_options=RELAXED_JSON_OPTIONS, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token, sort):
+    # Values of the sort keys, in sort order; a token from another sort is invalid
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception as e:
+        # json_util raises assorted errors on malformed extended JSON
+        raise InvalidCursor("Invalid cursor") from e
+    
+    if not isinstance(payload, dict) or list(payload) != [field for field, _ in sort]:
+        raise InvalidCursor("Invalid cursor")
+    
+    values = list(payload.values())
+    # Only plain sort key values, never operators or other BSON types
+    if any(isinstance(value, bool) or not isinstance(value, CURSOR_TYPES) for value in values):
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+def after_cursor(sort, values):
+    # Documents strictly after the cursor in the given sort order:
+    # (a > x) or (a == x and b > y) ..., with < for descending keys
+    conditions = []
+    for i, (field, direction) in enumerate(sort):
+        condition = {prior: value for (prior, _), value in zip(sort[:i], values[:i])}
+        condition[field] = {'$gt' if direction == ASCENDING else '$lt': values[i]}
+        conditions.append(condition)
+    return {'$or': conditions}
\ No newline at end of file
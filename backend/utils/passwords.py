@@ -0,0 +1,75 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import bcrypt
+
+class PasswordPoolFull(Exception):
+    pass
+
+# Run in the worker processes, must stay module-level so they can be pickled
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _check_password(password, password_hash):
+    return bcrypt.checkpw(password, password_hash)
+
+def hash_cost(password_hash):
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+class PasswordHasher:
+    def __init__(self, rounds, workers, max_pending, timeout):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = None
+        self._pid = None
+    
+    def _pool(self):
+        # Created lazily so every gunicorn worker gets its own pool after fork
+        pid = os.getpid()
+        with self._lock:
+            if self._pid != pid:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._pending = threading.BoundedSemaphore(self.max_pending)
+                self._pid = pid
+        return self._executor, self._pending
+    
+    def _run(self, fn, *args):
+        # Inline mode, e.g. for local development
+        if self.workers <= 0:
+            return fn(*args)
+        
+        executor, pending = self._pool()
+        
+        # Shed load instead of queueing behind a burst of logins
+        if not pending.acquire(blocking=False):
+            raise PasswordPoolFull()
+        
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            pending.release()
+            raise
+        future.add_done_callback(lambda _: pending.release())
+        
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PasswordPoolFull()
+    
+    def hash_password(self, password):
+        password_hash = self._run(_hash_password, password.encode('utf-8'), self.rounds)
+        return password_hash.decode('utf-8')
+    
+    def check_password(self, password, password_hash):
+        return self._run(_check_password, password.encode('utf-8'), password_hash.encode('utf-8'))
+    
+    def needs_rehash(self, password_hash):
+        return hash_cost(password_hash) != self.rounds
@@ -0,0 +1,190 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, jsonify, current_app, g
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600}
+
+def parse_rate(value):
+    # "<requests>/<second|minute|hour>" -> (capacity, tokens per second);
+    # "off" or "0" disables the limit
+    value = (value or '').strip().lower()
+    if value in ('', 'off', '0'):
+        return None
+    
+    count, _, period = value.partition('/')
+    count = int(count)
+    if count < 1 or period not in PERIODS:
+        raise ValueError(f"Invalid rate limit: {value!r}")
+    return count, count / PERIODS[period]
+
+class LocalBuckets:
+    # Token buckets of this worker. Least recently used buckets are evicted
+    # past maxsize; a forgotten bucket just starts full again.
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, keys, capacity, rate, cost=1):
+        # Takes cost tokens from every bucket in keys, or from none of them
+        # when one is short. Returns the wait until all of them can pay.
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key in keys:
+                tokens, updated = self._buckets.pop(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - updated) * rate))
+            
+            retry_after = max(0, max((cost - tokens) / rate for tokens in levels))
+            if not retry_after:
+                levels = [tokens - cost for tokens in levels]
+            
+            for key, tokens in zip(keys, levels):
+                self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return retry_after
+    
+    def __len__(self):
+        return len(self._buckets)
+
+class RedisBuckets:
+    # Buckets shared by all workers and hosts; one script refills all of a
+    # request's buckets and takes from them together, atomically
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local cost = tonumber(ARGV[4])
+    local levels = {}
+    local retry_after = 0
+    for i, key in ipairs(KEYS) do
+        local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+        levels[i] = tokens
+        if tokens < cost then
+            retry_after = math.max(retry_after, (cost - tokens) / rate)
+        end
+    end
+    for i, key in ipairs(KEYS) do
+        local tokens = levels[i]
+        if retry_after == 0 then
+            tokens = tokens - cost
+        end
+        redis.call('HSET', key, 'tokens', tokens, 'updated', now)
+        redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000))
+    end
+    return tostring(retry_after)
+    """
+    
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATELIMIT_REDIS_URL is set but the 'redis' package is not installed")
+        
+        self.client = redis.Redis.from_url(url)
+        self._take = self.client.register_script(self.SCRIPT)
+    
+    def take(self, keys, capacity, rate, cost=1):
+        return float(self._take(keys=['agripal:ratelimit:' + key for key in keys], args=[capacity, rate, time.time(), cost]))
+    
+    def __len__(self):
+        return 0
+
+class RateLimiter:
+    def __init__(self, rules, store_size=100000, redis_url=None):
+        # rules: route name -> (capacity, rate) or None when disabled
+        self.rules = rules
+        self.store = RedisBuckets(redis_url) if redis_url else LocalBuckets(store_size)
+        self.limited = 0
+    
+    def capacity(self, name):
+        # Most tokens one check can take, or None when the rule is off
+        rule = self.rules.get(name)
+        return rule[0] if rule else None
+    
+    def check(self, name, keys, cost=1):
+        # Seconds to wait before retrying, or 0 when every bucket had cost
+        # tokens and paid them. A rejected request takes nothing, so one
+        # client's retries never drain a bucket it shares with others.
+        # cost must not exceed the rule's capacity.
+        rule = self.rules.get(name)
+        if rule is None:
+            return 0
+        
+        capacity, rate = rule
+        retry_after = self.store.take([f"{name}:{key}" for key in keys], capacity, rate, cost)
+        if retry_after:
+            self.limited += 1
+        return retry_after
+
+def _client_keys():
+    # Always the client IP; also the JWT subject once verify_token has run
+    keys = ['ip:' + (request.remote_addr or 'unknown')]
+    user_context = g.get('user_context')
+    if user_context is not None:
+        keys.append('user:' + user_context.id)
+    return keys
+
+def _too_many_requests(retry_after):
+    return jsonify({"error": "Too many requests, please try again later"}), 429, {
+        "Retry-After": str(math.ceil(retry_after))
+    }
+
+def charge(name, cost):
+    # Take cost tokens from the RATELIMIT_<NAME> buckets inside a view, for
+    # requests that do the work of several; a 429 response when they are
+    # short, otherwise None
+    retry_after = current_app.rate_limiter.check(name, _client_keys(), cost)
+    return _too_many_requests(retry_after) if retry_after else None
+
+def rate_limit(name):
+    # Apply the RATELIMIT_<NAME> rule; place under @verify_token to also
+    # limit by user. Runs before the view reads the body or touches MongoDB.
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            retry_after = current_app.rate_limiter.check(name, _client_keys())
+            if retry_after:
+                return _too_many_requests(retry_after)
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+class AdmissionControl:
+    # Caps the requests a worker handles at once; the rest get 503 before
+    # any route code runs instead of queueing behind MongoDB or bcrypt
+    def __init__(self, max_concurrent, exempt=()):
+        self.max_concurrent = max_concurrent
+        self.exempt = set(exempt)
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+    
+    def init_app(self, app):
+        if self.max_concurrent <= 0:
+            return
+        
+        @app.before_request
+        def admit():
+            if request.endpoint in self.exempt:
+                return None
+            with self._lock:
+                if self.in_flight >= self.max_concurrent:
+                    self.rejected += 1
+                    return jsonify({"error": "Server is busy, please try again later"}), 503, {"Retry-After": "1"}
+                self.in_flight += 1
+            g.admitted = True
+        
+        # Streamed responses keep their slot until the stream ends
+        @app.teardown_request
+        def release(exc=None):
+            if g.pop('admitted', False):
+                with self._lock:
+                    self.in_flight -= 1
\ No newline at end of file
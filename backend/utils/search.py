@@ -0,0 +1,60 @@
+import re
+import unicodedata
+
+SEARCH_MODES = ('prefix', 'exact')
+
+# Fields holding the normalized search terms of each searchable crop field
+SEARCH_FIELDS = {
+    'crop_type': 'crop_type_terms',
+    'location': 'location_terms'
+}
+
+# Fields holding the leading characters of every term ("edge n-grams"), which
+# the marketplace indexes are built on: a prefix search is then an equality
+# match, and the index can still serve the sort. Longer prefixes are matched
+# on this many characters and checked against the terms.
+PREFIX_FIELDS = {
+    'crop_type': 'crop_type_prefixes',
+    'location': 'location_prefixes'
+}
+MAX_PREFIX_LENGTH = 10
+
+def normalize_terms(text):
+    # Lowercased, accent-folded word tokens, e.g. "Élite Wheat" -> ["elite", "wheat"]
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    folded = ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+    return re.findall(r'\w+', folded)
+
+def edge_ngrams(terms):
+    # "wheat" -> ["w", "wh", "whe", "whea", "wheat"], up to MAX_PREFIX_LENGTH
+    prefixes = {term[:length] for term in terms for length in range(1, min(len(term), MAX_PREFIX_LENGTH) + 1)}
+    return sorted(prefixes)
+
+def search_terms(data):
+    # Search term and prefix fields for the searchable fields present in data
+    fields = {}
+    for field, terms_field in SEARCH_FIELDS.items():
+        if field in data:
+            # A null field has no terms rather than the term "none"
+            terms = normalize_terms(data[field]) if data[field] is not None else []
+            fields[terms_field] = terms
+            fields[PREFIX_FIELDS[field]] = edge_ngrams(terms)
+    return fields
+
+def term_filter(field, value, mode='prefix'):
+    terms = normalize_terms(value)
+    if not terms:
+        return None
+    
+    # User input is matched literally. Both modes are equality matches on the
+    # indexed prefixes; exact mode then checks the whole terms.
+    terms_field = SEARCH_FIELDS[field]
+    condition = {PREFIX_FIELDS[field]: {'$all': list(dict.fromkeys(term[:MAX_PREFIX_LENGTH] for term in terms))}}
+    if mode == 'exact':
+        condition[terms_field] = {'$all': terms}
+        return condition
+    
+    longer = [term for term in terms if len(term) > MAX_PREFIX_LENGTH]
+    if longer:
+        condition['$and'] = [{terms_field: {'$regex': '^' + re.escape(term)}} for term in longer]
+    return condition
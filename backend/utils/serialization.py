@@ -0,0 +1,53 @@
+import json
+from datetime import date, datetime, timezone
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        # Stored datetimes are naive UTC; say so, as orjson does with OPT_NAIVE_UTC
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return DefaultJSONProvider.default(value)
+
+class BSONJSONProvider(DefaultJSONProvider):
+    # Encodes ObjectId as its hex string and datetimes as ISO 8601 in UTC
+    # (+00:00), with orjson when it is installed and the standard library otherwise
+    ensure_ascii = False
+    sort_keys = False
+    
+    def _orjson_option(self, indent):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+    
+    def dumps(self, obj, **kwargs):
+        if orjson is not None:
+            option = self._orjson_option(kwargs.get('indent'))
+            return orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+        
+        kwargs.setdefault('default', _default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+    
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        
+        # Skip the str round trip and hand orjson's bytes straight to the response
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=_default, option=self._orjson_option(indent))
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
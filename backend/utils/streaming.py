@@ -0,0 +1,36 @@
+from flask import current_app, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Bytes buffered before a chunk is written to the client
+FLUSH_SIZE = 32 * 1024
+
+def wants_stream(request):
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def ndjson_response(docs):
+    # Serialize documents as they come off the cursor; the first one is sent
+    # right away, the rest in FLUSH_SIZE chunks
+    def generate():
+        buffer = []
+        size = 0
+        first = True
+        
+        dumps = current_app.json.dumps
+        
+        for doc in docs:
+            line = dumps(doc, separators=(',', ':')) + '\n'
+            buffer.append(line)
+            size += len(line)
+            if first or size >= FLUSH_SIZE:
+                yield ''.join(buffer)
+                buffer = []
+                size = 0
+                first = False
+        
+        if buffer:
+            yield ''.join(buffer)
+    
+    return current_app.response_class(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
@@ -0,0 +1,52 @@
+import math
+import re
+
+# Kilograms per unit. Quantities are stored in kg and prices per kg.
+UNITS = {
+    'kg': 1, 'kgs': 1, 'kilo': 1, 'kilos': 1, 'kilogram': 1, 'kilograms': 1,
+    'كيلو': 1, 'كجم': 1, 'كغ': 1,
+    'g': 0.001, 'gram': 0.001, 'grams': 0.001, 'جرام': 0.001,
+    'quintal': 100, 'quintals': 100,
+    't': 1000, 'ton': 1000, 'tons': 1000, 'tonne': 1000, 'tonnes': 1000, 'طن': 1000,
+}
+
+# "3000", "3,000 kg", "2.5 tons", "12.5 EGP/kg", "3000 per ton"
+MEASURE = re.compile(
+    r'^\s*(?P<number>\d[\d,]*(?:\.\d+)?|\.\d+)\s*'
+    r'(?:egp|le|جنيه)?\s*'
+    r'(?:(?:/|per\s+|a\s+|لكل\s*)?(?P<unit>[^\W\d_]+))?\s*$',
+    re.IGNORECASE
+)
+
+class InvalidMeasure(ValueError):
+    pass
+
+def parse_measure(value, default_unit='kg'):
+    # (number, kg per unit) from a number or a string with an optional unit
+    if isinstance(value, bool):
+        raise InvalidMeasure("must be a number")
+    if isinstance(value, (int, float)):
+        number, unit = float(value), default_unit
+    else:
+        match = MEASURE.match(str(value))
+        if not match:
+            raise InvalidMeasure("must be a number, optionally with a unit (e.g. '12.5/kg')")
+        number = float(match.group('number').replace(',', ''))
+        unit = match.group('unit') or default_unit
+    
+    factor = UNITS.get(unit.casefold())
+    if factor is None:
+        raise InvalidMeasure(f"has an unknown unit '{unit}'")
+    if not math.isfinite(number):
+        raise InvalidMeasure("must be a finite number")
+    if number <= 0:
+        raise InvalidMeasure("must be greater than zero")
+    return number, factor
+
+def quantity_in_kg(value, default_unit='kg'):
+    number, factor = parse_measure(value, default_unit)
+    return round(number * factor, 3)
+
+def price_per_kg(value, default_unit='kg'):
+    number, factor = parse_measure(value, default_unit)
+    return round(number / factor, 4)
\ No newline at end of file
@@ -0,0 +1,140 @@
+import codecs
+import csv
+import io
+import json
+
+CHUNK_SIZE = 64 * 1024
+# Largest single array element buffered while waiting for the rest of it
+MAX_ELEMENT_SIZE = 1024 * 1024
+
+class MalformedUpload(ValueError):
+    pass
+
+class UnsupportedUpload(ValueError):
+    pass
+
+# Rows are yielded one at a time as (row, error) so uploads of any size are
+# processed in constant memory. A row that cannot be parsed has row=None.
+
+def iter_json_array(stream):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    eof = False
+    started = False
+    
+    def read_more():
+        nonlocal buffer, eof
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            eof = True
+            buffer += text_decoder.decode(b'', final=True)
+        else:
+            buffer += text_decoder.decode(chunk)
+    
+    while True:
+        buffer = buffer.lstrip()
+        if not started:
+            if not buffer:
+                if eof:
+                    raise MalformedUpload("Expected a JSON array")
+                read_more()
+                continue
+            if buffer[0] != '[':
+                raise MalformedUpload("Expected a JSON array")
+            buffer = buffer[1:]
+            started = True
+            continue
+        
+        if buffer.startswith(','):
+            buffer = buffer[1:]
+            continue
+        if buffer.startswith(']'):
+            return
+        if not buffer:
+            if eof:
+                raise MalformedUpload("Unterminated JSON array")
+            read_more()
+            continue
+        
+        try:
+            row, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as e:
+            # Only an element cut off by the end of the buffer can be completed
+            # by reading on; an error anywhere else is malformed input, and
+            # buffering the rest of the upload would not fix it
+            truncated = len(buffer) - e.pos <= 16 or e.msg.startswith('Unterminated string')
+            if eof or not truncated:
+                raise MalformedUpload("Invalid JSON array")
+            if len(buffer) > MAX_ELEMENT_SIZE:
+                raise MalformedUpload("Array element is too large")
+            read_more()
+            continue
+        
+        if end == len(buffer) and not eof:
+            # A trailing number may continue in the next chunk
+            read_more()
+            continue
+        
+        buffer = buffer[end:]
+        yield row, None
+
+def iter_ndjson(stream):
+    buffer = b''
+    # Set while skipping the rest of a line that outgrew MAX_ELEMENT_SIZE
+    oversize = False
+    
+    def parse(line):
+        line = line.decode('utf-8').strip()
+        if not line:
+            return None
+        try:
+            return json.loads(line), None
+        except json.JSONDecodeError:
+            return None, "Invalid JSON"
+    
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if oversize:
+                # The end of the oversize line; its row error is already out
+                oversize = False
+                continue
+            row = parse(line)
+            if row is not None:
+                yield row
+        if not oversize and len(buffer) > MAX_ELEMENT_SIZE:
+            oversize = True
+            yield None, "Line is too large"
+        if oversize:
+            buffer = b''
+    
+    if not oversize:
+        row = parse(buffer)
+        if row is not None:
+            yield row
+
+def iter_csv(stream):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+    try:
+        for row in reader:
+            yield row, None
+    except csv.Error as e:
+        raise MalformedUpload(f"Invalid CSV on line {reader.line_num}: {e}")
+
+UPLOAD_FORMATS = {
+    'application/json': iter_json_array,
+    'application/x-ndjson': iter_ndjson,
+    'application/jsonl': iter_ndjson,
+    'text/csv': iter_csv
+}
+
+def iter_upload_rows(request):
+    reader = UPLOAD_FORMATS.get(request.mimetype)
+    if reader is None:
+        raise UnsupportedUpload(f"Content-Type must be one of: {', '.join(UPLOAD_FORMATS)}")
+    return reader(request.stream)
@@ -1,6 +1,50 @@
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, g
 import jwt
+import hashlib
+import time
 from functools import wraps
+from bson import ObjectId
+
+class UserContext:
+    # Per-request view of the authenticated user; the document is loaded
+    # at most once, on first access, and shared by everything in the request
+    def __init__(self, user_id, role):
+        self.id = user_id
+        self.role = role
+        self._user = None
+        self._loaded = False
+    
+    @property
+    def user(self):
+        if not self._loaded:
+            self._user = current_app.db.users.find_one(
+                {"_id": ObjectId(self.id)},
+                {"password": 0}
+            )
+            self._loaded = True
+        return self._user
+
+def current_user():
+    return g.user_context.user
+
+def _decode_token(token):
+    # Verified claims are cached by token digest until the token expires
+    cache = current_app.token_cache
+    if cache is None:
+        return jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+    
+    digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    data = cache.get(digest)
+    if data is not None:
+        return data
+    
+    data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+    ttl = cache.ttl
+    if 'exp' in data:
+        ttl = min(ttl, data['exp'] - time.time())
+    if ttl > 0:
+        cache.set(digest, data, ttl)
+    return data
 
 def verify_token(f):
     @wraps(f)
@@ -14,7 +58,7 @@ def verify_token(f):
             if token.startswith('Bearer '):
                 token = token[7:]
             
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+            data = _decode_token(token)
             current_user_id = data['id']
             current_user_role = data['role']
         except jwt.ExpiredSignatureError:
@@ -22,5 +66,6 @@ def verify_token(f):
         except jwt.InvalidTokenError:
             return jsonify({"error": "Token is invalid"}), 401
         
+        g.user_context = UserContext(current_user_id, current_user_role)
         return f(current_user_id, current_user_role, *args, **kwargs)
-    return decorated
\ No newline at end of file
+    return decorated